@@ -0,0 +1,47 @@
+"""add rooms
+
+Revision ID: b7e4a2c9d130
+Revises: 3f2b8c1d9e47
+Create Date: 2026-10-18 14:03:27.904113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e4a2c9d130'
+down_revision = '3f2b8c1d9e47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('room',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=32), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    # existing messages all belong to the general room, which gets id 1
+    op.execute("INSERT INTO room (name) VALUES ('general')")
+
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('room_id', sa.Integer(), server_default='1', nullable=False))
+        batch_op.create_foreign_key('fk_message_room_id_room', 'room', ['room_id'], ['id'])
+        batch_op.drop_index('ix_message_timestamp_id')
+        batch_op.create_index('ix_message_room_timestamp_id', ['room_id', 'timestamp', 'id'], unique=False)
+
+    # the application always sets the room, the default only filled existing rows
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.alter_column('room_id', server_default=None)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.drop_index('ix_message_room_timestamp_id')
+        batch_op.create_index('ix_message_timestamp_id', ['timestamp', 'id'], unique=False)
+        batch_op.drop_constraint('fk_message_room_id_room', type_='foreignkey')
+        batch_op.drop_column('room_id')
+
+    op.drop_table('room')
@@ -0,0 +1,31 @@
+"""add message search vector
+
+Revision ID: d41c7f0a8e25
+Revises: 5c1e9d7a2b64
+Create Date: 2026-10-18 17:22:54.631087
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41c7f0a8e25'
+down_revision = '5c1e9d7a2b64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # a generated column is computed for the existing rows too; this rewrites the table
+    # and locks it until done, so run it outside peak hours on a large history
+    op.execute(
+        "ALTER TABLE message ADD COLUMN search_vector tsvector "
+        "GENERATED ALWAYS AS (to_tsvector('english', text)) STORED"
+    )
+    op.create_index('ix_message_search_vector', 'message', ['search_vector'], unique=False, postgresql_using='gin')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_message_search_vector', table_name='message', postgresql_using='gin')
+    op.drop_column('message', 'search_vector')
@@ -0,0 +1,106 @@
+"""partition message by month
+
+Revision ID: e8a3b5f17c02
+Revises: d41c7f0a8e25
+Create Date: 2026-10-18 20:41:13.508216
+
+"""
+from datetime import date, datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8a3b5f17c02'
+down_revision = 'd41c7f0a8e25'
+branch_labels = None
+depends_on = None
+
+# months after the current one that get a partition up front; later ones are created
+# by python -m chatcmd.db.archive
+PARTITIONS_AHEAD = 3
+COLUMNS = "id, text, timestamp, user_id, room_id"
+
+
+def _add_months(month: date, count: int) -> date:
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _create_indexes() -> None:
+    op.create_index('ix_message_id', 'message', ['id'], unique=False)
+    op.create_index('ix_message_room_timestamp_id', 'message', ['room_id', 'timestamp', 'id'], unique=False)
+    op.create_index('ix_message_search_vector', 'message', ['search_vector'], unique=False, postgresql_using='gin')
+
+
+def _drop_indexes() -> None:
+    op.drop_index('ix_message_search_vector', table_name='message', postgresql_using='gin')
+    op.drop_index('ix_message_room_timestamp_id', table_name='message')
+    op.drop_index('ix_message_id', table_name='message')
+
+
+# The old table is renamed and emptied into a new partitioned one, which keeps the
+# message ids and their sequence. The primary key of a partitioned table must include
+# the partition key, so it becomes (id, timestamp); ids stay unique through the sequence.
+# The copy holds an exclusive lock on message until it commits.
+def upgrade() -> None:
+    _drop_indexes()
+    op.execute("ALTER TABLE message RENAME TO message_unpartitioned")
+    op.execute("ALTER TABLE message_unpartitioned DROP CONSTRAINT message_pkey")
+    op.execute("ALTER SEQUENCE message_id_seq OWNED BY NONE")
+    op.execute(
+        "CREATE TABLE message ("
+        "id INTEGER NOT NULL DEFAULT nextval('message_id_seq'), "
+        "text VARCHAR NOT NULL, "
+        "timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now(), "
+        "user_id INTEGER NOT NULL, "
+        "room_id INTEGER NOT NULL, "
+        "search_vector tsvector GENERATED ALWAYS AS (to_tsvector('english', text)) STORED, "
+        "CONSTRAINT message_pkey PRIMARY KEY (id, timestamp)"
+        ") PARTITION BY RANGE (timestamp)"
+    )
+
+    oldest = op.get_bind().execute(sa.text("SELECT min(timestamp) FROM message_unpartitioned")).scalar()
+    current = date.today().replace(day=1)
+    month = (oldest or datetime.now()).date().replace(day=1)
+    while month <= _add_months(current, PARTITIONS_AHEAD):
+        op.execute(
+            f"CREATE TABLE message_p{month:%Y_%m} PARTITION OF message "
+            f"FOR VALUES FROM ('{month}') TO ('{_add_months(month, 1)}')"
+        )
+        month = _add_months(month, 1)
+    op.execute("CREATE TABLE message_default PARTITION OF message DEFAULT")
+
+    op.execute(f"INSERT INTO message ({COLUMNS}) SELECT {COLUMNS} FROM message_unpartitioned")
+    op.drop_table('message_unpartitioned')
+    op.execute("ALTER SEQUENCE message_id_seq OWNED BY message.id")
+    # indexes are built once the rows are in, which is faster than updating them per row
+    _create_indexes()
+    op.create_foreign_key('message_user_id_fkey', 'message', 'user', ['user_id'], ['id'])
+    op.create_foreign_key('fk_message_room_id_room', 'message', 'room', ['room_id'], ['id'])
+
+
+# Archived partitions are not restored; import them first if their history is needed.
+def downgrade() -> None:
+    _drop_indexes()
+    op.execute("ALTER TABLE message RENAME TO message_partitioned")
+    op.execute("ALTER TABLE message_partitioned DROP CONSTRAINT message_pkey")
+    op.execute("ALTER SEQUENCE message_id_seq OWNED BY NONE")
+    op.execute(
+        "CREATE TABLE message ("
+        "id INTEGER NOT NULL DEFAULT nextval('message_id_seq'), "
+        "text VARCHAR NOT NULL, "
+        "timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now(), "
+        "user_id INTEGER NOT NULL, "
+        "room_id INTEGER NOT NULL, "
+        "search_vector tsvector GENERATED ALWAYS AS (to_tsvector('english', text)) STORED, "
+        "CONSTRAINT message_pkey PRIMARY KEY (id)"
+        ")"
+    )
+    op.execute(f"INSERT INTO message ({COLUMNS}) SELECT {COLUMNS} FROM message_partitioned")
+    op.drop_table('message_partitioned')
+    op.execute("ALTER SEQUENCE message_id_seq OWNED BY message.id")
+    _create_indexes()
+    op.create_foreign_key('message_user_id_fkey', 'message', 'user', ['user_id'], ['id'])
+    op.create_foreign_key('fk_message_room_id_room', 'message', 'room', ['room_id'], ['id'])
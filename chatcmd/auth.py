@@ -0,0 +1,94 @@
+import base64
+import hashlib
+import hmac
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+
+class CachedUser(NamedTuple):
+    id: int
+    password_hash: str
+    expires: float
+
+
+# Users looked up at CONNECT, so a client that reconnects within `ttl` seconds skips the
+# database. Least recently used entries are evicted beyond `capacity`; a password change
+# must invalidate the entry.
+class UserCache:
+    def __init__(self, ttl: float = 300, capacity: int = 10_000):
+        self._users: OrderedDict[str, CachedUser] = OrderedDict()
+        self._ttl = ttl
+        self._capacity = capacity
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def get(self, name: str) -> CachedUser | None:
+        user = self._users.get(name)
+        if user is None or user.expires < time.monotonic():
+            if user:
+                del self._users[name]
+            self.misses += 1
+            return None
+        self._users.move_to_end(name)
+        self.hits += 1
+        return user
+
+    def put(self, name: str, user_id: int, password_hash: str) -> CachedUser:
+        user = CachedUser(user_id, password_hash, time.monotonic() + self._ttl)
+        if self._ttl > 0:
+            self._users[name] = user
+            self._users.move_to_end(name)
+            if len(self._users) > self._capacity:
+                self._users.popitem(last=False)
+        return user
+
+    def invalidate(self, name: str):
+        self._users.pop(name, None)
+
+    def stats(self) -> dict[str, int]:
+        return {"size": len(self), "hits": self.hits, "misses": self.misses}
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def _unb64(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+# Signed "name|expiry" tokens that let a client reconnect without sending its password,
+# so the server skips the bcrypt verify. The signature also covers the user's password
+# hash, so changing the password revokes every token issued before.
+class ResumeTokens:
+    def __init__(self, secret: bytes, ttl: float):
+        self._secret = secret
+        self._ttl = ttl
+
+    def issue(self, name: str, password_hash: str) -> str:
+        payload = f"{name}|{int(time.time() + self._ttl)}"
+        return f"{_b64(payload.encode())}.{_b64(self._sign(payload, password_hash))}"
+
+    def verify(self, token: str, name: str, password_hash: str) -> bool:
+        try:
+            payload, signature = token.split(".")
+            payload = _unb64(payload).decode()
+            token_name, expires = payload.rsplit("|", 1)
+            expired = int(expires) < time.time()
+            signature = _unb64(signature)
+        except ValueError:
+            return False
+        expected = self._sign(payload, password_hash)
+        return (
+            hmac.compare_digest(signature, expected)
+            and token_name == name
+            and not expired
+        )
+
+    def _sign(self, payload: str, password_hash: str) -> bytes:
+        message = f"{payload}|{password_hash}".encode()
+        return hmac.new(self._secret, message, hashlib.sha256).digest()
@@ -0,0 +1,92 @@
+"""Measure how much simultaneous logins stall the event loop.
+
+Runs N concurrent password verifications twice: inline on the event loop, the way
+Database.login_user used to call bcrypt, and through PasswordHasher. A ticker task
+sleeps 1 ms at a time and records how late it wakes up; the gaps are the time every
+other connected client would have been frozen.
+
+    python -m chatcmd.bench.auth_stall --logins 500 --rounds 12
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from passlib.hash import bcrypt
+
+from ..db.pwd import PasswordHasher, verify_password
+
+PASSWORD = "abc123!@#"
+TICK = 0.001
+
+
+async def measure_stall(logins: int, verify) -> dict:
+    lags: list[float] = []
+    done = asyncio.Event()
+
+    async def ticker():
+        loop = asyncio.get_running_loop()
+        while not done.is_set():
+            start = loop.time()
+            await asyncio.sleep(TICK)
+            lags.append(loop.time() - start - TICK)
+
+    ticker_task = asyncio.create_task(ticker())
+    await asyncio.sleep(TICK)
+    start = time.perf_counter()
+    await asyncio.gather(*(verify() for _ in range(logins)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await ticker_task
+
+    lags.sort()
+    return {
+        "wall_time_s": round(elapsed, 3),
+        "max_stall_ms": round(lags[-1] * 1000, 2),
+        "p99_stall_ms": round(lags[int(len(lags) * 0.99)] * 1000, 2),
+        "total_stall_s": round(sum(lag for lag in lags if lag > TICK), 3),
+    }
+
+
+async def run(logins: int, rounds: int, executor: str, concurrency: int) -> dict:
+    pwd_hash = bcrypt.using(rounds=rounds).hash(PASSWORD)
+
+    async def inline():
+        verify_password(PASSWORD, pwd_hash)
+
+    pool = ThreadPoolExecutor(concurrency) if executor == "thread" else None
+    hasher = PasswordHasher(pool, concurrency)
+    # start the workers up front so pool creation isn't counted as a stall
+    await hasher.verify(PASSWORD, pwd_hash)
+
+    async def offloaded():
+        await hasher.verify(PASSWORD, pwd_hash)
+
+    try:
+        return {
+            "logins": logins,
+            "bcrypt_rounds": rounds,
+            "executor": executor,
+            "concurrency": concurrency,
+            "before": await measure_stall(logins, inline),
+            "after": await measure_stall(logins, offloaded),
+        }
+    finally:
+        hasher.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m chatcmd.bench.auth_stall")
+    parser.add_argument("--logins", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=12)
+    parser.add_argument("--executor", choices=["process", "thread"], default="process")
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+    result = asyncio.run(run(args.logins, args.rounds, args.executor, args.concurrency))
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+"""Load-test the chat server with simulated clients and report latencies as JSON.
+
+Starts `python -m chatcmd.server run_local` (or targets a server that is already
+running), connects --clients simulated users speaking the text protocol, and runs three
+phases:
+
+  connect   CONNECT with a fresh account, timed until the welcome line arrives
+  messages  --senders clients each send --messages lines, waiting for the ACK of one
+            before sending the next; every client records when each line reaches it
+  history   every client requests `\\LOAD --load-size` for the newest messages
+
+then every client sends `\\q`. Clients PING the server while connected, so runs longer
+than its idle timeout don't lose quiet clients to the idle sweep. The server's RSS,
+including worker and hasher child processes, is sampled throughout. Latencies are
+measured in this process, so run the generator on a machine (or cores) that the server
+isn't starved of.
+
+    python -m chatcmd.bench --clients 2000 --senders 200 --messages 20 --output run.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from collections import deque
+from datetime import datetime
+
+from ..db.db_queries import encode_cursor
+
+PASSWORD = "abc123!@#"
+PROBE_INTERVAL = 0.1
+# seconds between PINGs; well under the server's default idle timeout of 60
+HEARTBEAT_INTERVAL = 20
+
+
+class Samples:
+    def __init__(self):
+        self.values: list[float] = []
+
+    def add(self, seconds: float):
+        self.values.append(seconds)
+
+    def summary(self) -> dict:
+        values = sorted(self.values)
+        if not values:
+            return {"count": 0}
+
+        def percentile(p: float) -> float:
+            return round(values[min(int(len(values) * p), len(values) - 1)] * 1000, 3)
+
+        return {
+            "count": len(values),
+            "p50": percentile(0.5),
+            "p90": percentile(0.9),
+            "p99": percentile(0.99),
+            "max": round(values[-1] * 1000, 3),
+        }
+
+
+class Stats:
+    def __init__(self):
+        self.connect = Samples()
+        self.ack = Samples()
+        self.broadcast = Samples()
+        self.history = Samples()
+        # send time of every benchmark message, by id
+        self.sent: dict[int, float] = {}
+        self.deliveries = 0
+
+
+class SimulatedClient:
+    def __init__(self, name: str, stats: Stats):
+        self.name = name
+        self._stats = stats
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+        self._task: asyncio.Task | None = None
+        self._heartbeat: asyncio.Task | None = None
+        # every command is acknowledged in order; \LOAD is then followed by a \PACK
+        self._pending_acks: deque[tuple[float, asyncio.Future | None]] = deque()
+        self._pending_loads: deque[tuple[float, asyncio.Future]] = deque()
+
+    async def connect(self, host: str, port: int):
+        start = time.perf_counter()
+        self._reader, self._writer = await asyncio.open_connection(host, port)
+        self._writer.write(f"CONNECT {self.name} {PASSWORD}\n".encode())
+        while not (line := await self._reader.readline()).startswith(b"Welcome!"):
+            if not line or line == b"Invalid credentials.\n":
+                raise ConnectionError(f"{self.name} was rejected")
+        self._stats.connect.add(time.perf_counter() - start)
+        self._task = asyncio.create_task(self._read_loop())
+        self._heartbeat = asyncio.create_task(self._ping())
+
+    async def send_message(self, message_id: int):
+        acked = asyncio.get_running_loop().create_future()
+        now = time.perf_counter()
+        self._stats.sent[message_id] = now
+        self._pending_acks.append((now, acked))
+        self._writer.write(f"bench {message_id}\n".encode())
+        await acked
+
+    async def load_history(self, amount: int):
+        loaded = asyncio.get_running_loop().create_future()
+        cursor = encode_cursor((datetime.now(), 0))
+        now = time.perf_counter()
+        self._pending_acks.append((now, None))
+        self._pending_loads.append((now, loaded))
+        self._writer.write(f"\\LOAD {amount} {cursor}\n".encode())
+        await loaded
+
+    async def quit(self):
+        if self._writer is None:
+            return
+        if self._heartbeat:
+            self._heartbeat.cancel()
+        try:
+            self._writer.write(b"\\q\n")
+            await self._writer.drain()
+        except ConnectionError:
+            pass
+        self._writer.close()
+        if self._task:
+            self._task.cancel()
+
+    # PINGs are never acknowledged, so they don't disturb the ACK bookkeeping.
+    async def _ping(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            self._writer.write(b"\\PING\n")
+
+    async def _read_loop(self):
+        while line := await self._reader.readline():
+            now = time.perf_counter()
+            if line == b"\\ACK\n":
+                sent, acked = self._pending_acks.popleft()
+                if acked:
+                    self._stats.ack.add(now - sent)
+                    acked.set_result(None)
+            elif line.startswith(b"\\PACK "):
+                sent, loaded = self._pending_loads.popleft()
+                self._stats.history.add(now - sent)
+                loaded.set_result(None)
+            elif b": bench " in line:
+                message_id = int(line.rsplit(b" ", 1)[1])
+                self._stats.broadcast.add(now - self._stats.sent[message_id])
+                self._stats.deliveries += 1
+        for _, future in [*self._pending_acks, *self._pending_loads]:
+            if future and not future.done():
+                future.set_exception(ConnectionError(f"{self.name} disconnected"))
+
+
+# Resident memory of a process and all of its descendants, from /proc (Linux only).
+def rss_bytes(pid: int) -> int:
+    total = 0
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    total += int(line.split()[1]) * 1024
+        for tid in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{tid}/children") as children:
+                total += sum(rss_bytes(int(child)) for child in children.read().split())
+    except (FileNotFoundError, ProcessLookupError):
+        pass
+    return total
+
+
+async def sample_rss(pid: int, samples: list[int], interval: float = 0.25):
+    while True:
+        samples.append(rss_bytes(pid))
+        await asyncio.sleep(interval)
+
+
+async def wait_for_server(
+    host: str, port: int, timeout: float, interval: float = PROBE_INTERVAL
+):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(interval)
+
+
+async def connect_clients(
+    args: argparse.Namespace, stats: Stats
+) -> tuple[list[SimulatedClient], int, float]:
+    semaphore = asyncio.Semaphore(args.connect_concurrency)
+    failed = 0
+
+    async def connect(client: SimulatedClient):
+        nonlocal failed
+        async with semaphore:
+            try:
+                await client.connect(args.host, args.port)
+                return client
+            except OSError:
+                failed += 1
+
+    clients = [
+        SimulatedClient(f"{args.prefix}{i:05d}", stats) for i in range(args.clients)
+    ]
+    start = time.perf_counter()
+    connected = await asyncio.gather(*(connect(client) for client in clients))
+    return [c for c in connected if c], failed, time.perf_counter() - start
+
+
+async def send_messages(args: argparse.Namespace, clients: list[SimulatedClient]):
+    async def sender(index: int, client: SimulatedClient):
+        for i in range(args.messages):
+            await client.send_message(index * args.messages + i)
+            if args.interval:
+                await asyncio.sleep(args.interval)
+
+    await asyncio.gather(
+        *(sender(i, client) for i, client in enumerate(clients[: args.senders]))
+    )
+
+
+async def run(args: argparse.Namespace, server_pid: int | None) -> dict:
+    stats = Stats()
+    rss: list[int] = []
+    sampler = None
+    if server_pid:
+        sampler = asyncio.create_task(sample_rss(server_pid, rss))
+        await asyncio.sleep(0)
+
+    clients, failed, connect_time = await connect_clients(args, stats)
+    try:
+        start = time.perf_counter()
+        await send_messages(args, clients)
+        send_time = time.perf_counter() - start
+        # broadcasts may still be on their way to slower clients
+        expected = len(stats.sent) * len(clients)
+        deadline = time.monotonic() + args.drain_timeout
+        while stats.deliveries < expected and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        delivery_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(client.load_history(args.load_size) for client in clients)
+        )
+        history_time = time.perf_counter() - start
+    finally:
+        await asyncio.gather(*(client.quit() for client in clients))
+        if sampler:
+            sampler.cancel()
+            rss.append(rss_bytes(server_pid))
+
+    acked = stats.ack.summary()["count"]
+    result = {
+        "config": {
+            "clients": args.clients,
+            "senders": min(args.senders, len(clients)),
+            "messages_per_sender": args.messages,
+            "interval_s": args.interval,
+            "server_args": args.server_args,
+        },
+        "connect": {
+            "connected": len(clients),
+            "failed": failed,
+            "wall_time_s": round(connect_time, 3),
+            "per_second": round(len(clients) / connect_time, 1),
+            "latency_ms": stats.connect.summary(),
+        },
+        "messages": {
+            "sent": len(stats.sent),
+            "acked": acked,
+            "wall_time_s": round(send_time, 3),
+            "per_second": round(acked / send_time, 1),
+            "ack_latency_ms": stats.ack.summary(),
+            "deliveries": stats.deliveries,
+            "expected_deliveries": expected,
+            "deliveries_per_second": round(stats.deliveries / delivery_time, 1),
+            "broadcast_latency_ms": stats.broadcast.summary(),
+        },
+        "history": {
+            "wall_time_s": round(history_time, 3),
+            "latency_ms": stats.history.summary(),
+        },
+    }
+    if rss:
+        result["server_rss_mb"] = {
+            "start": round(rss[0] / 2**20, 1),
+            "peak": round(max(rss) / 2**20, 1),
+            "end": round(rss[-1] / 2**20, 1),
+        }
+    return result
+
+
+# Thousands of sockets need more descriptors than the usual soft limit of 1024.
+def raise_open_files_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def start_server(args: argparse.Namespace) -> subprocess.Popen:
+    command = [sys.executable, "-m", "chatcmd.server", "run_local"]
+    return subprocess.Popen(
+        command + args.server_args.split(),
+        stdout=subprocess.DEVNULL,
+        stderr=None if args.server_stderr else subprocess.DEVNULL,
+    )
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m chatcmd.bench")
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument(
+        "--senders",
+        type=int,
+        default=100,
+        help="how many of the clients send messages",
+    )
+    parser.add_argument("--messages", type=int, default=10, help="per sender")
+    parser.add_argument(
+        "--interval", type=float, default=0, help="pause after each ACK, seconds"
+    )
+    parser.add_argument("--load-size", type=int, default=20)
+    parser.add_argument("--connect-concurrency", type=int, default=100)
+    parser.add_argument("--drain-timeout", type=float, default=10)
+    parser.add_argument("--prefix", default="bench", help="username prefix")
+    parser.add_argument("--host", default="127.0.0.2")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--server-args",
+        default="",
+        help='extra arguments for the spawned server, e.g. "--workers 4"',
+    )
+    parser.add_argument(
+        "--no-server",
+        action="store_true",
+        help="benchmark a server that is already running instead of starting one",
+    )
+    parser.add_argument(
+        "--server-pid", type=int, help="pid to sample RSS from with --no-server"
+    )
+    parser.add_argument("--server-stderr", action="store_true")
+    parser.add_argument("--output", help="write the JSON report here")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    # the spawned server inherits the raised limit
+    raise_open_files_limit()
+    server = None if args.no_server else start_server(args)
+    server_pid = server.pid if server else args.server_pid
+    try:
+        asyncio.run(wait_for_server(args.host, args.port, timeout=30))
+        result = asyncio.run(run(args, server_pid))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    report = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(report + "\n")
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""Measure cold start and per-connection overhead of the chat server as JSON.
+
+  import       time to import chatcmd.server and chatcmd.client in a fresh interpreter,
+               and whether that pulled in the sqlite test backend
+  startup      from spawning `python -m chatcmd.server run_local` until it accepts
+               connections, over --runs fresh servers
+  connections  --connections sockets that connect and stay idle: time to open them all
+               and server RSS per connection
+  logins       --logins new users doing CONNECT, timed until the welcome line, and
+               server RSS per logged-in client
+
+The startup, connections and logins phases run once per event loop given with --loop,
+by default the standard library loop and uvloop when it is installed.
+
+    python -m chatcmd.bench.startup --connections 2000 --output startup.json
+"""
+
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import time
+
+from ..eventloop import uvloop_available
+from .load import (
+    SimulatedClient,
+    Samples,
+    Stats,
+    raise_open_files_limit,
+    rss_bytes,
+    wait_for_server,
+)
+
+HOST = "127.0.0.2"
+PORT = 8000
+# the server's RSS is sampled after connections settle for this long
+SETTLE_TIME = 0.5
+# at least the server's --auth-concurrency
+WARMUP_LOGINS = 8
+
+IMPORT_PROBE = """
+import sys, time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start, "tests.database" in sys.modules)
+"""
+
+
+def time_import(module: str, runs: int) -> dict:
+    samples = Samples()
+    loaded_backend = False
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-c", IMPORT_PROBE.format(module=module)],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        seconds, loaded = result.stdout.split()
+        samples.add(float(seconds))
+        loaded_backend |= loaded == "True"
+    return {"latency_ms": samples.summary(), "loads_sqlite_backend": loaded_backend}
+
+
+def start_server(args: argparse.Namespace, loop: str) -> subprocess.Popen:
+    command = [sys.executable, "-m", "chatcmd.server", "run_local", "--loop", loop]
+    return subprocess.Popen(
+        command + args.server_args.split(),
+        stdout=subprocess.DEVNULL,
+        stderr=None if args.server_stderr else subprocess.DEVNULL,
+    )
+
+
+def stop_server(server: subprocess.Popen):
+    server.terminate()
+    server.wait()
+
+
+async def time_startup(
+    args: argparse.Namespace, loop: str, samples: Samples
+) -> subprocess.Popen:
+    start = time.perf_counter()
+    server = start_server(args, loop)
+    try:
+        await wait_for_server(HOST, PORT, timeout=30, interval=0.002)
+    except OSError:
+        stop_server(server)
+        raise
+    samples.add(time.perf_counter() - start)
+    return server
+
+
+async def open_idle_connections(count: int, concurrency: int) -> tuple[list, float]:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def connect():
+        async with semaphore:
+            return (await asyncio.open_connection(HOST, PORT))[1]
+
+    start = time.perf_counter()
+    writers = await asyncio.gather(*(connect() for _ in range(count)))
+    return writers, time.perf_counter() - start
+
+
+async def measure_connections(args: argparse.Namespace, pid: int) -> dict:
+    await asyncio.sleep(SETTLE_TIME)
+    before = rss_bytes(pid)
+    writers, elapsed = await open_idle_connections(
+        args.connections, args.connect_concurrency
+    )
+    await asyncio.sleep(SETTLE_TIME)
+    after = rss_bytes(pid)
+    for writer in writers:
+        writer.close()
+    return {
+        "connections": len(writers),
+        "wall_time_s": round(elapsed, 3),
+        "per_second": round(len(writers) / elapsed, 1),
+        "rss_bytes_per_connection": round((after - before) / len(writers)),
+    }
+
+
+async def measure_logins(args: argparse.Namespace, pid: int) -> dict:
+    # concurrent logins start all of the password hashing processes, which are not
+    # per client
+    warmup = [SimulatedClient(f"warmup{i}", Stats()) for i in range(WARMUP_LOGINS)]
+    await asyncio.gather(*(client.connect(HOST, PORT) for client in warmup))
+    await asyncio.gather(*(client.quit() for client in warmup))
+    stats = Stats()
+    clients = [SimulatedClient(f"start{i:05d}", stats) for i in range(args.logins)]
+    await asyncio.sleep(SETTLE_TIME)
+    before = rss_bytes(pid)
+    start = time.perf_counter()
+    semaphore = asyncio.Semaphore(args.connect_concurrency)
+
+    async def connect(client: SimulatedClient):
+        async with semaphore:
+            await client.connect(HOST, PORT)
+
+    try:
+        await asyncio.gather(*(connect(client) for client in clients))
+        elapsed = time.perf_counter() - start
+        await asyncio.sleep(SETTLE_TIME)
+        after = rss_bytes(pid)
+    finally:
+        await asyncio.gather(*(client.quit() for client in clients))
+    return {
+        "logins": len(clients),
+        "wall_time_s": round(elapsed, 3),
+        "latency_ms": stats.connect.summary(),
+        "rss_bytes_per_client": round((after - before) / len(clients)),
+    }
+
+
+async def run_loop(args: argparse.Namespace, loop: str) -> dict:
+    startup = Samples()
+    for _ in range(args.runs - 1):
+        stop_server(await time_startup(args, loop, startup))
+    # the last server is kept for the connection phases
+    server = await time_startup(args, loop, startup)
+    try:
+        result = {"startup_ms": startup.summary()}
+        if args.connections:
+            result["idle_connections"] = await measure_connections(args, server.pid)
+        if args.logins:
+            result["logins"] = await measure_logins(args, server.pid)
+        return result
+    finally:
+        stop_server(server)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m chatcmd.bench.startup")
+    parser.add_argument(
+        "--loop",
+        action="append",
+        choices=["asyncio", "uvloop"],
+        help="event loop to measure, may be repeated",
+    )
+    parser.add_argument("--runs", type=int, default=5, help="server starts per loop")
+    parser.add_argument("--import-runs", type=int, default=5)
+    parser.add_argument("--connections", type=int, default=1000)
+    parser.add_argument("--logins", type=int, default=50)
+    parser.add_argument("--connect-concurrency", type=int, default=100)
+    parser.add_argument(
+        "--server-args",
+        default="",
+        help="extra arguments for the spawned server",
+    )
+    parser.add_argument("--server-stderr", action="store_true")
+    parser.add_argument("--output", help="write the JSON report here")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    loops = args.loop or ["asyncio"] + (["uvloop"] if uvloop_available() else [])
+    raise_open_files_limit()
+    result = {
+        "import": {
+            module: time_import(module, args.import_runs)
+            for module in ("chatcmd.server", "chatcmd.client")
+        },
+        "loops": {loop: asyncio.run(run_loop(args, loop)) for loop in loops},
+    }
+
+    report = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(report + "\n")
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+import asyncio
+import logging
+import time
+from asyncio import StreamWriter
+from enum import Enum
+from typing import Awaitable, Callable, Collection, Iterable
+
+from .frames import Frame
+from .metrics import Histogram
+from .protocol import TEXT, FramedCodec, TextCodec
+
+
+class OverflowPolicy(Enum):
+    DROP_OLDEST = "drop_oldest"
+    DISCONNECT = "disconnect"
+    BLOCK = "block"
+
+
+# asyncio's defaults; the transport stops taking writes above the high watermark until
+# the peer has read it down below the low one
+HIGH_WATER = 64 * 1024
+LOW_WATER = 16 * 1024
+# recipients per broadcast
+FANOUT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10_000)
+
+
+# Bounded queue of encoded frames for a single client, drained by its own writer task,
+# so a slow client only ever delays itself. Frames are encoded with the client's codec,
+# which is cached on the frame, so each event is encoded once per codec.
+class Outbox:
+    def __init__(
+        self,
+        writer: StreamWriter,
+        maxsize: int,
+        policy: OverflowPolicy,
+        on_error: Callable[[], None],
+        codec: TextCodec | FramedCodec = TEXT,
+        high_water: int = HIGH_WATER,
+        low_water: int = LOW_WATER,
+    ):
+        self._writer = writer
+        self.codec = codec
+        self._queue: asyncio.Queue[bytes] = asyncio.Queue(maxsize)
+        self._policy = policy
+        self._on_error = on_error
+        self._high_water = high_water
+        writer.transport.set_write_buffer_limits(high_water, low_water)
+        self.dropped = 0
+        self.queued_bytes = 0
+        # drains that had to wait for the peer, and the longest of them in seconds
+        self.stalls = 0
+        self.max_drain = 0.0
+        # loop time the pending drain started waiting, None while the peer keeps up
+        self.behind_since: float | None = None
+        # set once nothing will be written any more, releases senders waiting in put()
+        self._closed = asyncio.Event()
+        self._task = asyncio.create_task(self._write_loop())
+
+    @property
+    def closed(self) -> bool:
+        return self._closed.is_set()
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    # Seconds the client has been unable to take more data.
+    def lag(self) -> float:
+        if self.behind_since is None:
+            return 0.0
+        return asyncio.get_running_loop().time() - self.behind_since
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.qsize(),
+            "queued_bytes": self.queued_bytes,
+            "transport_bytes": self._writer.transport.get_write_buffer_size(),
+            "dropped": self.dropped,
+            "stalls": self.stalls,
+            "max_drain_ms": round(self.max_drain * 1000, 3),
+            "lag_ms": round(self.lag() * 1000, 3),
+        }
+
+    # Enqueue without waiting; returns False if the frame was not accepted.
+    def offer(self, frame: Frame) -> bool:
+        data = frame.encode(self.codec)
+        try:
+            self._queue.put_nowait(data)
+            self.queued_bytes += len(data)
+            return True
+        except asyncio.QueueFull:
+            if self._policy != OverflowPolicy.DROP_OLDEST:
+                return False
+        self.queued_bytes -= len(self._queue.get_nowait())
+        self._queue.task_done()
+        self._queue.put_nowait(data)
+        self.queued_bytes += len(data)
+        self.dropped += 1
+        return True
+
+    # Wait for room in the queue; the frame is dropped if the outbox closes meanwhile.
+    async def put(self, frame: Frame):
+        data = frame.encode(self.codec)
+        if self.closed:
+            return
+        try:
+            self._queue.put_nowait(data)
+            self.queued_bytes += len(data)
+            return
+        except asyncio.QueueFull:
+            pass
+        put = asyncio.ensure_future(self._queue.put(data))
+        closed = asyncio.ensure_future(self._closed.wait())
+        try:
+            await asyncio.wait((put, closed), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            closed.cancel()
+            if put.done() and not put.cancelled():
+                self.queued_bytes += len(data)
+            else:
+                put.cancel()
+
+    async def _write_loop(self):
+        loop = asyncio.get_running_loop()
+        transport = self._writer.transport
+        try:
+            while True:
+                frames = [await self._queue.get()]
+                while not self._queue.empty():
+                    frames.append(self._queue.get_nowait())
+                self._writer.writelines(frames)
+                self.queued_bytes -= sum(map(len, frames))
+                # drain() only waits once the transport is above the high watermark
+                if transport.get_write_buffer_size() > self._high_water:
+                    self.stalls += 1
+                    self.behind_since = loop.time()
+                    await self._writer.drain()
+                    self.max_drain = max(self.max_drain, self.lag())
+                    self.behind_since = None
+                else:
+                    await self._writer.drain()
+                for _ in frames:
+                    self._queue.task_done()
+        except Exception as e:
+            logging.exception("Could not write to client.", exc_info=e)
+            self._closed.set()
+            self._on_error()
+
+    async def close(self, flush_timeout: float = 1.0):
+        flushed = False
+        self._closed.set()
+        if not self._task.done() and flush_timeout > 0:
+            try:
+                await asyncio.wait_for(self._queue.join(), flush_timeout)
+                flushed = True
+            except asyncio.exceptions.TimeoutError:
+                pass
+        self._task.cancel()
+        try:
+            if flushed:
+                self._writer.close()
+                await self._writer.wait_closed()
+            else:
+                # a graceful close would wait for the stalled peer to take the send buffer
+                self._writer.transport.abort()
+        except Exception as e:
+            logging.exception("Error closing client writer, ignoring.", exc_info=e)
+
+
+# Fans encoded frames out to every registered client's outbox without awaiting any writer.
+# Clients that could not take any data for `max_lag` seconds are disconnected whatever
+# the overflow policy, 0 keeps them.
+class Broadcaster:
+    def __init__(
+        self,
+        on_disconnect: Callable[[str], Awaitable[None]],
+        queue_size: int = 256,
+        policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST,
+        high_water: int = HIGH_WATER,
+        low_water: int = LOW_WATER,
+        max_lag: float = 0,
+    ):
+        self._outboxes: dict[str, Outbox] = {}
+        self._on_disconnect = on_disconnect
+        self._queue_size = queue_size
+        self._policy = policy
+        self._high_water = high_water
+        self._low_water = low_water
+        self._max_lag = max_lag
+        self.evicted = 0
+        # time to enqueue a broadcast for every recipient, and how many there were
+        self.fanout_time = Histogram()
+        self.fanout_size = Histogram(FANOUT_BUCKETS)
+
+    def __len__(self) -> int:
+        return len(self._outboxes)
+
+    def __contains__(self, username: str) -> bool:
+        return username in self._outboxes
+
+    # Number of frames discarded for the user under the drop-oldest policy.
+    def dropped(self, username: str) -> int:
+        outbox = self._outboxes.get(username)
+        return outbox.dropped if outbox else 0
+
+    # Buffer stats of the `limit` clients with the most data waiting, most first.
+    def client_stats(self, limit: int | None = None) -> dict[str, dict]:
+        stats = sorted(
+            ((username, outbox.stats()) for username, outbox in self._outboxes.items()),
+            key=lambda item: item[1]["queued_bytes"] + item[1]["transport_bytes"],
+            reverse=True,
+        )
+        return dict(stats[:limit])
+
+    # Register a new outbox for the user, replacing and closing the one of an earlier
+    # connection under the same name.
+    def add(
+        self,
+        username: str,
+        writer: StreamWriter,
+        codec: TextCodec | FramedCodec = TEXT,
+    ) -> Outbox:
+        def on_error():
+            asyncio.create_task(self._disconnect(username, outbox))
+
+        old = self._outboxes.get(username)
+        outbox = self._outboxes[username] = Outbox(
+            writer,
+            self._queue_size,
+            self._policy,
+            on_error,
+            codec,
+            self._high_water,
+            self._low_water,
+        )
+        if old:
+            asyncio.create_task(old.close(flush_timeout=0))
+        return outbox
+
+    # Close `outbox`, or the user's current one if None. It is unregistered only if it is
+    # still the user's current outbox; returns whether it was.
+    async def remove(
+        self, username: str, flush_timeout: float = 1.0, outbox: Outbox | None = None
+    ) -> bool:
+        current = self._outboxes.get(username)
+        outbox = outbox or current
+        if outbox is None:
+            return False
+        if outbox is current:
+            del self._outboxes[username]
+        await outbox.close(flush_timeout)
+        return outbox is current
+
+    async def send(self, username: str, frame: Frame):
+        if outbox := self._outboxes.get(username):
+            await self._offer([(username, outbox)], frame)
+
+    # Enqueue the frame for `recipients`, or for everyone if None.
+    async def broadcast(self, frame: Frame, recipients: Iterable[str] | None = None):
+        start = time.perf_counter()
+        if recipients is None:
+            outboxes = self._outboxes.items()
+        else:
+            outboxes = [
+                (username, self._outboxes[username])
+                for username in recipients
+                if username in self._outboxes
+            ]
+        await self._offer(outboxes, frame)
+        self.fanout_size.observe(len(outboxes))
+        self.fanout_time.observe(time.perf_counter() - start)
+
+    async def _offer(self, outboxes: Collection[tuple[str, Outbox]], frame: Frame):
+        lagging = []
+        overflowed = []
+        # behind_since is None for every client that keeps up, a cheap check per frame
+        deadline = asyncio.get_running_loop().time() - self._max_lag
+        for username, outbox in outboxes:
+            behind_since = outbox.behind_since
+            if self._max_lag and behind_since is not None and behind_since < deadline:
+                lagging.append((username, outbox))
+            elif not outbox.offer(frame):
+                overflowed.append((username, outbox))
+        for username, outbox in lagging:
+            logging.error(f"{username} is too far behind, disconnecting.")
+            self.evicted += 1
+            await self._disconnect(username, outbox)
+        if overflowed:
+            await self._handle_overflow(overflowed, frame)
+
+    async def _handle_overflow(
+        self, overflowed: list[tuple[str, Outbox]], frame: Frame
+    ):
+        # the outboxes of clients disconnected while lagging ones were being removed
+        overflowed = [
+            (username, outbox) for username, outbox in overflowed if not outbox.closed
+        ]
+        if self._policy == OverflowPolicy.BLOCK:
+            await asyncio.gather(
+                *(self._put(username, outbox, frame) for username, outbox in overflowed)
+            )
+            return
+        for username, outbox in overflowed:
+            logging.error(f"Outbound queue of {username} is full, disconnecting.")
+            await self._disconnect(username, outbox)
+
+    # Under the block policy the sender waits for room, but no longer than `max_lag`: a
+    # client that took nothing for that long is evicted like in _offer.
+    async def _put(self, username: str, outbox: Outbox, frame: Frame):
+        if not self._max_lag:
+            await outbox.put(frame)
+            return
+        try:
+            await asyncio.wait_for(outbox.put(frame), self._max_lag)
+        except asyncio.exceptions.TimeoutError:
+            if self._outboxes.get(username) is outbox:
+                logging.error(f"{username} is too far behind, disconnecting.")
+                self.evicted += 1
+                await self._disconnect(username, outbox)
+
+    # A replaced outbox is only closed; the user reconnected meanwhile and stays.
+    async def _disconnect(self, username: str, outbox: Outbox):
+        # pending frames can't be delivered anyway, so don't wait for them
+        if await self.remove(username, flush_timeout=0, outbox=outbox):
+            await self._on_disconnect(username)
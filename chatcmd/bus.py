@@ -0,0 +1,128 @@
+import asyncio
+import json
+import logging
+import os
+from asyncio import StreamReader, StreamWriter
+from typing import Awaitable, Callable
+
+# Local pub/sub bus for worker processes. Every worker keeps one connection to a hub
+# on a Unix domain socket and publishes newline-delimited JSON events; the hub relays
+# each event to all other workers. The hub also remembers how many users each worker
+# has online, so a worker that joins late still learns the global presence count.
+
+
+class BusHub:
+    def __init__(self, path: str):
+        self._path = path
+        self._workers: dict[int, StreamWriter] = {}
+        self._handlers: set[asyncio.Task] = set()
+        self.presence: dict[int, int] = {}
+        self._server: asyncio.AbstractServer | None = None
+
+    async def start(self):
+        if os.path.exists(self._path):
+            os.unlink(self._path)
+        self._server = await asyncio.start_unix_server(
+            self._worker_connected, self._path
+        )
+
+    async def close(self):
+        if self._server:
+            self._server.close()
+        for writer in list(self._workers.values()):
+            writer.close()
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+        if os.path.exists(self._path):
+            os.unlink(self._path)
+
+    async def _worker_connected(self, reader: StreamReader, writer: StreamWriter):
+        task = asyncio.current_task()
+        self._handlers.add(task)
+        task.add_done_callback(self._handlers.discard)
+        hello = await reader.readline()
+        if not hello:
+            writer.close()
+            return
+        worker = json.loads(hello)["worker"]
+        self._workers[worker] = writer
+        for other, count in self.presence.items():
+            writer.write(_encode({"type": "presence", "worker": other, "count": count}))
+
+        try:
+            while line := await reader.readline():
+                event = json.loads(line)
+                if event["type"] == "presence":
+                    self.presence[worker] = event["count"]
+                self._relay(worker, line)
+        except Exception as e:
+            logging.exception(f"Error reading from worker {worker}.", exc_info=e)
+        finally:
+            self._workers.pop(worker, None)
+            # users of a worker that went away are no longer online anywhere
+            if self.presence.pop(worker, 0):
+                self._relay(
+                    worker, _encode({"type": "presence", "worker": worker, "count": 0})
+                )
+            writer.close()
+
+    # Workers are local and drain the bus continuously, so writes are not awaited.
+    def _relay(self, sender: int, line: bytes):
+        for worker, writer in self._workers.items():
+            if worker != sender:
+                writer.write(line)
+
+
+class BusClient:
+    def __init__(
+        self,
+        path: str,
+        worker: int,
+        on_event: Callable[[dict], Awaitable[None]],
+    ):
+        self._path = path
+        self.worker = worker
+        self._on_event = on_event
+        self._writer: StreamWriter | None = None
+        self._task: asyncio.Task | None = None
+
+    # `on_close` is called if the hub goes away, e.g. because the supervisor died.
+    async def connect(
+        self,
+        on_close: Callable[[], None] | None = None,
+        attempts: int = 50,
+        delay: float = 0.1,
+    ):
+        for attempt in range(attempts):
+            try:
+                reader, self._writer = await asyncio.open_unix_connection(self._path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                if attempt == attempts - 1:
+                    raise
+                await asyncio.sleep(delay)
+        self._writer.write(_encode({"worker": self.worker}))
+        self._task = asyncio.create_task(self._listen(reader, on_close))
+
+    def publish(self, event: dict):
+        if self._writer and not self._writer.is_closing():
+            self._writer.write(_encode({**event, "worker": self.worker}))
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+        if self._writer:
+            self._writer.close()
+
+    async def _listen(self, reader: StreamReader, on_close: Callable[[], None] | None):
+        while line := await reader.readline():
+            try:
+                await self._on_event(json.loads(line))
+            except Exception as e:
+                logging.exception("Could not handle bus event.", exc_info=e)
+        logging.error("Bus hub closed the connection.")
+        if on_close:
+            on_close()
+
+
+def _encode(event: dict) -> bytes:
+    return json.dumps(event).encode() + b"\n"
@@ -4,84 +4,226 @@ import termios
 import tty
 import logging
 import asyncio
-import json
+import argparse
+import re
 from asyncio import StreamReader, StreamWriter
-from collections import deque
 
+from . import eventloop
 from .reader import *
-from .utils import *
+from .render import TerminalRenderer
 from .store import MessageStore
+from .protocol import TEXT, FramedCodec, Kind, TextCodec, msgpack, negotiate
 
+# messages requested when scrolling reaches the oldest loaded one
+HISTORY_PAGE = 50
+MAX_RETRIES = 3
+# seconds without sending anything before a PING; well under the server's idle timeout
+HEARTBEAT_INTERVAL = 20
 
-class MessageError(Exception):
-    pass
+
+# A numbered command sent to the server and not acknowledged yet.
+class PendingCommand:
+    def __init__(self, data: bytes, sent_at: float, acked: asyncio.Future):
+        self.data = data
+        self.sent_at = sent_at
+        self.attempts = 0
+        # resolves to True once acknowledged, or False after the last retry
+        self.acked = acked
+
+
+# Where --remember keeps the resume token of a user between runs.
+def token_path(username: str) -> str:
+    cache = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    return os.path.join(cache, "chatcmd", f"{username}.token")
+
+
+# A token is used once: the resumed session asks for a fresh one.
+def take_token(username: str) -> str | None:
+    try:
+        with open(token_path(username)) as file:
+            token = file.read().strip()
+        os.remove(token_path(username))
+        return token
+    except FileNotFoundError:
+        return None
+
+
+def save_token(username: str, token: str):
+    path = token_path(username)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as file:
+        file.write(token)
 
 
 class ChatClient:
-    def __init__(self) -> None:
+    def __init__(
+        self, protocol: str = "text", window: int = 32, remember: bool = False
+    ) -> None:
         self._server_writer: StreamWriter
         self._server_reader: StreamReader
         self._stdin_reader: StreamReader
         self._messages: MessageStore
-        self._ack_event = asyncio.Event()
-        self._send_event = asyncio.Event()
-
-    def _prepare_message(self, message: str):
-        if "\\LOAD" in message:
-            message += f" {self._messages.get_len()-3}"
-        return f"{message}\n".encode()
-
-    async def _send_message(self, message: str):
-        max_retries = 3
-        prep = self._prepare_message(message)
-        for i in range(max_retries + 1):
-            try:
-                self._server_writer.write(prep)
+        self._renderer: TerminalRenderer
+        # up to `window` commands are sent ahead of their ACKs, matched up by sequence number
+        self._window = asyncio.Semaphore(window)
+        self._in_flight: dict[int, PendingCommand] = {}
+        self._next_seq = 1
+        self._last_sent = 0.0
+        self._loading_history = False
+        # the last search and the cursor of its next page, "-" before the first one
+        self._search_terms = ""
+        self._search_cursor = "-"
+        self._protocol = protocol
+        self._codec: TextCodec | FramedCodec = TEXT
+        self._remember = remember
+        self._username = ""
+
+    def _prepare_message(self, message: str, seq: int):
+        if message.startswith("\\LOAD"):
+            args = message.removeprefix("\\LOAD").strip()
+            # opaque position of the oldest message held, handed back to the server
+            if cursor := self._messages.history_cursor:
+                args += f" {cursor}"
+            return self._codec.encode(Kind.LOAD, args, seq)
+        if re.match(r"\\[q|Q]", message):
+            return self._codec.encode(Kind.QUIT, seq=seq)
+        if message == "\\TOKEN":
+            return self._codec.encode(Kind.TOKEN, seq=seq)
+        if message.startswith("\\JOIN "):
+            room = message.removeprefix("\\JOIN").strip().lower()
+            return self._codec.encode(Kind.JOIN, room, seq)
+        if message.strip() == "\\PART":
+            return self._codec.encode(Kind.PART, seq=seq)
+        if message.startswith("\\MSG "):
+            return self._codec.encode(Kind.DIRECT, f"{message[5:]}\n", seq)
+        if message.startswith("\\DMS "):
+            return self._codec.encode(Kind.CONVERSATION, message[5:].strip(), seq)
+        if message.startswith("\\PASSWD "):
+            return self._codec.encode(Kind.PASSWD, message[8:].strip(), seq)
+        if message.startswith("\\SEARCH"):
+            # a bare \SEARCH asks for the next page of the last search
+            if terms := message.removeprefix("\\SEARCH").strip():
+                self._search_terms, self._search_cursor = terms, "-"
+            search = f"{self._search_cursor} {self._search_terms}"
+            return self._codec.encode(Kind.SEARCH, search, seq)
+        return self._codec.encode(Kind.MESSAGE, f"{message}\n", seq)
+
+    # Send without waiting for the ACK, once there is room in the window; the returned
+    # future tells whether the server acknowledged the command.
+    async def _send_message(self, message: str) -> asyncio.Future:
+        await self._window.acquire()
+        seq = self._next_seq
+        self._next_seq += 1
+        data = self._prepare_message(message, seq)
+        loop = asyncio.get_running_loop()
+        pending = PendingCommand(data, loop.time(), loop.create_future())
+        self._in_flight[seq] = pending
+        self._last_sent = pending.sent_at
+        self._server_writer.write(data)
+        await self._server_writer.drain()
+        return pending.acked
+
+    def _acknowledged(self, seq: int | None):
+        pending = self._in_flight.pop(seq, None)
+        if pending:
+            self._window.release()
+            pending.acked.set_result(True)
+
+    # Resend only the commands whose ACK is overdue; the server ignores duplicates.
+    async def _retransmit_overdue(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(0.5)
+            for seq, pending in list(self._in_flight.items()):
+                if loop.time() - pending.sent_at < 2 + pending.attempts:
+                    continue
+                if pending.attempts == MAX_RETRIES:
+                    del self._in_flight[seq]
+                    self._window.release()
+                    pending.acked.set_result(False)
+                    await self._messages.append("Failed to send the message\n")
+                    continue
+                pending.attempts += 1
+                pending.sent_at = loop.time()
+                await self._messages.append(
+                    f"Could not send the message, retrying...({pending.attempts}/{MAX_RETRIES})\n"
+                )
+                self._server_writer.write(pending.data)
+
+    # Keep an idle connection open: a PING goes out only when nothing else was sent for
+    # HEARTBEAT_INTERVAL seconds. It has no sequence number and is never acknowledged.
+    async def _heartbeat(self):
+        loop = asyncio.get_running_loop()
+        self._last_sent = loop.time()
+        while True:
+            idle = loop.time() - self._last_sent
+            if idle >= HEARTBEAT_INTERVAL:
+                self._server_writer.write(self._codec.encode(Kind.PING))
                 await self._server_writer.drain()
-                await asyncio.wait_for(self._ack_event.wait(), 2 + i)
-                break
-            except asyncio.exceptions.TimeoutError:
-                if i == max_retries:
-                    raise MessageError
-                else:
-                    await self._messages.append(
-                        f"Could not send the message, retrying...({i+1}/{max_retries})\n"
-                    )
+                self._last_sent = loop.time()
+                idle = 0
+            await asyncio.sleep(HEARTBEAT_INTERVAL - idle)
 
     async def _listen_for_messages(self):  # A
-        while (message := await self._server_reader.readline()) != b"":
-            message_str = message.decode()
-
-            if self._send_event and "\ACK" in message_str:
-                self._ack_event.set()
-            elif "\PACK" in message_str:
-                message_pack = message_str.removeprefix("\PACK ")
-                message_list = json.loads(message_pack)
-                await self._messages.extend(message_list)
+        while event := await self._codec.read_event(self._server_reader):
+            kind, payload = event
+
+            if kind == Kind.ACK:
+                self._acknowledged(payload)
+            elif kind == Kind.PACK:
+                cursor, message_list = payload
+                await self._messages.prepend(message_list, cursor)
+                self._loading_history = False
+            elif kind == Kind.RESULTS:
+                await self._show_results(*payload)
+            elif kind == Kind.RESUME:
+                save_token(self._username, payload)
+            elif kind == Kind.CHAT:
+                cursor, message = payload
+                await self._messages.append(message, cursor)
+            elif kind == Kind.ROOM:
+                # everything from the previous room arrived before this
+                self._messages.clear()
+                self._loading_history = False
             else:
-                await self._messages.append(message_str)
+                await self._messages.append(payload)
 
         await self._messages.append("\nServer closed connection.\n")
 
+    async def _show_results(self, cursor: str, lines: list[str]):
+        first_page = self._search_cursor == "-"
+        if first_page:
+            await self._messages.append(f'Results for "{self._search_terms}":\n')
+        for line in lines:
+            await self._messages.append(line)
+        if lines:
+            await self._messages.append("\\SEARCH shows more.\n")
+        else:
+            await self._messages.append(
+                "No results.\n" if first_page else "No more results.\n"
+            )
+        self._search_cursor = cursor
+
     async def _read_and_send(self):  # B
         while True:
-            message = await read_line(self._stdin_reader)
-            try:
-                self._send_event.set()
-                await self._send_message(message)
-            except MessageError:
-                await self._messages.append("Failed to send the message\n")
-                sys.stdout.flush()
-            finally:
-                self._ack_event.clear()
-                self._send_event.clear()
-
-    async def _redraw_output(self, items: deque):
-        os.system("clear")
-        move_to_top_of_screen()
-        for item in items:
-            sys.stdout.write(item)
-        move_to_bottom_of_screen()
+            message = await read_line(self._stdin_reader, self._on_key)
+            await self._send_message(message)
+
+    # Arrow keys scroll by one message, Page Up and Page Down by a screen; reaching the
+    # oldest message held loads the page before it.
+    def _on_key(self, key: bytes):
+        page = self._renderer.height
+        keys = {b"\x1b[A": 1, b"\x1b[B": -1, b"\x1b[5~": page, b"\x1b[6~": -page}
+        if key not in keys:
+            return
+        if self._messages.scroll(keys[key], page) and not self._loading_history:
+            self._loading_history = True
+            asyncio.create_task(self._load_older())
+
+    async def _load_older(self):
+        if not await (await self._send_message(f"\\LOAD {HISTORY_PAGE}")):
+            self._loading_history = False
+            await self._messages.append("Could not load older messages\n")
 
     async def start_chat_client(self):
         # switch terminal to raw mode to avoid race conditions
@@ -89,10 +231,11 @@ class ChatClient:
         old_settings = termios.tcgetattr(fd)
         tty.setcbreak(fd)
 
-        os.system("clear")
-        move_to_bottom_of_screen()
-
-        self._messages = MessageStore(self._redraw_output)
+        renderer = self._renderer = TerminalRenderer(
+            lambda rows: self._messages.visible(rows)
+        )
+        self._messages = MessageStore(renderer.appended, renderer.redraw)
+        renderer.start()
 
         self._stdin_reader = await create_stdin_reader()
         sys.stdout.write("Enter username and password: ")
@@ -104,19 +247,36 @@ class ChatClient:
                 "127.0.0.2", 8000
             )  # C
         except:
+            renderer.stop()
             termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
             sys.stdout.write("Could not connect to server\n")
             return
 
-        self._server_writer.write(f"CONNECT {username}\n".encode())
+        credentials = username.split()
+        self._username = credentials[0] if credentials else ""
+        # with a saved token, the username alone is enough
+        token = None
+        if self._remember and len(credentials) == 1:
+            token = take_token(self._username)
+        hello = f"RESUME {self._username} {token}" if token else f"CONNECT {username}"
+        if self._protocol != "text":
+            hello += f" {self._protocol}"
+        self._server_writer.write(f"{hello}\n".encode())
         await self._server_writer.drain()
+        if self._protocol != "text":
+            await self._negotiate_protocol()
 
         message_listener = asyncio.create_task(self._listen_for_messages())  # D
         input_listener = asyncio.create_task(self._read_and_send())
+        retransmitter = asyncio.create_task(self._retransmit_overdue())
+        heartbeat = asyncio.create_task(self._heartbeat())
 
         try:
+            if self._remember:
+                await self._send_message("\\TOKEN")
             _, pending = await asyncio.wait(
-                [message_listener, input_listener], return_when=asyncio.FIRST_COMPLETED
+                [message_listener, input_listener, retransmitter, heartbeat],
+                return_when=asyncio.FIRST_COMPLETED,
             )
             for task in pending:
                 task.cancel()
@@ -125,17 +285,64 @@ class ChatClient:
             self._server_writer.close()
             await self._server_writer.wait_closed()
         finally:
-            sys.stdout.flush()
+            renderer.stop()
             # switch terminal back to echo mode
             termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
 
+    # The server confirms the protocol it picked with one text line before switching to it.
+    async def _negotiate_protocol(self):
+        reply = (await self._server_reader.readline()).decode()
+        if reply.startswith("\\PROTOCOL "):
+            self._codec = negotiate(reply.split()[1])
+        elif reply:
+            await self._messages.append(reply)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m chatcmd.client")
+    parser.add_argument(
+        "--protocol",
+        choices=["text", "framed", "framed-msgpack"],
+        default="text",
+        help="framed-msgpack needs msgpack (poetry install -E msgpack), "
+        "otherwise framed JSON is used",
+    )
+    parser.add_argument(
+        "--window",
+        type=int,
+        default=32,
+        help="how many messages may be sent before the first of them is acknowledged",
+    )
+    parser.add_argument(
+        "--remember",
+        action="store_true",
+        help="keep a resume token, so next time only the username is needed",
+    )
+    parser.add_argument(
+        "--loop",
+        choices=eventloop.LOOPS,
+        default="auto",
+        help="event loop implementation, auto uses uvloop when it is installed",
+    )
+    return parser.parse_args()
 
-async def main():
-    chat_client = ChatClient()
+
+async def main(args: argparse.Namespace):
+    protocol = args.protocol
+    if protocol == "framed-msgpack" and msgpack is None:
+        protocol = "framed"
+    chat_client = ChatClient(protocol, args.window, args.remember)
     await chat_client.start_chat_client()
 
 
-try:
-    asyncio.run(main())
-except KeyboardInterrupt:
-    print("\nInterrupted by user")
+# Entry point of python -m chatcmd.client and the chatcmd-client script.
+def run():
+    args = parse_args()
+    try:
+        eventloop.run(main(args), args.loop)
+    except KeyboardInterrupt:
+        print("\nInterrupted by user")
+
+
+if __name__ == "__main__":
+    run()
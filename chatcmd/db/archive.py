@@ -0,0 +1,328 @@
+"""Create upcoming monthly partitions of the message table and archive cold ones.
+
+On Postgres `message` is partitioned by month of `timestamp` (message_pYYYY_MM) with a
+default partition for anything outside them. This tool
+
+  - creates the partitions for the current month and the --ahead months after it,
+    moving rows that landed in the default partition meanwhile
+  - exports every partition older than --keep-months to --dir, one compressed JSON
+    lines file per room: <dir>/2026-01/room-1.jsonl.zst (gzip without zstandard)
+  - detaches and drops the exported partitions
+
+Run it from cron about once a month. A server started with DB_ARCHIVE_DIR pointing at
+the same directory keeps serving the archived history to \\LOAD.
+
+    python -m chatcmd.db.archive --dir /var/lib/chatcmd/archive --keep-months 12
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import re
+import shutil
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import IO
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, create_async_engine
+
+from .models import Message, User
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+SUFFIX = ".jsonl.zst" if zstandard else ".jsonl.gz"
+MONTH = re.compile(r"\d{4}-\d{2}")
+PARTITION = re.compile(r"message_p(\d{4})_(\d{2})")
+# the stored columns; search_vector is generated
+COLUMNS = "id, text, timestamp, user_id, room_id"
+
+
+def month_of(value: datetime | date) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, count: int) -> date:
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"message_p{month:%Y_%m}"
+
+
+def _open(path: str, mode: str) -> IO:
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError(f"Install zstandard to read {path}")
+        return zstandard.open(path, mode)
+    return gzip.open(path, mode)
+
+
+# Writes one month of messages, grouped by room and ordered by (timestamp, id) within
+# each room. Files go to a temporary directory that replaces the month's directory only
+# once everything is written, so a failed export leaves no partial month behind.
+class MonthWriter:
+    def __init__(self, directory: str, month: date):
+        self._path = os.path.join(directory, f"{month:%Y-%m}")
+        self._tmp = self._path + ".tmp"
+        self._file: IO | None = None
+        self._room: int | None = None
+        self.rows = 0
+
+    def __enter__(self) -> "MonthWriter":
+        shutil.rmtree(self._tmp, ignore_errors=True)
+        os.makedirs(self._tmp)
+        return self
+
+    def add(self, row: dict):
+        if row["room_id"] != self._room:
+            if self._file:
+                self._file.close()
+            self._room = row["room_id"]
+            path = os.path.join(self._tmp, f"room-{self._room}{SUFFIX}")
+            self._file = _open(path, "wt")
+        self._file.write(json.dumps(row) + "\n")
+        self.rows += 1
+
+    def __exit__(self, exc_type, *_):
+        if self._file:
+            self._file.close()
+        if exc_type is not None:
+            shutil.rmtree(self._tmp, ignore_errors=True)
+            return
+        # a month exported before, but whose partition was not dropped yet
+        shutil.rmtree(self._path, ignore_errors=True)
+        os.rename(self._tmp, self._path)
+
+
+# Read side of the archive, for history older than the oldest partition. A room's month
+# is decoded on first use and the last `cache_size` of them are kept, so paging through
+# one month reads its file once. The archiver adds a month about once a month, so the
+# directory is listed again only every `refresh` seconds.
+class MessageArchive:
+    def __init__(self, directory: str, cache_size: int = 8, refresh: float = 60):
+        self._directory = directory
+        self._cache_size = cache_size
+        self._refresh = refresh
+        self._months: list[str] = []
+        self._listed_at: float | None = None
+        # (month, room id) -> [((timestamp, id), row)], oldest first
+        self._rooms: OrderedDict[tuple[str, int], list] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    # Archived months, newest first.
+    def months(self) -> list[str]:
+        now = time.monotonic()
+        if self._listed_at is None or now - self._listed_at >= self._refresh:
+            self._listed_at = now
+            try:
+                names = os.listdir(self._directory)
+            except FileNotFoundError:
+                names = []
+            self._months = sorted(
+                (name for name in names if MONTH.fullmatch(name)), reverse=True
+            )
+        return self._months
+
+    # Whether any archived month starts before `timestamp`.
+    def reaches(self, timestamp: datetime) -> bool:
+        months = self.months()
+        return bool(months) and datetime.fromisoformat(f"{months[-1]}-01") < timestamp
+
+    # Up to `amount` messages of the room older than `before`, a history Cursor, oldest
+    # first.
+    async def page(
+        self, amount: int, before: tuple[datetime, int], room_id: int
+    ) -> list[Message]:
+        rows = []
+        for month in self.months():
+            if datetime.fromisoformat(f"{month}-01") >= before[0]:
+                continue
+            entries = await self._room(month, room_id)
+            end = bisect_left(entries, before, key=lambda entry: entry[0])
+            rows = entries[max(end - (amount - len(rows)), 0) : end] + rows
+            if len(rows) == amount:
+                break
+        return [_message(row) for _, row in rows]
+
+    async def _room(self, month: str, room_id: int) -> list:
+        key = (month, room_id)
+        entries = self._rooms.get(key)
+        if entries is not None:
+            self._rooms.move_to_end(key)
+            self.hits += 1
+            return entries
+        self.misses += 1
+        path = os.path.join(self._directory, month, f"room-{room_id}")
+        entries = await asyncio.to_thread(_read_room, path)
+        self._rooms[key] = entries
+        if len(self._rooms) > self._cache_size:
+            self._rooms.popitem(last=False)
+        return entries
+
+    def stats(self) -> dict[str, int]:
+        return {"cached": len(self._rooms), "hits": self.hits, "misses": self.misses}
+
+
+def _read_room(path: str) -> list:
+    for suffix in (".jsonl.zst", ".jsonl.gz"):
+        if os.path.exists(path + suffix):
+            break
+    else:
+        return []
+    entries = []
+    with _open(path + suffix, "rt") as file:
+        for line in file:
+            row = json.loads(line)
+            timestamp = datetime.fromisoformat(row["timestamp"])
+            entries.append(((timestamp, row["id"]), row))
+    return entries
+
+
+# Archived rows are returned like rows from the database, with the author attached.
+def _message(row: dict) -> Message:
+    message = Message(
+        id=row["id"],
+        text=row["text"],
+        timestamp=datetime.fromisoformat(row["timestamp"]),
+        user_id=row["user_id"],
+        room_id=row["room_id"],
+    )
+    message.user = User(id=row["user_id"], name=row["user"])
+    return message
+
+
+# The default partition is detached while a month is carved out of it, so creating a
+# partition works even if rows for that month were already inserted.
+async def create_partition(conn: AsyncConnection, month: date):
+    name = partition_name(month)
+    if (await conn.execute(text(f"SELECT to_regclass('{name}')"))).scalar():
+        return
+    bounds = f"timestamp >= '{month}' AND timestamp < '{add_months(month, 1)}'"
+    for statement in (
+        "ALTER TABLE message DETACH PARTITION message_default",
+        f"CREATE TABLE {name} PARTITION OF message "
+        f"FOR VALUES FROM ('{month}') TO ('{add_months(month, 1)}')",
+        f"INSERT INTO message ({COLUMNS}) "
+        f"SELECT {COLUMNS} FROM message_default WHERE {bounds}",
+        f"DELETE FROM message_default WHERE {bounds}",
+        "ALTER TABLE message ATTACH PARTITION message_default DEFAULT",
+    ):
+        await conn.execute(text(statement))
+    print(f"Created {name}")
+
+
+async def list_partitions(conn: AsyncConnection) -> list[date]:
+    result = await conn.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = 'message'::regclass"
+        )
+    )
+    months = []
+    for (name,) in result:
+        if match := PARTITION.fullmatch(name):
+            months.append(date(int(match.group(1)), int(match.group(2)), 1))
+    return sorted(months)
+
+
+async def archive_partition(engine: AsyncEngine, directory: str, month: date) -> int:
+    name = partition_name(month)
+    async with engine.connect() as conn:
+        expected = (await conn.execute(text(f"SELECT count(*) FROM {name}"))).scalar()
+        result = await conn.stream(
+            text(
+                f"SELECT m.id, m.timestamp, m.user_id, u.name, m.room_id, m.text "
+                f'FROM {name} m JOIN "user" u ON u.id = m.user_id '
+                "ORDER BY m.room_id, m.timestamp, m.id"
+            )
+        )
+        with MonthWriter(directory, month) as writer:
+            async for row in result:
+                writer.add(
+                    {
+                        "id": row.id,
+                        "timestamp": row.timestamp.isoformat(),
+                        "user_id": row.user_id,
+                        "user": row.name,
+                        "room_id": row.room_id,
+                        "text": row.text,
+                    }
+                )
+    if writer.rows != expected:
+        raise RuntimeError(f"Exported {writer.rows} of {expected} rows from {name}")
+    async with engine.begin() as conn:
+        await conn.execute(text(f"ALTER TABLE message DETACH PARTITION {name}"))
+        await conn.execute(text(f"DROP TABLE {name}"))
+    return writer.rows
+
+
+async def maintain(engine: AsyncEngine, args: argparse.Namespace):
+    current = month_of(datetime.now())
+    async with engine.begin() as conn:
+        for offset in range(args.ahead + 1):
+            await create_partition(conn, add_months(current, offset))
+        partitions = await list_partitions(conn)
+    cutoff = add_months(current, -args.keep_months)
+    for month in partitions:
+        if month >= cutoff:
+            break
+        if args.dry_run:
+            print(f"Would archive {partition_name(month)}")
+            continue
+        rows = await archive_partition(engine, args.dir, month)
+        print(f"Archived {rows} messages from {partition_name(month)}")
+
+
+def parse_args(archive_dir: str | None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m chatcmd.db.archive")
+    parser.add_argument(
+        "--dir",
+        default=archive_dir,
+        required=archive_dir is None,
+        help="archive directory, DB_ARCHIVE_DIR by default",
+    )
+    parser.add_argument(
+        "--keep-months",
+        type=int,
+        default=12,
+        help="months kept in the database besides the current one",
+    )
+    parser.add_argument(
+        "--ahead", type=int, default=3, help="months to create partitions for"
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="only create partitions and list the ones that would be archived",
+    )
+    return parser.parse_args()
+
+
+def main():
+    from .db_config import get_settings
+
+    settings = get_settings()
+    args = parse_args(settings.DB_ARCHIVE_DIR)
+    engine = create_async_engine(settings.DATABASE_URL)
+
+    async def run():
+        try:
+            await maintain(engine, args)
+        finally:
+            await engine.dispose()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -20,7 +20,20 @@ class Settings:
     POSTGRES_SERVER = os.getenv("POSTGRES_SERVER", "localhost")
     POSTGRES_PORT = os.getenv("POSTGRES_PORT", "5432")  # default postgres port is 5432
     POSTGRES_DB = os.getenv("POSTGRES_DB", "chat")
-    DATABASE_URL = f"postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_SERVER}:{POSTGRES_PORT}/{POSTGRES_DB}"
+    # prepared statements asyncpg keeps per connection, the fixed query set fits easily
+    DB_STATEMENT_CACHE_SIZE = os.getenv("DB_STATEMENT_CACHE_SIZE", "100")
+    DATABASE_URL = f"postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_SERVER}:{POSTGRES_PORT}/{POSTGRES_DB}?prepared_statement_cache_size={DB_STATEMENT_CACHE_SIZE}"
+
+    # connection pool; size it above the number of concurrent queries the server runs,
+    # i.e. the message persister plus logins and \LOAD pages not served from memory
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+    DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # seconds
+    DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # seconds, -1 disables
+    DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+    DB_SLOW_STATEMENT = float(os.getenv("DB_SLOW_STATEMENT", "0.5"))  # seconds
+    # where python -m chatcmd.db.archive puts old partitions; \LOAD reads them back
+    DB_ARCHIVE_DIR = os.getenv("DB_ARCHIVE_DIR")
 
     def env_set(self) -> bool:
         return all(
@@ -44,6 +57,15 @@ class Settings:
             "url": self.DATABASE_URL,
         }
 
+    def pool_options(self) -> dict:
+        return {
+            "pool_size": self.DB_POOL_SIZE,
+            "max_overflow": self.DB_MAX_OVERFLOW,
+            "pool_timeout": self.DB_POOL_TIMEOUT,
+            "pool_recycle": self.DB_POOL_RECYCLE,
+            "pool_pre_ping": self.DB_POOL_PRE_PING,
+        }
+
 
 @lru_cache()
 def get_settings():
@@ -1,57 +1,367 @@
+import base64
+import functools
+import time
 from datetime import datetime
-from sqlalchemy import select
+from typing import TYPE_CHECKING
+from sqlalchemy import (
+    Float,
+    Row,
+    bindparam,
+    column,
+    func,
+    insert,
+    literal_column,
+    select,
+    table,
+    tuple_,
+    update,
+)
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import joinedload
 
-from .models import Message, User
-from .pwd import get_password_hash, verify_password
+from ..metrics import Histogram
+from .metrics import InstrumentedQueuePool, StatementMetrics
+from .models import (
+    GENERAL_ROOM_ID,
+    SEARCH_CONFIG,
+    DirectMessage,
+    Message,
+    Room,
+    User,
+)
+from .pwd import PasswordHasher
+
+if TYPE_CHECKING:
+    # imported by whoever configures an archive, so zstandard loads only then
+    from .archive import MessageArchive
+
+# position in message history: (timestamp, id) of the oldest message already seen
+Cursor = tuple[datetime, int]
+
+
+def encode_cursor(cursor: Cursor) -> str:
+    timestamp, message_id = cursor
+    raw = f"{timestamp.isoformat()}|{message_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(token: str) -> Cursor:
+    timestamp, message_id = base64.urlsafe_b64decode(token.encode()).decode().split("|")
+    return datetime.fromisoformat(timestamp), int(message_id)
+
+
+# position in search results: (score, id) of the last result already seen, best first
+SearchCursor = tuple[float, int]
+FIRST_RESULT: SearchCursor = (float("inf"), 0)
+
+
+def encode_search_cursor(cursor: SearchCursor) -> str:
+    score, message_id = cursor
+    raw = f"{score!r}|{message_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_search_cursor(token: str) -> SearchCursor:
+    score, message_id = base64.urlsafe_b64decode(token.encode()).decode().split("|")
+    return float(score), int(message_id)
+
+
+# User input as an FTS5 query that can't be a syntax error: every word is quoted and
+# all of them must match.
+def fts5_query(terms: str) -> str:
+    return " ".join('"' + word.replace('"', '""') + '"' for word in terms.split())
+
+
+# The hot statements are built once with bound parameters, so each call skips building
+# the statement and its cache key and hits SQLAlchemy's compiled cache; on Postgres,
+# asyncpg also keeps them prepared per connection.
+USER_BY_NAME = select(User).where(User.name == bindparam("name"))
+AUTH_BY_NAME = select(User.id, User.password_hash).where(User.name == bindparam("name"))
+MESSAGES_BEFORE = (
+    select(Message)
+    .options(joinedload(Message.user))
+    .filter(Message.room_id == bindparam("room_id"))
+    .filter(
+        tuple_(Message.timestamp, Message.id)
+        < tuple_(bindparam("timestamp"), bindparam("message_id"))
+    )
+    .order_by(Message.timestamp.desc(), Message.id.desc())
+    .limit(bindparam("amount"))
+)
+INSERT_MESSAGE = insert(Message)
+ROOM_BY_NAME = select(Room.id).where(Room.name == bindparam("name"))
+CONVERSATION_BEFORE = (
+    select(DirectMessage)
+    .options(joinedload(DirectMessage.sender))
+    .filter(DirectMessage.user_a_id == bindparam("user_a_id"))
+    .filter(DirectMessage.user_b_id == bindparam("user_b_id"))
+    .filter(
+        tuple_(DirectMessage.timestamp, DirectMessage.id)
+        < tuple_(bindparam("timestamp"), bindparam("message_id"))
+    )
+    .order_by(DirectMessage.timestamp.desc(), DirectMessage.id.desc())
+    .limit(bindparam("amount"))
+)
+INSERT_DIRECT_MESSAGE = insert(DirectMessage)
+
+
+# Ranked full-text search in one room, keyset paginated by (score, id) like the history;
+# a higher score is a better match. Only the matching rows are ranked, so the cost follows
+# the number of matches rather than the size of the table.
+def _search(score, match, source=None):
+    query = select(Message, score.label("score")).options(joinedload(Message.user))
+    if source is not None:
+        query = query.join(source, source.c.rowid == Message.id)
+    return (
+        query.filter(match)
+        .filter(Message.room_id == bindparam("room_id"))
+        .filter(
+            tuple_(score, Message.id)
+            < tuple_(bindparam("score"), bindparam("message_id"))
+        )
+        .order_by(score.desc(), Message.id.desc())
+        .limit(bindparam("amount"))
+    )
+
+
+SEARCH_VECTOR = literal_column("message.search_vector")
+TS_QUERY = postgresql.websearch_to_tsquery(SEARCH_CONFIG, bindparam("terms"))
+MESSAGE_SEARCH = table("message_search", column("rowid"), column("rank"))
+SEARCH_MESSAGES = {
+    "postgresql": _search(
+        func.ts_rank(SEARCH_VECTOR, TS_QUERY, type_=Float),
+        SEARCH_VECTOR.bool_op("@@")(TS_QUERY),
+    ),
+    # bm25() ranks better matches lower
+    "sqlite": _search(
+        -MESSAGE_SEARCH.c.rank,
+        literal_column("message_search").match(bindparam("terms")),
+        MESSAGE_SEARCH,
+    ),
+}
+
+
+# Column values identifying the conversation between two users, in either direction.
+def conversation(user_id: int, other_id: int) -> dict[str, int]:
+    return {"user_a_id": min(user_id, other_id), "user_b_id": max(user_id, other_id)}
+
+
+# Names of the Database methods decorated with @timed; each gets a latency histogram.
+TIMED_METHODS: list[str] = []
+
+
+def timed(method):
+    name = method.__name__
+    TIMED_METHODS.append(name)
+
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await method(self, *args, **kwargs)
+        finally:
+            self.method_time[name].observe(time.perf_counter() - start)
+
+    return wrapper
 
 
 class Database:
     def __init__(
         self,
         database_url: str,
+        hasher: PasswordHasher | None = None,
+        pool_options: dict | None = None,
+        slow_statement: float = 0.5,
+        archive: "MessageArchive | None" = None,
     ) -> None:
-        self._engine = create_async_engine(database_url)
-        self._async_session = async_sessionmaker(self._engine)
+        self._hasher = hasher or PasswordHasher()
+        self._engine = create_async_engine(
+            database_url, poolclass=InstrumentedQueuePool, **(pool_options or {})
+        )
+        self._statements = StatementMetrics(self._engine.sync_engine, slow_statement)
+        self._async_session = async_sessionmaker(self._engine, expire_on_commit=False)
+        self.method_time = {name: Histogram() for name in TIMED_METHODS}
+        self._archive = archive
+
+    async def close(self):
+        await self._engine.dispose()
+
+    # replaced by a fresh pool when the engine is disposed
+    @property
+    def pool(self) -> InstrumentedQueuePool:
+        return self._engine.pool
 
-    async def get_messages(self, amount: int, offset: int, before: datetime):
+    @property
+    def statements(self) -> StatementMetrics:
+        return self._statements
+
+    # Pool saturation and query latency, to tell slow chat apart from a starved pool.
+    def pool_stats(self) -> dict:
+        pool = self.pool
+        return {
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            # negative until the pool has opened all of its regular connections
+            "overflow": max(pool.overflow(), 0),
+            "waiting": pool.waiting,
+            "timeouts": pool.timeouts,
+            "wait_ms": pool.wait_time.summary(),
+            "statement_ms": self._statements.duration.summary(),
+            "statement_errors": self._statements.errors,
+        }
+
+    # Return up to `amount` messages of the room older than the cursor, oldest first.
+    # History older than the oldest partition continues in the archive, if there is one.
+    @timed
+    async def get_messages(
+        self, amount: int, before: Cursor, room_id: int = GENERAL_ROOM_ID
+    ):
+        timestamp, message_id = before
+        params = {
+            "room_id": room_id,
+            "timestamp": timestamp,
+            "message_id": message_id,
+            "amount": amount,
+        }
         async with self._async_session() as session:
-            stmt = (
-                select(Message)
-                .filter(Message.timestamp < before)
-                .order_by(Message.timestamp.desc())
-                .offset(offset)
-                .limit(amount)
+            result = await session.execute(MESSAGES_BEFORE, params)
+            messages = sorted(result.scalars().all(), key=lambda m: (m.timestamp, m.id))
+        if len(messages) < amount and self._archive:
+            if messages:
+                before = (messages[0].timestamp, messages[0].id)
+            # a short page of a room that is younger than every archived month
+            if not self._archive.reaches(before[0]):
+                return messages
+            older = await self._archive.page(amount - len(messages), before, room_id)
+            messages = older + messages
+        return messages
+
+    # Up to `amount` messages of the room matching `terms` after the cursor, best match
+    # first, each with its score.
+    @timed
+    async def search_messages(
+        self,
+        terms: str,
+        amount: int,
+        after: SearchCursor = FIRST_RESULT,
+        room_id: int = GENERAL_ROOM_ID,
+    ) -> list[tuple[Message, float]]:
+        dialect = self._engine.dialect.name
+        score, message_id = after
+        params = {
+            "terms": fts5_query(terms) if dialect == "sqlite" else terms,
+            "room_id": room_id,
+            "score": score,
+            "message_id": message_id,
+            "amount": amount,
+        }
+        async with self._async_session() as session:
+            result = await session.execute(SEARCH_MESSAGES[dialect], params)
+            return [(message, score) for message, score in result.all()]
+
+    # The author's id is resolved once at login, so storing a message is a single INSERT.
+    @timed
+    async def add_message(
+        self, user_id: int, text: str, room_id: int = GENERAL_ROOM_ID
+    ):
+        async with self._async_session() as session:
+            await session.execute(
+                INSERT_MESSAGE, {"user_id": user_id, "text": text, "room_id": room_id}
             )
-            result = await session.execute(stmt)
+            await session.commit()
+
+    # Store a batch of {user_id, text, timestamp, room_id} rows with a multi-row INSERT in one transaction.
+    @timed
+    async def add_messages(self, rows: list[dict]):
+        async with self._async_session() as session:
+            await session.execute(INSERT_MESSAGE, rows)
+            await session.commit()
+
+    # Up to `amount` direct messages between the two users older than the cursor, oldest
+    # first; a range scan of the conversation index, the public history is not touched.
+    @timed
+    async def get_direct_messages(
+        self, user_id: int, other_id: int, amount: int, before: Cursor
+    ):
+        timestamp, message_id = before
+        params = {
+            **conversation(user_id, other_id),
+            "timestamp": timestamp,
+            "message_id": message_id,
+            "amount": amount,
+        }
+        async with self._async_session() as session:
+            result = await session.execute(CONVERSATION_BEFORE, params)
             messages = result.scalars().all()
-            return sorted(messages, key=lambda m: m.timestamp)
+            return sorted(messages, key=lambda m: (m.timestamp, m.id))
 
-    async def add_message(self, username: str, text: str):
-        user = await self.get_user_by_name(username)
-        msg = Message(text=text, user_id=user.id)
+    # Store a batch of {user_a_id, user_b_id, sender_id, text, timestamp} rows.
+    @timed
+    async def add_direct_messages(self, rows: list[dict]):
         async with self._async_session() as session:
-            session.add(msg)
+            await session.execute(INSERT_DIRECT_MESSAGE, rows)
             await session.commit()
 
+    # Id of the room with this name, created on first use.
+    @timed
+    async def get_room_id(self, name: str) -> int:
+        async with self._async_session() as session:
+            room_id = (await session.execute(ROOM_BY_NAME, {"name": name})).scalar()
+            if room_id is not None:
+                return room_id
+            try:
+                room = Room(name=name)
+                session.add(room)
+                await session.commit()
+                return room.id
+            except IntegrityError:
+                # another worker created it first
+                await session.rollback()
+                return (await session.execute(ROOM_BY_NAME, {"name": name})).scalar()
+
+    @timed
     async def get_user_by_name(self, username: str):
         async with self._async_session() as session:
-            stmt = select(User).where(User.name == username)
-            result = await session.execute(stmt)
+            result = await session.execute(USER_BY_NAME, {"name": username})
             return result.scalar()
 
+    # Everything CONNECT needs in one query: the user's id and password hash, or None
+    # if the name is not registered yet.
+    @timed
+    async def get_user_for_auth(self, username: str) -> Row | None:
+        async with self._async_session() as session:
+            result = await session.execute(AUTH_BY_NAME, {"name": username})
+            return result.first()
+
+    async def verify_password(self, password: str, password_hash: str) -> bool:
+        return await self._hasher.verify(password, password_hash)
+
+    @timed
     async def add_user(self, username: str, password: str):
-        pwd_hash = get_password_hash(password)
+        pwd_hash = await self._hasher.hash(password)
         user = User(name=username, password_hash=pwd_hash)
         async with self._async_session() as session:
             session.add(user)
             await session.commit()
+            return user
+
+    @timed
+    async def set_password(self, username: str, password: str):
+        pwd_hash = await self._hasher.hash(password)
+        async with self._async_session() as session:
+            await session.execute(
+                update(User).where(User.name == username).values(password_hash=pwd_hash)
+            )
+            await session.commit()
 
+    @timed
     async def login_user(self, username: str, password: str):
         async with self._async_session() as session:
-            stmt = select(User).where(User.name == username)
-            result = await session.execute(stmt)
+            result = await session.execute(USER_BY_NAME, {"name": username})
             user = result.scalar()
-            if user and verify_password(password, user.password_hash):
-                return True
-            return False
+        # verify after the session is released so the connection isn't held during bcrypt
+        if user and await self._hasher.verify(password, user.password_hash):
+            return user
+        return None
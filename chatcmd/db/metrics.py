@@ -0,0 +1,63 @@
+import logging
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from ..metrics import Histogram
+
+
+# Times how long each checkout waits for a free connection and counts the waiters;
+# SQLAlchemy has no pool event for a checkout that has not been served yet.
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.waiting = 0
+        self.timeouts = 0
+        self.wait_time = Histogram()
+
+    def _do_get(self):
+        self.waiting += 1
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            self.waiting -= 1
+            self.wait_time.observe(time.perf_counter() - start)
+
+    def recreate(self):
+        # dispose() swaps in a fresh pool; the metrics carry over to it
+        pool = super().recreate()
+        pool.timeouts = self.timeouts
+        pool.wait_time = self.wait_time
+        return pool
+
+
+# Statement timing hooks on an engine, with a warning for statements slower than
+# `slow_statement` seconds.
+class StatementMetrics:
+    def __init__(self, engine: Engine, slow_statement: float = 0.5):
+        self.duration = Histogram()
+        self.errors = 0
+        self._slow_statement = slow_statement
+        event.listen(engine, "before_cursor_execute", self._before)
+        event.listen(engine, "after_cursor_execute", self._after)
+        event.listen(engine, "handle_error", self._error)
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        context._chatcmd_started = time.perf_counter()
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._chatcmd_started
+        self.duration.observe(elapsed)
+        if elapsed > self._slow_statement:
+            logging.warning(
+                "Slow statement (%.0f ms): %s", elapsed * 1000, statement[:200]
+            )
+
+    def _error(self, exception_context):
+        self.errors += 1
@@ -2,7 +2,7 @@ from __future__ import annotations
 
 import datetime
 
-from sqlalchemy import ForeignKey, String, func
+from sqlalchemy import DDL, ForeignKey, Index, String, event, func
 from sqlalchemy.ext.asyncio import AsyncAttrs
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
@@ -18,19 +18,116 @@ class User(Base):
     name: Mapped[str] = mapped_column(String(10), unique=True, nullable=False)
     password_hash: Mapped[str] = mapped_column(nullable=False)
 
+    # history is only ever paged through Database.get_messages, never loaded per user
     messages: Mapped[list[Message]] = relationship(
-        "Message", back_populates="user", lazy="subquery"
+        "Message", back_populates="user", lazy="raise"
     )
 
 
+# the room every user starts in; created along with the table, so its id is always 1
+GENERAL_ROOM = "general"
+GENERAL_ROOM_ID = 1
+
+
+class Room(Base):
+    __tablename__ = "room"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    name: Mapped[str] = mapped_column(String(32), unique=True, nullable=False)
+
+
+event.listen(
+    Room.__table__,
+    "after_create",
+    DDL(f"INSERT INTO room (name) VALUES ('{GENERAL_ROOM}')"),
+)
+
+
 class Message(Base):
     __tablename__ = "message"
+    # keyset pagination walks the history of one room by (timestamp, id); on Postgres the
+    # table is partitioned by month of timestamp, see chatcmd.db.archive
+    __table_args__ = (
+        Index("ix_message_room_timestamp_id", "room_id", "timestamp", "id"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, index=True)
     text: Mapped[str] = mapped_column(nullable=False)
-    timestamp: Mapped[datetime.datetime] = mapped_column(server_default=func.now())
+    # stamped by the application so every backend stores one format that compares
+    # correctly against bound cursors (sqlite's now() drops the microseconds)
+    timestamp: Mapped[datetime.datetime] = mapped_column(
+        default=datetime.datetime.now, server_default=func.now()
+    )
 
     user_id: Mapped[int] = mapped_column(ForeignKey("user.id"), nullable=False)
-    user: Mapped[User] = relationship(
-        "User", back_populates="messages", lazy="subquery"
+    # loaded explicitly with joinedload where the author is needed
+    user: Mapped[User] = relationship("User", back_populates="messages", lazy="raise")
+
+    room_id: Mapped[int] = mapped_column(
+        ForeignKey("room.id"), nullable=False, default=GENERAL_ROOM_ID
+    )
+
+
+# Full-text index of message text for \SEARCH, outside the mapped columns since it is
+# different per backend. Postgres gets a generated tsvector column with a GIN index, as
+# added by the alembic migration; sqlite an FTS5 table over the message table, kept in
+# sync by triggers.
+SEARCH_CONFIG = "english"
+for statement in (
+    "ALTER TABLE message ADD COLUMN search_vector tsvector GENERATED ALWAYS AS "
+    f"(to_tsvector('{SEARCH_CONFIG}', text)) STORED",
+    "CREATE INDEX ix_message_search_vector ON message USING gin (search_vector)",
+):
+    event.listen(
+        Message.__table__,
+        "after_create",
+        DDL(statement).execute_if(dialect="postgresql"),
+    )
+for statement in (
+    "CREATE VIRTUAL TABLE message_search USING fts5("
+    "text, content='message', content_rowid='id', tokenize='porter unicode61')",
+    "CREATE TRIGGER message_search_insert AFTER INSERT ON message BEGIN "
+    "INSERT INTO message_search (rowid, text) VALUES (new.id, new.text); END",
+    "CREATE TRIGGER message_search_delete AFTER DELETE ON message BEGIN "
+    "INSERT INTO message_search (message_search, rowid, text) "
+    "VALUES ('delete', old.id, old.text); END",
+    "CREATE TRIGGER message_search_update AFTER UPDATE OF text ON message BEGIN "
+    "INSERT INTO message_search (message_search, rowid, text) "
+    "VALUES ('delete', old.id, old.text); "
+    "INSERT INTO message_search (rowid, text) VALUES (new.id, new.text); END",
+):
+    event.listen(
+        Message.__table__,
+        "after_create",
+        DDL(statement).execute_if(dialect="sqlite"),
+    )
+event.listen(
+    Message.__table__,
+    "before_drop",
+    DDL("DROP TABLE IF EXISTS message_search").execute_if(dialect="sqlite"),
+)
+
+
+# Private messages, kept apart from the public history. A conversation is identified by
+# its two users, lower id first, so both directions share one index range.
+class DirectMessage(Base):
+    __tablename__ = "direct_message"
+    __table_args__ = (
+        Index(
+            "ix_direct_message_conversation",
+            "user_a_id",
+            "user_b_id",
+            "timestamp",
+            "id",
+        ),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    text: Mapped[str] = mapped_column(nullable=False)
+    timestamp: Mapped[datetime.datetime] = mapped_column(
+        default=datetime.datetime.now, server_default=func.now()
     )
+    user_a_id: Mapped[int] = mapped_column(ForeignKey("user.id"), nullable=False)
+    user_b_id: Mapped[int] = mapped_column(ForeignKey("user.id"), nullable=False)
+    sender_id: Mapped[int] = mapped_column(ForeignKey("user.id"), nullable=False)
+    sender: Mapped[User] = relationship("User", foreign_keys=[sender_id], lazy="raise")
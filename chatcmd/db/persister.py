@@ -0,0 +1,148 @@
+import asyncio
+import logging
+from datetime import datetime
+
+from .db_queries import Database, conversation
+from .models import GENERAL_ROOM_ID
+
+
+# Write-behind queue for chat messages: callers enqueue stamped rows and a background
+# task stores them in multi-row INSERTs once a batch fills up or the flush interval passes.
+class MessagePersister:
+    def __init__(
+        self,
+        db: Database,
+        batch_size: int = 100,
+        flush_interval: float = 0.2,
+        max_queue: int = 10_000,
+        retries: int = 3,
+        retry_delay: float = 0.5,
+    ):
+        self._db = db
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._queue: asyncio.Queue[dict | None] = asyncio.Queue(max_queue)
+        self._batch_ready = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._closed = False
+        # puts waiting for room in the queue; close() lets them land before the sentinel
+        self._putting = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        # a failed batch is retried `retries` more times, doubling the delay each time
+        self._retries = retries
+        self._retry_delay = retry_delay
+        self.retried = 0
+        # rows given up on after the last retry; their senders were already acknowledged
+        self.failed = 0
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    # Waits while the queue is full, so a flood of messages slows down its sender
+    # instead of growing memory without bound.
+    async def put(
+        self,
+        user_id: int,
+        text: str,
+        timestamp: datetime,
+        room_id: int = GENERAL_ROOM_ID,
+    ):
+        await self._enqueue(
+            {
+                "user_id": user_id,
+                "text": text,
+                "timestamp": timestamp,
+                "room_id": room_id,
+            }
+        )
+
+    async def _enqueue(self, row: dict):
+        if self._closed:
+            raise RuntimeError("Message persister is closed")
+        self._putting += 1
+        self._idle.clear()
+        try:
+            await self._queue.put(row)
+        finally:
+            self._putting -= 1
+            if not self._putting:
+                self._idle.set()
+        if self._queue.qsize() >= self._batch_size:
+            self._batch_ready.set()
+
+    # Stop accepting messages and wait until everything queued so far is stored.
+    async def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._task:
+            # flush without waiting for full batches while the pending puts land
+            self._batch_ready.set()
+            await self._idle.wait()
+            await self._queue.put(None)
+            self._batch_ready.set()
+            await self._task
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            if (
+                batch[0] is not None
+                and not self._closed
+                and self._queue.qsize() < self._batch_size - 1
+            ):
+                try:
+                    await asyncio.wait_for(
+                        self._batch_ready.wait(), self._flush_interval
+                    )
+                except asyncio.exceptions.TimeoutError:
+                    pass
+            self._batch_ready.clear()
+            while len(batch) < self._batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            stop = None in batch
+            if stop:
+                while not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+            rows = [row for row in batch if row is not None]
+            if rows:
+                await self._write(rows)
+            if stop:
+                return
+
+    async def _write(self, rows: list[dict]):
+        delay = self._retry_delay
+        for attempt in range(self._retries + 1):
+            try:
+                await self._store(rows)
+                return
+            except Exception as e:
+                logging.exception(f"Could not store {len(rows)} message(s).", exc_info=e)
+            if attempt < self._retries:
+                self.retried += 1
+                await asyncio.sleep(delay)
+                delay *= 2
+        self.failed += len(rows)
+
+    async def _store(self, rows: list[dict]):
+        await self._db.add_messages(rows)
+
+
+# The same write-behind queue for direct messages, stored in their own table.
+class DirectMessagePersister(MessagePersister):
+    async def put(
+        self, sender_id: int, recipient_id: int, text: str, timestamp: datetime
+    ):
+        await self._enqueue(
+            {
+                **conversation(sender_id, recipient_id),
+                "sender_id": sender_id,
+                "text": text,
+                "timestamp": timestamp,
+            }
+        )
+
+    async def _store(self, rows: list[dict]):
+        await self._db.add_direct_messages(rows)
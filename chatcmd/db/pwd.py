@@ -1,5 +1,11 @@
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
 from passlib.context import CryptContext
 
+from ..metrics import Histogram
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
@@ -9,3 +15,44 @@ def get_password_hash(password):
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
+
+
+# Runs bcrypt off the event loop. A process pool is used by default since bcrypt holds
+# the GIL for most of its work; the semaphore caps how many hashes are in flight so a
+# reconnect storm queues up here instead of piling work onto the executor.
+class PasswordHasher:
+    def __init__(self, executor: Executor | None = None, max_concurrency: int = 4):
+        self._executor = executor
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._max_concurrency = max_concurrency
+        # seconds per hash or verify, including the wait for a free slot
+        self.duration = Histogram()
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            # forked children would inherit the open client sockets and keep them alive
+            # after the server closes its end
+            self._executor = ProcessPoolExecutor(
+                max_workers=self._max_concurrency,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    async def _run(self, func, *args):
+        start = time.perf_counter()
+        try:
+            async with self._semaphore:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._get_executor(), func, *args)
+        finally:
+            self.duration.observe(time.perf_counter() - start)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(get_password_hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(verify_password, plain_password, hashed_password)
+
+    def shutdown(self):
+        if self._executor:
+            self._executor.shutdown(wait=True, cancel_futures=True)
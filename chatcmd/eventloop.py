@@ -0,0 +1,25 @@
+import asyncio
+from typing import Any, Coroutine
+
+LOOPS = ("auto", "uvloop", "asyncio")
+
+
+def uvloop_available() -> bool:
+    try:
+        import uvloop
+    except ImportError:
+        return False
+    return True
+
+
+# Run `main` to completion on the chosen event loop: "auto" takes uvloop when it is
+# installed and the standard library loop otherwise.
+def run(main: Coroutine[Any, Any, Any], loop: str = "auto"):
+    if loop == "asyncio" or (loop == "auto" and not uvloop_available()):
+        return asyncio.run(main)
+    try:
+        import uvloop
+    except ImportError:
+        main.close()
+        raise SystemExit("uvloop is not installed, try pip install uvloop")
+    return uvloop.run(main)
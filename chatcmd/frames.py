@@ -0,0 +1,47 @@
+import json
+from typing import Any
+
+from .protocol import Kind, TextCodec, FramedCodec
+
+# Outbound frames are built once per event and encoded at most once per wire codec;
+# the same bytes object is queued for every recipient speaking that codec.
+
+
+class Frame:
+    __slots__ = ("kind", "payload", "_encoded")
+
+    def __init__(self, kind: Kind, payload: Any = None):
+        self.kind = kind
+        self.payload = payload
+        self._encoded: dict[str, bytes] = {}
+
+    def encode(self, codec: TextCodec | FramedCodec) -> bytes:
+        data = self._encoded.get(codec.name)
+        if data is None:
+            data = self._encoded[codec.name] = codec.encode(self.kind, self.payload)
+        return data
+
+
+ACK = Frame(Kind.ACK)
+
+
+def text_frame(message: str) -> Frame:
+    return Frame(Kind.TEXT, message)
+
+
+# A chat line with the cursor of its position in the room's history.
+def chat_frame(cursor: str, message: str) -> Frame:
+    return Frame(Kind.CHAT, (cursor, message))
+
+
+# JSON string literal for one history line, ready to be spliced into a \PACK frame.
+def pack_fragment(line: str) -> bytes:
+    return json.dumps(line).encode()
+
+
+def pack_frame(cursor: str, fragments: list[bytes]) -> Frame:
+    return Frame(Kind.PACK, (cursor, fragments))
+
+
+def results_frame(cursor: str, fragments: list[bytes]) -> Frame:
+    return Frame(Kind.RESULTS, (cursor, fragments))
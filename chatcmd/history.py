@@ -0,0 +1,66 @@
+from bisect import bisect_left
+from collections import deque
+
+from .db.db_queries import Cursor
+from .frames import pack_fragment
+
+
+# The last `capacity` messages, kept in order as (cursor, encoded JSON "name: text")
+# pairs so recent \LOAD pages are answered without touching the database.
+class HistoryBuffer:
+    def __init__(self, capacity: int = 500, complete: bool = True):
+        self._entries: deque[tuple[Cursor, bytes]] = deque(maxlen=capacity)
+        # True while the buffer holds every stored message, so a short page is final
+        self._complete = complete
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def capacity(self) -> int:
+        return self._entries.maxlen
+
+    # Fill the buffer from the newest stored messages; `complete` means there are no older ones.
+    # Messages appended while they were being queried and newer than all of them are kept.
+    def warm(self, messages: list[tuple[Cursor, str]], complete: bool):
+        newer = [e for e in self._entries if not messages or e[0] > messages[-1][0]]
+        self._entries.clear()
+        self._entries.extend((key, pack_fragment(line)) for key, line in messages)
+        self._entries.extend(newer)
+        self._complete = complete and len(messages) + len(newer) <= self.capacity
+
+    # Messages relayed from other workers can arrive slightly out of order; they are
+    # inserted at their position so the buffer stays sorted by cursor.
+    def append(self, key: Cursor, line: str):
+        entry = (key, pack_fragment(line))
+        if self._entries and key < self._entries[-1][0]:
+            position = bisect_left(self._entries, key, key=lambda entry: entry[0])
+            if len(self._entries) == self.capacity:
+                if position == 0:
+                    self._complete = False
+                    return
+                self._entries.popleft()
+                self._complete = False
+                position -= 1
+            self._entries.insert(position, entry)
+            return
+        if len(self._entries) == self.capacity:
+            self._complete = False
+        self._entries.append(entry)
+
+    # Up to `amount` JSON fragments older than `before` with the cursor of the oldest one,
+    # or None if the page reaches past the buffered window.
+    def page(self, amount: int, before: Cursor) -> tuple[list[bytes], Cursor] | None:
+        end = bisect_left(self._entries, before, key=lambda entry: entry[0])
+        if end < amount and not self._complete:
+            self.misses += 1
+            return None
+        self.hits += 1
+        start = max(end - amount, 0)
+        fragments = [self._entries[i][1] for i in range(start, end)]
+        return fragments, self._entries[start][0] if fragments else before
+
+    def stats(self) -> dict[str, int]:
+        return {"size": len(self), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,160 @@
+import asyncio
+import logging
+from bisect import bisect_left
+from typing import Callable
+
+# upper bounds of the latency buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+# Per-bucket counts plus a running sum: enough to see a latency tail without keeping
+# every sample.
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        # the last count is for values above the largest bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def summary(self) -> dict:
+        labels = [f"<={bound * 1000:g}ms" for bound in self.buckets] + ["inf"]
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count * 1000, 3) if self.count else 0,
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+Metric = Counter | Histogram | Callable[[], float]
+
+
+def _labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in labels.items()
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+# Named metrics rendered in the Prometheus text exposition format. Recording only
+# touches the metric objects; the text is built when the endpoint is scraped, and
+# callables registered with `collect` are only read then.
+class Registry:
+    def __init__(self):
+        # name -> (type, help, {rendered labels: metric})
+        self._families: dict[str, tuple[str, str, dict[str, Metric]]] = {}
+
+    def counter(self, name: str, help: str, **labels: str) -> Counter:
+        return self._get(name, "counter", help, labels, Counter)
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+        **labels: str,
+    ) -> Histogram:
+        return self._get(name, "histogram", help, labels, lambda: Histogram(buckets))
+
+    # Expose a histogram or counter that lives elsewhere, e.g. on the database pool.
+    def add(self, name: str, help: str, metric: Counter | Histogram, **labels: str):
+        kind = "histogram" if isinstance(metric, Histogram) else "counter"
+        self._get(name, kind, help, labels, lambda: metric)
+
+    # A value read at scrape time; `kind` is "gauge", or "counter" for running totals.
+    def collect(
+        self,
+        name: str,
+        help: str,
+        read: Callable[[], float],
+        kind: str = "gauge",
+        **labels: str,
+    ):
+        self._get(name, kind, help, labels, lambda: read)
+
+    def _get(self, name: str, kind: str, help: str, labels: dict, create):
+        family = self._families.setdefault(name, (kind, help, {}))
+        if family[0] != kind:
+            raise ValueError(f"{name} is already registered as a {family[0]}")
+        metrics = family[2]
+        key = _labels(labels)
+        if key not in metrics:
+            metrics[key] = create()
+        return metrics[key]
+
+    def render(self) -> str:
+        lines = []
+        for name, (kind, help, metrics) in self._families.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, metric in metrics.items():
+                if isinstance(metric, Histogram):
+                    lines.extend(_histogram_lines(name, labels, metric))
+                else:
+                    value = metric.value if isinstance(metric, Counter) else metric()
+                    lines.append(f"{name}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _histogram_lines(name: str, labels: str, histogram: Histogram) -> list[str]:
+    # bucket counts are cumulative in the exposition format
+    prefix = labels[1:-1] + "," if labels else ""
+    lines = []
+    cumulative = 0
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{prefix}le="{bound:g}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {histogram.count}')
+    lines.append(f"{name}_sum{labels} {histogram.total}")
+    lines.append(f"{name}_count{labels} {histogram.count}")
+    return lines
+
+
+# Serve the registry over plain HTTP, for `GET /metrics` only.
+async def serve_metrics(registry: Registry, host: str, port: int) -> asyncio.Server:
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 5)
+            method, path, _ = request.split(b" ", 2)
+            if method == b"GET" and path == b"/metrics":
+                status, body = "200 OK", registry.render().encode()
+            else:
+                status, body = "404 Not Found", b"Not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (
+            asyncio.IncompleteReadError,
+            asyncio.LimitOverrunError,
+            asyncio.exceptions.TimeoutError,
+            ConnectionError,
+            ValueError,
+        ):
+            # the scraper went away or did not send an HTTP request
+            pass
+        except Exception as e:
+            logging.exception("Error serving metrics.", exc_info=e)
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
@@ -0,0 +1,191 @@
+import asyncio
+import functools
+import logging
+import os
+import signal
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from collections import Counter
+from types import FrameType
+
+
+class HandlerStats:
+    def __init__(self):
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.max_wall = 0.0
+
+    def record(self, wall: float, cpu: float):
+        self.calls += 1
+        self.wall += wall
+        self.cpu += cpu
+        self.max_wall = max(self.max_wall, wall)
+
+
+# Drives a coroutine step by step, adding up the CPU time of its own steps. Wall time
+# includes every await, so wall much larger than CPU means the handler was waiting.
+# Both are inclusive: a timed handler awaited by another counts towards both.
+class _Timed:
+    def __init__(self, coro, stats: HandlerStats):
+        self._coro = coro
+        self._stats = stats
+
+    def __await__(self):
+        start = time.perf_counter()
+        cpu = 0.0
+        value, error = None, None
+        try:
+            while True:
+                step = time.thread_time()
+                try:
+                    if error is None:
+                        future = self._coro.send(value)
+                    else:
+                        future = self._coro.throw(error)
+                except StopIteration as stop:
+                    return stop.value
+                finally:
+                    cpu += time.thread_time() - step
+                try:
+                    value, error = (yield future), None
+                except BaseException as e:
+                    value, error = None, e
+        finally:
+            self._stats.record(time.perf_counter() - start, cpu)
+
+
+def _frame_name(frame: FrameType) -> str:
+    code = frame.f_code
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _collapse(frame: FrameType | None) -> str:
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+# Opt-in profiling for a running server, all off the hot path when not enabled:
+#  - a watchdog thread logs the event loop's stack whenever it has been blocked for
+#    more than `slow_callback` seconds, while it is still blocked
+#  - instrument() times handler coroutines, see _Timed
+#  - SIGUSR1 samples the loop thread's stack every `interval` seconds for `duration`
+#    seconds and writes the samples in the collapsed format of flamegraph.pl and
+#    speedscope, one "root;...;leaf count" line per distinct stack
+class Profiler:
+    def __init__(
+        self,
+        slow_callback: float = 0.1,
+        interval: float = 0.005,
+        duration: float = 10,
+        directory: str = tempfile.gettempdir(),
+    ):
+        self._slow_callback = slow_callback
+        self._interval = interval
+        self._duration = duration
+        self._directory = directory
+        self.handlers: dict[str, HandlerStats] = {}
+        self.stalls = 0
+        self._loop_thread = 0
+        self._last_tick = 0.0
+        self._stopped = threading.Event()
+        self._sampling = False
+        self._ticker: asyncio.Task | None = None
+
+    # Replace the named coroutine methods of `obj` with timed ones, on the instance only.
+    def instrument(self, obj, names: list[str]):
+        for name in names:
+            method = getattr(obj, name)
+            stats = self.handlers.setdefault(name, HandlerStats())
+
+            @functools.wraps(method)
+            async def timed(*args, _method=method, _stats=stats, **kwargs):
+                return await _Timed(_method(*args, **kwargs), _stats)
+
+            setattr(obj, name, timed)
+
+    # Must be called from the event loop thread.
+    def start(self):
+        loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._ticker = asyncio.create_task(self._tick())
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+        loop.add_signal_handler(signal.SIGUSR1, self.sample)
+
+    def stop(self):
+        self._stopped.set()
+        if self._ticker:
+            self._ticker.cancel()
+        asyncio.get_running_loop().remove_signal_handler(signal.SIGUSR1)
+
+    def report(self) -> str:
+        lines = [
+            f"{'handler':<24}{'calls':>8}{'wall ms':>12}{'cpu ms':>12}{'max ms':>10}"
+        ]
+        for name, stats in sorted(
+            self.handlers.items(), key=lambda item: item[1].wall, reverse=True
+        ):
+            lines.append(
+                f"{name:<24}{stats.calls:>8}{stats.wall * 1000:>12.1f}"
+                f"{stats.cpu * 1000:>12.1f}{stats.max_wall * 1000:>10.1f}"
+            )
+        lines.append(f"event loop blocked {self.stalls} time(s)")
+        return "\n".join(lines)
+
+    # Start a sampling run in the background, unless one is going on already.
+    def sample(self):
+        if self._sampling:
+            return
+        self._sampling = True
+        threading.Thread(target=self._sample, name="stack-sampler", daemon=True).start()
+
+    async def _tick(self):
+        while True:
+            self._last_tick = time.monotonic()
+            await asyncio.sleep(self._slow_callback / 4)
+
+    def _watch(self):
+        reported = 0.0
+        # a tick is due every slow_callback / 4 seconds, so a late one means a stall
+        limit = self._slow_callback * 1.25
+        while not self._stopped.wait(self._slow_callback / 4):
+            tick = self._last_tick
+            blocked = time.monotonic() - tick
+            if blocked > limit and tick != reported:
+                reported = tick
+                self.stalls += 1
+                frame = sys._current_frames().get(self._loop_thread)
+                logging.warning(
+                    "Event loop blocked for %.0f ms so far in:\n%s",
+                    blocked * 1000,
+                    "".join(traceback.format_stack(frame)),
+                )
+
+    def _sample(self):
+        stacks: Counter[str] = Counter()
+        deadline = time.monotonic() + self._duration
+        try:
+            while time.monotonic() < deadline and not self._stopped.is_set():
+                frame = sys._current_frames().get(self._loop_thread)
+                stacks[_collapse(frame)] += 1
+                time.sleep(self._interval)
+            path = os.path.join(
+                self._directory, f"chatcmd-{os.getpid()}-{int(time.time())}.folded"
+            )
+            with open(path, "w") as output:
+                for stack, count in stacks.most_common():
+                    output.write(f"{stack} {count}\n")
+            print(f"Wrote {sum(stacks.values())} stack samples to {path}")
+            print(self.report())
+        except Exception as e:
+            logging.exception("Stack sampling failed.", exc_info=e)
+        finally:
+            self._sampling = False
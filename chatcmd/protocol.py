@@ -0,0 +1,262 @@
+import json
+import re
+import struct
+from asyncio import IncompleteReadError, StreamReader
+from enum import IntEnum
+from typing import Any
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+# What a message means, independent of how it travels on the wire.
+class Kind(IntEnum):
+    TEXT = 1  # server -> client: a line to display
+    ACK = 2  # server -> client: the sequence number of the command, if it had one
+    PACK = 3  # server -> client: (cursor, list of history lines)
+    MESSAGE = 4  # client -> server: a chat line, including its trailing newline
+    LOAD = 5  # client -> server: "amount [cursor]"
+    QUIT = 6  # client -> server
+    TOKEN = 7  # client -> server: asks for a resume token
+    RESUME = 8  # server -> client: a token to reconnect with instead of the password
+    JOIN = 9  # client -> server: the name of the room to switch to
+    PART = 10  # client -> server: go back to the general room
+    ROOM = 11  # server -> client: the room the client is now in
+    DIRECT = 12  # client -> server: "recipient text", including the trailing newline
+    CONVERSATION = 13  # client -> server: "user [amount]", recent direct messages
+    PING = 14  # client -> server: keeps an idle connection alive, never acknowledged
+    SEARCH = 15  # client -> server: "cursor terms", cursor "-" for the first page
+    RESULTS = 16  # server -> client: (cursor, list of result lines), framed like PACK
+    CHAT = 17  # server -> client: (cursor, line), a chat line \LOAD can page back from
+    PASSWD = 18  # client -> server: "current new"
+
+
+# the kinds a client may send
+COMMANDS = frozenset(
+    (
+        Kind.MESSAGE,
+        Kind.LOAD,
+        Kind.QUIT,
+        Kind.TOKEN,
+        Kind.JOIN,
+        Kind.PART,
+        Kind.DIRECT,
+        Kind.CONVERSATION,
+        Kind.PING,
+        Kind.SEARCH,
+        Kind.PASSWD,
+    )
+)
+
+
+class ProtocolError(Exception):
+    pass
+
+
+# A command read from a client: what it is, its text and the client's sequence number,
+# which is None for clients that don't number their commands.
+Command = tuple[Kind, str, int | None]
+
+
+# The original newline-delimited protocol, kept for clients that don't negotiate framing.
+# Numbered commands are prefixed with "\\SEQ <n> " and acknowledged with "\\ACK <n>".
+class TextCodec:
+    name = "text"
+
+    def encode(self, kind: Kind, payload: Any = None, seq: int | None = None) -> bytes:
+        if seq is not None:
+            return f"\\SEQ {seq} ".encode() + self.encode(kind, payload)
+        if kind == Kind.ACK:
+            if payload is not None:
+                return f"\\ACK {payload}\n".encode()
+            return b"\\ACK\n"
+        if kind in (Kind.PACK, Kind.RESULTS):
+            cursor, fragments = payload
+            command = b"\\PACK " if kind == Kind.PACK else b"\\RESULTS "
+            return b"".join(
+                (command, cursor.encode(), b" [", b", ".join(fragments), b"]\n")
+            )
+        if kind == Kind.LOAD:
+            return f"\\LOAD {payload}\n".encode()
+        if kind == Kind.QUIT:
+            return b"\\q\n"
+        if kind == Kind.TOKEN:
+            return b"\\TOKEN\n"
+        if kind == Kind.RESUME:
+            return f"\\RESUME {payload}\n".encode()
+        if kind == Kind.JOIN:
+            return f"\\JOIN {payload}\n".encode()
+        if kind == Kind.PART:
+            return b"\\PART\n"
+        if kind == Kind.ROOM:
+            return f"\\ROOM {payload}\n".encode()
+        if kind == Kind.PING:
+            return b"\\PING\n"
+        if kind == Kind.DIRECT:
+            return f"\\MSG {payload}".encode()
+        if kind == Kind.CONVERSATION:
+            return f"\\DMS {payload}\n".encode()
+        if kind == Kind.SEARCH:
+            return f"\\SEARCH {payload}\n".encode()
+        if kind == Kind.PASSWD:
+            return f"\\PASSWD {payload}\n".encode()
+        if kind == Kind.CHAT:
+            cursor, line = payload
+            return f"\\CHAT {cursor} {line}".encode()
+        return payload.encode()
+
+    # Commands a client sends to the server.
+    async def read_command(self, reader: StreamReader) -> Command | None:
+        line = await reader.readline()
+        if not line:
+            return None
+        message = line.decode()
+        seq = None
+        if match := re.match(r"\\SEQ (\d+) ", message):
+            seq = int(match.group(1))
+            message = message[match.end() :]
+        if re.match(r"\\LOAD", message):
+            return Kind.LOAD, message.removeprefix("\\LOAD").strip(), seq
+        if re.match(r"\\[q|Q]", message):
+            return Kind.QUIT, "", seq
+        if message == "\\PING\n":
+            return Kind.PING, "", seq
+        if message == "\\TOKEN\n":
+            return Kind.TOKEN, "", seq
+        if message.startswith("\\JOIN "):
+            return Kind.JOIN, message.removeprefix("\\JOIN").strip(), seq
+        if message == "\\PART\n":
+            return Kind.PART, "", seq
+        if message.startswith("\\MSG "):
+            return Kind.DIRECT, message.removeprefix("\\MSG "), seq
+        if message.startswith("\\DMS "):
+            return Kind.CONVERSATION, message.removeprefix("\\DMS").strip(), seq
+        if message.startswith("\\SEARCH "):
+            return Kind.SEARCH, message.removeprefix("\\SEARCH").strip(), seq
+        if message.startswith("\\PASSWD "):
+            return Kind.PASSWD, message.removeprefix("\\PASSWD").strip(), seq
+        return Kind.MESSAGE, message, seq
+
+    # Events the server sends to a client.
+    async def read_event(self, reader: StreamReader) -> tuple[Kind, Any] | None:
+        line = await reader.readline()
+        if not line:
+            return None
+        message = line.decode()
+        if message == "\\ACK\n":
+            return Kind.ACK, None
+        if re.fullmatch(r"\\ACK \d+\n", message):
+            return Kind.ACK, int(message[5:])
+        if message.startswith("\\PACK "):
+            _, cursor, pack = message.split(" ", 2)
+            return Kind.PACK, (cursor, json.loads(pack))
+        if message.startswith("\\RESULTS "):
+            _, cursor, results = message.split(" ", 2)
+            return Kind.RESULTS, (cursor, json.loads(results))
+        if message.startswith("\\RESUME "):
+            return Kind.RESUME, message.split()[1]
+        if message.startswith("\\ROOM "):
+            return Kind.ROOM, message.split()[1]
+        if message.startswith("\\CHAT "):
+            _, cursor, line = message.split(" ", 2)
+            return Kind.CHAT, (cursor, line)
+        return Kind.TEXT, message
+
+
+# Length-prefixed frames: a type byte and a 4-byte big-endian payload length, followed
+# by the payload. Text travels as UTF-8; history packs are JSON or, if negotiated, msgpack.
+# A chat line is its cursor, a space and the line.
+# Numbered commands set the high bit of the type byte and start with a 4-byte sequence
+# number; an ACK carries the number it acknowledges as its text.
+class FramedCodec:
+    header = struct.Struct(">BI")
+    seq = struct.Struct(">I")
+    sequenced = 0x80
+    max_payload = 1 << 20
+
+    def __init__(self, use_msgpack: bool = False):
+        self._msgpack = use_msgpack
+        self.name = "framed-msgpack" if use_msgpack else "framed"
+
+    def encode(self, kind: Kind, payload: Any = None, seq: int | None = None) -> bytes:
+        if kind in (Kind.PACK, Kind.RESULTS):
+            body = self._encode_pack(*payload)
+        elif kind == Kind.CHAT:
+            body = " ".join(payload).encode()
+        elif payload is not None:
+            body = str(payload).encode()
+        else:
+            body = b""
+        if seq is not None:
+            return self.header.pack(kind | self.sequenced, len(body) + 4) + (
+                self.seq.pack(seq) + body
+            )
+        return self.header.pack(kind, len(body)) + body
+
+    def _encode_pack(self, cursor: str, fragments: list[bytes]) -> bytes:
+        if self._msgpack:
+            lines = [json.loads(fragment) for fragment in fragments]
+            return msgpack.packb({"cursor": cursor, "messages": lines})
+        return b"".join(
+            (
+                b'{"cursor": "',
+                cursor.encode(),
+                b'", "messages": [',
+                b", ".join(fragments),
+                b"]}",
+            )
+        )
+
+    async def _read_frame(self, reader: StreamReader) -> tuple[int, bytes] | None:
+        try:
+            kind, length = self.header.unpack(
+                await reader.readexactly(self.header.size)
+            )
+            if length > self.max_payload:
+                raise ProtocolError(f"Frame of {length} bytes is too large")
+            return kind, await reader.readexactly(length)
+        except IncompleteReadError:
+            return None
+
+    async def read_command(self, reader: StreamReader) -> Command | None:
+        frame = await self._read_frame(reader)
+        if frame is None:
+            return None
+        kind, body = frame
+        seq = None
+        if kind & self.sequenced:
+            (seq,) = self.seq.unpack_from(body)
+            kind, body = kind & ~self.sequenced, body[self.seq.size :]
+        if kind not in COMMANDS:
+            raise ProtocolError(f"Unexpected frame of type {kind} from client")
+        return Kind(kind), body.decode(), seq
+
+    async def read_event(self, reader: StreamReader) -> tuple[Kind, Any] | None:
+        frame = await self._read_frame(reader)
+        if frame is None:
+            return None
+        kind, body = frame
+        kind = Kind(kind)
+        if kind in (Kind.PACK, Kind.RESULTS):
+            pack = msgpack.unpackb(body) if self._msgpack else json.loads(body)
+            return kind, (pack["cursor"], pack["messages"])
+        if kind == Kind.ACK:
+            return kind, int(body) if body else None
+        if kind == Kind.CHAT:
+            return kind, tuple(body.decode().split(" ", 1))
+        return kind, body.decode() if body else None
+
+
+TEXT = TextCodec()
+
+
+# Pick the codec for the protocol a client asked for at CONNECT; msgpack falls back to
+# JSON framing when it isn't installed.
+def negotiate(requested: str) -> TextCodec | FramedCodec:
+    if requested == "framed-msgpack" and msgpack is not None:
+        return FramedCodec(use_msgpack=True)
+    if requested in ("framed", "framed-msgpack"):
+        return FramedCodec()
+    return TEXT
@@ -2,8 +2,9 @@ import sys
 import asyncio
 from asyncio import StreamReader
 from collections import deque
+from typing import Callable
 
-from .utils import move_back_one_char, clear_screen
+from .utils import move_back_one_char, clear_line
 
 
 async def create_stdin_reader() -> StreamReader:
@@ -14,7 +15,19 @@ async def create_stdin_reader() -> StreamReader:
     return stream_reader
 
 
-async def read_line(stdin_reader: StreamReader) -> str:
+# Escape sequences sent by special keys, e.g. b"\x1b[5~" for Page Up.
+async def read_escape_sequence(stdin_reader: StreamReader) -> bytes:
+    sequence = b"\x1b" + await stdin_reader.read(1)
+    if sequence == b"\x1b[":
+        while not b"\x40" <= (char := await stdin_reader.read(1)) <= b"\x7e":
+            sequence += char
+        sequence += char
+    return sequence
+
+
+async def read_line(
+    stdin_reader: StreamReader, on_key: Callable[[bytes], None] | None = None
+) -> str:
     def erase_last_char():
         move_back_one_char()
         sys.stdout.write(" ")
@@ -23,7 +36,11 @@ async def read_line(stdin_reader: StreamReader) -> str:
     delete_char = b"\x7f"
     input_buffer: deque = deque()
     while (input_char := await stdin_reader.read(1)) != b"\n":
-        if input_char == delete_char:
+        if input_char == b"\x1b":
+            key = await read_escape_sequence(stdin_reader)
+            if on_key:
+                on_key(key)
+        elif input_char == delete_char:
             if len(input_buffer) > 0:
                 input_buffer.pop()
                 erase_last_char()
@@ -32,5 +49,6 @@ async def read_line(stdin_reader: StreamReader) -> str:
             input_buffer.append(input_char)
             sys.stdout.write(input_char.decode())
             sys.stdout.flush()
-    clear_screen()
+    # only the input line is cleared, the messages above it stay on screen
+    clear_line()
     return b"".join(input_buffer).decode()
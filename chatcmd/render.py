@@ -0,0 +1,102 @@
+import asyncio
+import shutil
+import signal
+import sys
+from typing import Callable
+
+from .utils import (
+    clear_screen,
+    delete_line,
+    move_to,
+    reset_scroll_region,
+    restore_cursor_position,
+    save_cursor_position,
+    set_scroll_region,
+)
+
+
+# Draws chat messages into a scroll region above the input line. New messages are written
+# at the bottom of the region and scroll it, and bursts are coalesced into one write per
+# refresh tick. Prepended history and scrolling redraw, and then only the visible rows.
+class TerminalRenderer:
+    def __init__(
+        self,
+        visible: Callable[[int], list[str]],
+        refresh_interval: float = 1 / 30,
+    ):
+        # returns the messages in the viewport for the given number of rows
+        self._visible = visible
+        self._refresh_interval = refresh_interval
+        self._pending: list[str] = []
+        self._redraw = False
+        self._scheduled: asyncio.TimerHandle | None = None
+        self._rows = 0
+
+    # Rows available for messages; the bottom row of the terminal is the input line.
+    @property
+    def height(self) -> int:
+        return self._rows - 1
+
+    def start(self):
+        self._rows = shutil.get_terminal_size()[1]
+        clear_screen()
+        set_scroll_region(1, self._rows - 1)
+        move_to(self._rows)
+        sys.stdout.flush()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGWINCH, self._resized)
+
+    def stop(self):
+        self.flush()
+        asyncio.get_running_loop().remove_signal_handler(signal.SIGWINCH)
+        reset_scroll_region()
+        move_to(self._rows)
+        sys.stdout.write("\n")
+        sys.stdout.flush()
+
+    def appended(self, message: str):
+        self._pending.append(message)
+        self._schedule()
+
+    def redraw(self):
+        self._redraw = True
+        self._schedule()
+
+    def flush(self):
+        if self._scheduled:
+            self._scheduled.cancel()
+            self._scheduled = None
+        if not self._pending and not self._redraw:
+            return
+        save_cursor_position()
+        if self._redraw:
+            # messages still pending are in the store already, so the viewport has them
+            self._draw_viewport()
+        else:
+            self._write(self._pending)
+        self._pending.clear()
+        self._redraw = False
+        restore_cursor_position()
+        sys.stdout.flush()
+
+    def _schedule(self):
+        if self._scheduled is None:
+            loop = asyncio.get_running_loop()
+            self._scheduled = loop.call_later(self._refresh_interval, self.flush)
+
+    def _draw_viewport(self):
+        for row in range(1, self.height + 1):
+            move_to(row)
+            delete_line()
+        self._write(self._visible(self.height))
+
+    def _write(self, messages: list[str]):
+        move_to(self._rows - 1)
+        for message in messages:
+            sys.stdout.write("\n" + message.rstrip("\n"))
+
+    def _resized(self):
+        self._rows = shutil.get_terminal_size()[1]
+        save_cursor_position()
+        set_scroll_region(1, self._rows - 1)
+        restore_cursor_position()
+        self.redraw()
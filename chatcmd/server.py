@@ -1,45 +1,444 @@
 import asyncio
+import argparse
 import logging
-import re
-import json
-from datetime import datetime
+import os
+import secrets
+import signal
+import tempfile
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
 from asyncio import StreamReader, StreamWriter
-import sys
-from .db.db_queries import Database
-from .db.db_config import get_settings
-from .validators import validate_password, validate_username
+from concurrent.futures import ThreadPoolExecutor
+from .auth import CachedUser, ResumeTokens, UserCache
+from .broadcast import HIGH_WATER, LOW_WATER, Broadcaster, Outbox, OverflowPolicy
+from .bus import BusClient
+from .db.db_queries import (
+    FIRST_RESULT,
+    Database,
+    decode_cursor,
+    decode_search_cursor,
+    encode_cursor,
+    encode_search_cursor,
+)
+from .db.models import GENERAL_ROOM, GENERAL_ROOM_ID
+from .db.persister import DirectMessagePersister, MessagePersister
+from .db.pwd import PasswordHasher
+from .frames import (
+    ACK,
+    Frame,
+    chat_frame,
+    pack_fragment,
+    pack_frame,
+    results_frame,
+    text_frame,
+)
+from .history import HistoryBuffer
+from . import eventloop
+from .metrics import Registry, serve_metrics
+from .profiling import Profiler
+from .protocol import COMMANDS, TEXT, FramedCodec, Kind, TextCodec, negotiate
+from .validators import validate_password, validate_room_name, validate_username
 
-from tests.database import LocalDatabase, SQLALCHEMY_DATABASE_URL
+INVALID_LOAD = text_frame("Invalid \\LOAD command.\n")
+INVALID_MSG = text_frame("Usage: \\MSG <user> <text>\n")
+INVALID_DMS = text_frame("Usage: \\DMS <user> [amount]\n")
+INVALID_SEARCH = text_frame("Usage: \\SEARCH <terms>\n")
+INVALID_PASSWD = text_frame("Usage: \\PASSWD <current password> <new password>\n")
+# search results per page
+SEARCH_PAGE = 20
+# shared by every worker, so a token issued by one is accepted by the others
+RESUME_SECRET_ENV = "CHATCMD_RESUME_SECRET"
+CONNECT_RESULTS = ("login", "register", "resume", "rejected", "invalid")
+# coroutines timed by --profile
+PROFILED_HANDLERS = [
+    "client_connected",
+    "_find_user",
+    "_login_user",
+    "_register_user",
+    "_resume_session",
+    "_process_message",
+    "_room_history",
+    "_send_history",
+    "_send_conversation",
+    "_send_search_results",
+    "_switch_room",
+    "_send_direct",
+    "_change_password",
+    "_notify_room",
+    "_acknowledge",
+]
 
 
 class CredentialsError(Exception):
     pass
 
 
+class ClientSession:
+    def __init__(
+        self, user_id: int, joined_at: datetime, codec: TextCodec | FramedCodec
+    ):
+        self.user_id = user_id
+        self.codec = codec
+        # loop time of the last command, PINGs included
+        self.last_seen = asyncio.get_running_loop().time()
+        self.room = GENERAL_ROOM
+        self.room_id = GENERAL_ROOM_ID
+        # history requests without a cursor start from the moment the user joined the room
+        self.joined_at = joined_at
+        # highest command sequence number handled; commands arrive in order, so any
+        # number at or below it is a retransmit
+        self.last_seq = 0
+        # this connection's outbox; a reconnect under the same name replaces both
+        self.outbox: Outbox | None = None
+
+
 class ChatServer:
-    def __init__(self, run_local: bool):
-        self._username_to_writer: dict[str, StreamWriter] = {}
+    def __init__(
+        self,
+        run_local: bool,
+        queue_size: int = 256,
+        overflow_policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST,
+        batch_size: int = 100,
+        flush_interval: float = 0.2,
+        hasher: PasswordHasher | None = None,
+        history_size: int = 500,
+        bus_path: str | None = None,
+        worker: int = 0,
+        db_stats_interval: float = 0,
+        user_cache: UserCache | None = None,
+        resume_tokens: ResumeTokens | None = None,
+        room_buffers: int = 64,
+        idle_timeout: float = 60,
+        write_limits: tuple[int, int] = (HIGH_WATER, LOW_WATER),
+        max_lag: float = 0,
+        client_stats_interval: float = 0,
+        metrics_port: int | None = None,
+        profiler: Profiler | None = None,
+        backlog: int = 1024,
+    ):
+        self._hasher = hasher or PasswordHasher()
+        self._broadcaster = Broadcaster(
+            self._remove_user, queue_size, overflow_policy, *write_limits, max_lag
+        )
+        self._sessions: dict[str, ClientSession] = {}
+        # backends are imported only when used: the sqlite one lives with the tests and
+        # the Postgres settings load the .env file
+        self._run_local = run_local
         if run_local:
-            self._db = LocalDatabase(SQLALCHEMY_DATABASE_URL)
+            from tests.database import LocalDatabase, SQLALCHEMY_DATABASE_URL
+
+            self._db = LocalDatabase(SQLALCHEMY_DATABASE_URL, self._hasher)
             print("Running local database")
         else:
+            from .db.archive import MessageArchive
+            from .db.db_config import get_settings
+
             settings = get_settings()
             if not settings.env_set():
                 raise EnvironmentError(
                     "Could not find necessary env variables, got: ",
                     settings.describe_env(),
                 )
-            self._db = Database(settings.DATABASE_URL)
+            self._db = Database(
+                settings.DATABASE_URL,
+                self._hasher,
+                settings.pool_options(),
+                settings.DB_SLOW_STATEMENT,
+                settings.DB_ARCHIVE_DIR and MessageArchive(settings.DB_ARCHIVE_DIR),
+            )
             print("Running server database")
+        self._persister = MessagePersister(self._db, batch_size, flush_interval)
+        self._direct_persister = DirectMessagePersister(
+            self._db, batch_size, flush_interval
+        )
+        # local members of each room, so a message only touches that room's outboxes
+        self._rooms: dict[str, set[str]] = {GENERAL_ROOM: set()}
+        self._room_ids = {GENERAL_ROOM: GENERAL_ROOM_ID}
+        # recent history of the rooms used lately, least recently used first
+        self._histories: OrderedDict[str, HistoryBuffer] = OrderedDict()
+        self._history_size = history_size
+        self._room_buffers = room_buffers
+        self._idle_timeout = idle_timeout
+        self._client_stats_interval = client_stats_interval
+        self._last_stamp = datetime.min
+        # in --workers mode, events are shared with the other workers through the bus
+        self._bus = (
+            BusClient(bus_path, worker, self._on_bus_event) if bus_path else None
+        )
+        self._remote_online: dict[int, int] = {}
+        self._db_stats_interval = db_stats_interval
+        self._users = user_cache or UserCache()
+        self._resume_tokens = resume_tokens
+        # recorded all the time, rendered only when scraped on `metrics_port`
+        self._metrics_port = metrics_port
+        self._metrics = Registry()
+        self._connects = {
+            result: self._metrics.counter(
+                "chatcmd_connects_total",
+                "Connection attempts by outcome",
+                result=result,
+            )
+            for result in CONNECT_RESULTS
+        }
+        self._auth_lookup = self._metrics.histogram(
+            "chatcmd_auth_seconds", "Time spent authenticating clients", stage="lookup"
+        )
+        self._command_time = {
+            kind: self._metrics.histogram(
+                "chatcmd_command_seconds",
+                "Time to process a client command",
+                kind=kind.name.lower(),
+            )
+            for kind in COMMANDS - {Kind.PING}
+        }
+        self._loop_lag = self._metrics.histogram(
+            "chatcmd_event_loop_lag_seconds", "How late a periodic timer fired"
+        )
+        self._register_metrics()
+        self._profiler = profiler
+        self._backlog = backlog
+        if profiler:
+            profiler.instrument(self, PROFILED_HANDLERS)
 
     async def start_chat_server(self, host: str, port: int):
-        if type(self._db) == LocalDatabase:
+        # with several workers the supervisor recreates the tables once before starting them
+        if self._run_local and not self._bus:
             await self._db.recreate_tables()
 
-        server = await asyncio.start_server(self.client_connected, host, port)
+        if self._profiler:
+            self._profiler.start()
+        await self._room_history(GENERAL_ROOM)
+        self._persister.start()
+        self._direct_persister.start()
+        stop = asyncio.Event()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+        if self._bus:
+            # a worker cut off from the others would serve a partial chat, so it stops
+            await self._bus.connect(on_close=stop.set)
+        # asyncio's default backlog of 100 overflows in a reconnect storm, and every
+        # dropped SYN costs that client a one second retransmit
+        server = await asyncio.start_server(
+            self.client_connected,
+            host,
+            port,
+            reuse_port=bool(self._bus),
+            backlog=self._backlog,
+        )
+        background = [asyncio.create_task(self._reap_idle())]
+        if self._db_stats_interval:
+            background.append(asyncio.create_task(self._report_db_stats()))
+        if self._client_stats_interval:
+            background.append(asyncio.create_task(self._report_client_stats()))
+        metrics_server = None
+        if self._metrics_port:
+            metrics_server = await serve_metrics(
+                self._metrics, "127.0.0.1", self._metrics_port
+            )
+            background.append(asyncio.create_task(self._measure_loop_lag()))
+            print(f"Serving metrics on http://127.0.0.1:{self._metrics_port}/metrics")
+        try:
+            await stop.wait()
+        finally:
+            # stop accepting clients, then store every message still waiting to be written
+            server.close()
+            if metrics_server:
+                metrics_server.close()
+            for task in background:
+                task.cancel()
+            if self._bus:
+                await self._bus.close()
+            await self._persister.close()
+            await self._direct_persister.close()
+            await self._db.close()
+            self._hasher.shutdown()
+            print(f"Server stopped, history buffers: {self._history_stats()}")
+            print(f"User cache: {self._users.stats()}")
+            print(f"Database pool: {self._db.pool_stats()}")
+            if self._profiler:
+                self._profiler.stop()
+                print(self._profiler.report())
+
+    # One sweep for all connections: clients that sent nothing, not even a PING, for
+    # `idle_timeout` seconds are disconnected together. Closing their connection ends
+    # their _listen_for_messages, which tells the room they left.
+    async def _reap_idle(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self._idle_timeout / 4)
+            deadline = loop.time() - self._idle_timeout
+            idle = [
+                (username, session)
+                for username, session in self._sessions.items()
+                if session.last_seen < deadline
+            ]
+            for username, _ in idle:
+                print(f"Client {username} timed out")
+            # a peer that stopped reading can't take what is still queued for it
+            await asyncio.gather(
+                *(
+                    self._broadcaster.remove(name, 0, session.outbox)
+                    for name, session in idle
+                )
+            )
+            for username, session in idle:
+                await self._remove_user(username, session)
+
+    async def _report_db_stats(self):
+        while True:
+            await asyncio.sleep(self._db_stats_interval)
+            print(f"Database pool: {self._db.pool_stats()}")
+
+    async def _measure_loop_lag(self, interval: float = 0.5):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            self._loop_lag.observe(max(loop.time() - start - interval, 0))
+
+    # Metrics kept by the broadcaster, hasher and database, and values read on scrape.
+    def _register_metrics(self):
+        metrics = self._metrics
+        broadcaster = self._broadcaster
+        metrics.collect(
+            "chatcmd_clients", "Clients connected to this server", broadcaster.__len__
+        )
+        metrics.collect(
+            "chatcmd_rooms", "Rooms with clients on this server", self._rooms.__len__
+        )
+        metrics.add(
+            "chatcmd_auth_seconds",
+            "Time spent authenticating clients",
+            self._hasher.duration,
+            stage="bcrypt",
+        )
+        metrics.add(
+            "chatcmd_broadcast_seconds",
+            "Time to queue a message for all of its recipients",
+            broadcaster.fanout_time,
+        )
+        metrics.add(
+            "chatcmd_broadcast_recipients",
+            "Recipients per broadcast",
+            broadcaster.fanout_size,
+        )
+        metrics.collect(
+            "chatcmd_slow_client_evictions_total",
+            "Clients disconnected for falling too far behind",
+            lambda: broadcaster.evicted,
+            "counter",
+        )
+        metrics.collect(
+            "chatcmd_user_cache_hits_total",
+            "Logins that found the user in the cache",
+            lambda: self._users.hits,
+            "counter",
+        )
+        metrics.collect(
+            "chatcmd_user_cache_misses_total",
+            "Logins that looked the user up in the database",
+            lambda: self._users.misses,
+            "counter",
+        )
+        for table, persister in (
+            ("message", self._persister),
+            ("direct_message", self._direct_persister),
+        ):
+            metrics.collect(
+                "chatcmd_persist_retries_total",
+                "Message batches written again after a failed INSERT",
+                lambda persister=persister: persister.retried,
+                "counter",
+                table=table,
+            )
+            metrics.collect(
+                "chatcmd_persist_failed_total",
+                "Acknowledged messages that could not be stored",
+                lambda persister=persister: persister.failed,
+                "counter",
+                table=table,
+            )
+        for method, histogram in self._db.method_time.items():
+            metrics.add(
+                "chatcmd_db_method_seconds",
+                "Duration of database calls",
+                histogram,
+                method=method,
+            )
+        metrics.add(
+            "chatcmd_db_statement_seconds",
+            "Duration of SQL statements",
+            self._db.statements.duration,
+        )
+        metrics.collect(
+            "chatcmd_db_statement_errors_total",
+            "SQL statements that failed",
+            lambda: self._db.statements.errors,
+            "counter",
+        )
+        metrics.add(
+            "chatcmd_db_pool_wait_seconds",
+            "Time to check a connection out of the pool",
+            self._db.pool.wait_time,
+        )
+        metrics.collect(
+            "chatcmd_db_pool_checked_out",
+            "Connections in use",
+            lambda: self._db.pool.checkedout(),
+        )
+        metrics.collect(
+            "chatcmd_db_pool_waiting",
+            "Checkouts waiting for a free connection",
+            lambda: self._db.pool.waiting,
+        )
+        metrics.collect(
+            "chatcmd_db_pool_timeouts_total",
+            "Checkouts that gave up waiting",
+            lambda: self._db.pool.timeouts,
+            "counter",
+        )
+
+    # The clients with the most data waiting are the ones holding broadcasts back.
+    async def _report_client_stats(self):
+        while True:
+            await asyncio.sleep(self._client_stats_interval)
+            print(f"Slowest clients: {self._broadcaster.client_stats(limit=10)}")
+            print(f"Evicted for lagging: {self._broadcaster.evicted}")
+
+    # The room's history buffer, filled from the database the first time it is used.
+    async def _room_history(self, room: str) -> HistoryBuffer:
+        if history := self._histories.get(room):
+            self._histories.move_to_end(room)
+            return history
+        # registered before the query, so messages sent meanwhile are not missed
+        history = self._histories[room] = HistoryBuffer(
+            self._history_size, complete=False
+        )
+        messages = await self._db.get_messages(
+            self._history_size, (datetime.now(), 0), self._room_ids[room]
+        )
+        history.warm(
+            [((m.timestamp, m.id), f"{m.user.name}: {m.text}") for m in messages],
+            complete=len(messages) < self._history_size,
+        )
+        self._evict_histories(keep=room)
+        return history
+
+    # Drop the buffers of the least recently used rooms nobody here is in, except `keep`,
+    # which a user is about to join.
+    def _evict_histories(self, keep: str):
+        idle = [
+            room
+            for room in self._histories
+            if room != keep and not self._rooms.get(room)
+        ]
+        for room in idle[: max(len(self._histories) - self._room_buffers, 0)]:
+            del self._histories[room]
 
-        async with server:
-            await server.serve_forever()
+    def _history_stats(self) -> dict[str, int]:
+        stats = [history.stats() for history in self._histories.values()]
+        totals = {key: sum(s[key] for s in stats) for key in ("size", "hits", "misses")}
+        return {"rooms": len(stats), **totals}
 
     # Wait for the client to provide a valid username command; otherwise, disconnect them.
     async def client_connected(self, reader: StreamReader, writer: StreamWriter):  # A
@@ -47,148 +446,659 @@ class ChatServer:
         print(f"CONNECTED {reader} {writer}")
 
         try:
-            command, name, pwd = command.decode().strip().split(" ")
-            if command != "CONNECT":
+            # an optional fourth token opts into a framed protocol, e.g. "framed";
+            # RESUME carries a resume token in place of the password
+            command, name, pwd, *protocol = command.decode().strip().split(" ")
+            if command not in ("CONNECT", "RESUME") or len(protocol) > 1:
                 raise ValueError
         except:
             await self._reject_client(
                 writer,
+                TEXT,
                 client_message="Invalid command.\n",
                 server_message="Got invalid command from client, disconnecting.",
             )
+            self._connects["invalid"].inc()
             return
 
-        user = await self._db.get_user_by_name(name)
+        codec = TEXT
+        if protocol:
+            codec = negotiate(protocol[0])
+            # confirmed in the text protocol, everything after this line uses the codec
+            writer.write(f"\\PROTOCOL {codec.name}\n".encode())
+
+        start = time.perf_counter()
+        user = await self._find_user(name)
+        self._auth_lookup.observe(time.perf_counter() - start)
         try:
-            if user:
-                await self._login_user(writer, name, pwd)
+            if command == "RESUME":
+                user_id = await self._resume_session(writer, codec, name, user, pwd)
+                result = "resume"
+            elif user:
+                user_id = await self._login_user(writer, codec, user, pwd)
+                result = "login"
             else:
-                await self._register_user(writer, name, pwd)
+                user_id = await self._register_user(writer, codec, name, pwd)
+                result = "register"
         except CredentialsError:
+            self._connects["rejected"].inc()
+            # the password may have changed since the user was cached
+            self._users.invalidate(name)
             await self._reject_client(
                 writer,
+                codec,
                 client_message="Invalid credentials.\n",
                 server_message="Client authentication failed, disconnecting",
             )
             return
 
-        self._add_user(name, reader, writer)
+        self._connects[result].inc()
+        self._add_user(name, user_id, codec, reader, writer)
         await self._on_connect(name, writer)
 
     async def _reject_client(
         self,
         writer: StreamWriter,
+        codec: TextCodec | FramedCodec,
         client_message: str | None = None,
         server_message: str | None = None,
     ):
         if server_message:
             logging.error(server_message)
         if client_message:
-            writer.write(client_message.encode())
+            writer.write(codec.encode(Kind.TEXT, client_message))
             await writer.drain()
         writer.close()
         await writer.wait_closed()
 
-    async def _login_user(self, writer: StreamWriter, username: str, password: str):
-        login = await self._db.login_user(username, password)
-        if not login:
+    async def _login_user(
+        self,
+        writer: StreamWriter,
+        codec: TextCodec | FramedCodec,
+        user: CachedUser,
+        password: str,
+    ) -> int:
+        if not await self._db.verify_password(password, user.password_hash):
             raise CredentialsError
-        writer.write("Login successful\n".encode())
+        writer.write(codec.encode(Kind.TEXT, "Login successful\n"))
         await writer.drain()
+        return user.id
 
-    async def _register_user(self, writer: StreamWriter, username: str, password: str):
+    async def _register_user(
+        self,
+        writer: StreamWriter,
+        codec: TextCodec | FramedCodec,
+        username: str,
+        password: str,
+    ) -> int:
         valid_pwd = validate_password(password)
         valid_name = validate_username(username)
         if not valid_pwd or not valid_name:
             raise CredentialsError
-        await self._db.add_user(username, password)
-        writer.write("Registration successful\n".encode())
+        user = await self._db.add_user(username, password)
+        self._users.put(username, user.id, user.password_hash)
+        writer.write(codec.encode(Kind.TEXT, "Registration successful\n"))
         await writer.drain()
+        return user.id
+
+    # A valid token stands in for the password, skipping the bcrypt verify.
+    async def _resume_session(
+        self,
+        writer: StreamWriter,
+        codec: TextCodec | FramedCodec,
+        username: str,
+        user: CachedUser | None,
+        token: str,
+    ) -> int:
+        if not user or not self._resume_tokens:
+            raise CredentialsError
+        if not self._resume_tokens.verify(token, username, user.password_hash):
+            raise CredentialsError
+        writer.write(codec.encode(Kind.TEXT, "Session resumed\n"))
+        await writer.drain()
+        return user.id
+
+    async def _find_user(self, username: str) -> CachedUser | None:
+        if user := self._users.get(username):
+            return user
+        row = await self._db.get_user_for_auth(username)
+        if row:
+            return self._users.put(username, row.id, row.password_hash)
+        return None
+
+    # The current password is checked like at login. Dropping the cached user here and,
+    # through the bus, on the other workers also revokes the user's resume tokens, which
+    # are signed with the old hash.
+    async def _change_password(self, username: str, message: str):
+        current, _, password = message.partition(" ")
+        if not current or not password or " " in password:
+            await self._broadcaster.send(username, INVALID_PASSWD)
+            return
+        user = await self._find_user(username)
+        if not user or not await self._db.verify_password(current, user.password_hash):
+            reply = "Wrong password.\n"
+        elif not validate_password(password):
+            reply = "The new password needs 3 letters, 3 digits and 3 symbols.\n"
+        else:
+            await self._db.set_password(username, password)
+            self._users.invalidate(username)
+            if self._bus:
+                self._bus.publish({"type": "invalidate", "name": username})
+            reply = "Password changed.\n"
+        await self._broadcaster.send(username, text_frame(reply))
 
-    # Store a user’s stream writer instance and create a task to listen for messages.
-    def _add_user(self, username: str, reader: StreamReader, writer: StreamWriter):  # B
-        self._username_to_writer[username] = writer
-        asyncio.create_task(self._listen_for_messages(username, reader))
+    # Give the user an outbound queue with its own writer task and create a task to listen for messages.
+    def _add_user(
+        self,
+        username: str,
+        user_id: int,
+        codec: TextCodec | FramedCodec,
+        reader: StreamReader,
+        writer: StreamWriter,
+    ):  # B
+        session = ClientSession(user_id, datetime.now(), codec)
+        self._sessions[username] = session
+        self._rooms[GENERAL_ROOM].add(username)
+        session.outbox = self._broadcaster.add(username, writer, codec)
+        self._publish_presence()
+        asyncio.create_task(self._listen_for_messages(username, session, reader))
 
     # Once a user connects, notify all others that they have connected.
     async def _on_connect(self, username: str, writer: StreamWriter):  # C
-        writer.write(
-            f"Welcome! {len(self._username_to_writer)} user(s) are online!\n".encode()
+        await self._broadcaster.send(
+            username,
+            text_frame(f"Welcome! {self._online()} user(s) are online!\n"),
         )
-        await writer.drain()
-        await self._notify_all(f"{username} connected!\n")
+        await self._notify_room(GENERAL_ROOM, f"{username} connected!\n")
 
-    async def _remove_user(self, username: str):
-        writer = self._username_to_writer[username]
-        del self._username_to_writer[username]
-        try:
-            writer.close()
-            await writer.wait_closed()
-        except Exception as e:
-            logging.exception("Error closing client writer, ignoring.", exc_info=e)
+    # Remove the user's current session, or only `session` if given: after a reconnect
+    # under the same name the old connection must not take the new one down with it.
+    # Returns whether a session was removed.
+    async def _remove_user(
+        self, username: str, session: ClientSession | None = None
+    ) -> bool:
+        current = self._sessions.get(username)
+        if session is not None and session is not current:
+            await self._broadcaster.remove(username, outbox=session.outbox)
+            return False
+        if current:
+            del self._sessions[username]
+            self._leave_room(username, current.room)
+        await self._broadcaster.remove(username, outbox=current and current.outbox)
+        self._publish_presence()
+        return current is not None
+
+    # Users connected to this worker plus those reported by the other workers.
+    def _online(self) -> int:
+        return len(self._broadcaster) + sum(self._remote_online.values())
+
+    def _publish_presence(self):
+        if self._bus:
+            self._bus.publish({"type": "presence", "count": len(self._broadcaster)})
+
+    async def _on_bus_event(self, event: dict):
+        if event["type"] == "presence":
+            self._remote_online[event["worker"]] = event["count"]
+        elif event["type"] == "direct":
+            if event["to"] in self._broadcaster:
+                await self._broadcaster.send(event["to"], text_frame(event["text"]))
+        elif event["type"] == "invalidate":
+            self._users.invalidate(event["name"])
+        elif event["type"] == "message":
+            room = event["room"]
+            timestamp = None
+            if "timestamp" in event:
+                timestamp = datetime.fromisoformat(event["timestamp"])
+                # rooms without a buffer here are read from the database when joined
+                if history := self._histories.get(room):
+                    history.append((timestamp, 0), event["text"])
+            if members := self._rooms.get(room):
+                frame = self._room_frame(event["text"], timestamp)
+                await self._broadcaster.broadcast(frame, members)
 
-    # Listen for messages from a client and send them to all other clients, waiting a maximum of a minute for a message.
-    async def _listen_for_messages(self, username: str, reader: StreamReader):  # D
+    # Listen for messages from a client and send them to all other clients; idle clients are
+    # disconnected by _reap_idle, so reads here have no timeout of their own.
+    async def _listen_for_messages(
+        self, username: str, session: ClientSession, reader: StreamReader
+    ):  # D
+        loop = asyncio.get_running_loop()
         try:
-            while (data := await asyncio.wait_for(reader.readline(), 60)) != b"":
-                await self._process_message(username, data.decode())
-            await self._notify_all(f"{username} has left the chat\n")
-        except asyncio.exceptions.TimeoutError as e:
-            print(f"Client {username} timed out")
-            await self._remove_user(username)
+            while command := await session.codec.read_command(reader):
+                if self._sessions.get(username) is not session:
+                    return  # replaced by a newer connection under the same name
+                session.last_seen = loop.time()
+                if command[0] != Kind.PING:
+                    start = time.perf_counter()
+                    await self._process_message(username, *command)
+                    elapsed = time.perf_counter() - start
+                    self._command_time[command[0]].observe(elapsed)
+            if await self._remove_user(username, session):
+                await self._notify_room(session.room, f"{username} has left the chat\n")
         except Exception as e:
             logging.exception("Error reading from client.", exc_info=e)
-            await self._remove_user(username)
-
-    async def _process_message(self, username: str, message: str):
-        if re.match(r"\\LOAD", message):
-            await self._acknowledge(username)
-            _, amount, offset = message.strip().split(" ")
-            messages = await self._db.get_messages(int(amount), offset, datetime.now())
-            prep_messages = [f"{x.user.name}: {x.text}" for x in messages]
-            messages_json = "\PACK " + json.dumps(prep_messages) + "\n"
-            writer = self._username_to_writer[username]
-            writer.write(messages_json.encode())
-            await writer.drain()
-        elif re.match(r"\\[q|Q]", message):
-            await self._acknowledge(username)
+            await self._remove_user(username, session)
+
+    async def _process_message(
+        self, username: str, kind: Kind, message: str, seq: int | None = None
+    ):
+        session = self._sessions[username]
+        if seq is not None:
+            if seq <= session.last_seq:
+                # handled already, only the ACK went missing or arrived late
+                await self._acknowledge(username, seq)
+                return
+            session.last_seq = seq
+
+        if kind == Kind.LOAD:
+            await self._acknowledge(username, seq)
+            await self._send_history(username, message.split())
+        elif kind in (Kind.JOIN, Kind.PART):
+            await self._switch_room(username, message or GENERAL_ROOM, seq)
+        elif kind == Kind.DIRECT:
+            await self._send_direct(username, message, seq)
+        elif kind == Kind.CONVERSATION:
+            await self._acknowledge(username, seq)
+            await self._send_conversation(username, message.split())
+        elif kind == Kind.SEARCH:
+            await self._acknowledge(username, seq)
+            await self._send_search_results(username, message)
+        elif kind == Kind.TOKEN:
+            await self._acknowledge(username, seq)
+            await self._issue_resume_token(username)
+        elif kind == Kind.PASSWD:
+            await self._acknowledge(username, seq)
+            await self._change_password(username, message)
+        elif kind == Kind.QUIT:
+            await self._acknowledge(username, seq)
             print(f"Closing {username} connection")
-            await self._remove_user(username)
+            await self._remove_user(username, session)
         else:
-            await self._db.add_message(username, message)
-            await self._acknowledge(username)
-            await self._notify_all(f"{username}: {message}")
+            timestamp = self._stamp()
+            room = session.room
+            await self._persister.put(
+                session.user_id, message, timestamp, session.room_id
+            )
+            # the id is only known once the row is written; timestamps are unique per
+            # server so (timestamp, 0) orders the message correctly for cursors
+            history = await self._room_history(room)
+            history.append((timestamp, 0), f"{username}: {message}")
+            await self._acknowledge(username, seq)
+            await self._notify_room(room, f"{username}: {message}", timestamp)
 
-    async def _acknowledge(self, username: str):
-        writer = self._username_to_writer[username]
-        writer.write(f"\ACK\n".encode())
-        await writer.drain()
+    # Move the user to another room. The \ROOM frame goes out before anything from the
+    # new room, so the client can clear the old room's messages up to that point.
+    async def _switch_room(self, username: str, room: str, seq: int | None):
+        session = self._sessions[username]
+        if not validate_room_name(room) or room == session.room:
+            await self._acknowledge(username, seq)
+            reply = f"Already in #{room}.\n" if room == session.room else None
+            await self._broadcaster.send(
+                username, text_frame(reply or "Invalid room name.\n")
+            )
+            return
+        if room not in self._room_ids:
+            self._room_ids[room] = await self._db.get_room_id(room)
+        await self._room_history(room)
+        if self._sessions.get(username) is not session:
+            return  # disconnected meanwhile
+
+        old_room = session.room
+        self._leave_room(username, old_room)
+        self._rooms.setdefault(room, set()).add(username)
+        session.room, session.room_id = room, self._room_ids[room]
+        session.joined_at = datetime.now()
+        await self._broadcaster.send(username, Frame(Kind.ROOM, room))
+        await self._acknowledge(username, seq)
+        await self._notify_room(old_room, f"{username} left #{old_room}\n")
+        await self._notify_room(room, f"{username} joined #{room}\n")
+
+    # A direct message goes to the sender's and the recipient's outboxes only, found by
+    # name; the rooms and the broadcast path are not involved.
+    async def _send_direct(self, username: str, message: str, seq: int | None):
+        recipient, _, text = message.partition(" ")
+        user = await self._find_user(recipient) if text.strip() else None
+        await self._acknowledge(username, seq)
+        if not text.strip():
+            await self._broadcaster.send(username, INVALID_MSG)
+            return
+        if not user:
+            await self._broadcaster.send(
+                username, text_frame(f"No such user: {recipient}\n")
+            )
+            return
+        sender_id = self._sessions[username].user_id
+        await self._direct_persister.put(sender_id, user.id, text, self._stamp())
+
+        frame = text_frame(f"{username} -> {recipient}: {text}")
+        await self._broadcaster.send(username, frame)
+        if recipient == username:
+            return
+        if recipient in self._broadcaster:
+            await self._broadcaster.send(recipient, frame)
+        elif self._bus:
+            # the worker the recipient is connected to, if any, delivers it
+            self._bus.publish(
+                {"type": "direct", "to": recipient, "text": frame.payload}
+            )
+        else:
+            await self._broadcaster.send(
+                username,
+                text_frame(f"{recipient} is offline, they can read it with \\DMS.\n"),
+            )
+
+    # The latest direct messages between the user and someone else, as plain lines.
+    async def _send_conversation(self, username: str, args: list[str]):
+        try:
+            other = args[0]
+            amount = int(args[1]) if len(args) > 1 else 20
+        except (IndexError, ValueError):
+            await self._broadcaster.send(username, INVALID_DMS)
+            return
+        user = await self._find_user(other)
+        if not user:
+            await self._broadcaster.send(
+                username, text_frame(f"No such user: {other}\n")
+            )
+            return
+        session = self._sessions[username]
+        messages = await self._db.get_direct_messages(
+            session.user_id, user.id, amount, (datetime.now(), 0)
+        )
+        if not messages:
+            await self._broadcaster.send(
+                username, text_frame(f"No direct messages with {other}.\n")
+            )
+        for m in messages:
+            recipient = other if m.sender_id == session.user_id else username
+            await self._broadcaster.send(
+                username, text_frame(f"{m.sender.name} -> {recipient}: {m.text}")
+            )
+
+    def _leave_room(self, username: str, room: str):
+        members = self._rooms.get(room)
+        if members is None:
+            return
+        members.discard(username)
+        if not members and room != GENERAL_ROOM:
+            del self._rooms[room]
+
+    # Send a page of history older than the client's cursor along with the cursor for the next page.
+    async def _send_history(self, username: str, args: list[str]):
+        session = self._sessions[username]
+        try:
+            amount = int(args[0])
+            if len(args) > 1:
+                before = decode_cursor(args[1])
+            else:
+                before = (session.joined_at, 0)
+        except (IndexError, ValueError):
+            await self._broadcaster.send(username, INVALID_LOAD)
+            return
+        history = await self._room_history(session.room)
+        page = history.page(amount, before)
+        if page is not None:
+            fragments, before = page
+        else:
+            messages = await self._db.get_messages(amount, before, session.room_id)
+            if messages:
+                before = (messages[0].timestamp, messages[0].id)
+            fragments = [pack_fragment(f"{x.user.name}: {x.text}") for x in messages]
+        await self._broadcaster.send(
+            username, pack_frame(encode_cursor(before), fragments)
+        )
 
-    # Send a message to all connected clients, removing any disconnected users.
-    async def _notify_all(self, message: str):  # E
-        inactive_users = []
-        for username, writer in self._username_to_writer.items():
-            try:
-                writer.write(message.encode())
-                await writer.drain()
-            except ConnectionError as e:
-                logging.exception("Could not write to client.", exc_info=e)
-                inactive_users.append(username)
+    # A page of the current room's messages matching the terms, best match first, with the
+    # cursor for the next page. Always answered from the database's full-text index.
+    async def _send_search_results(self, username: str, message: str):
+        session = self._sessions[username]
+        cursor, _, terms = message.partition(" ")
+        try:
+            after = FIRST_RESULT if cursor == "-" else decode_search_cursor(cursor)
+        except ValueError:
+            terms = ""
+        if not terms.strip():
+            await self._broadcaster.send(username, INVALID_SEARCH)
+            return
+        results = await self._db.search_messages(
+            terms, SEARCH_PAGE, after, session.room_id
+        )
+        if results:
+            last, score = results[-1]
+            after = (score, last.id)
+        fragments = [
+            pack_fragment(f"[{m.timestamp:%Y-%m-%d %H:%M}] {m.user.name}: {m.text}")
+            for m, _ in results
+        ]
+        await self._broadcaster.send(
+            username, results_frame(encode_search_cursor(after), fragments)
+        )
 
-        [await self._remove_user(username) for username in inactive_users]
+    async def _issue_resume_token(self, username: str):
+        user = await self._find_user(username)
+        if self._resume_tokens and user:
+            token = self._resume_tokens.issue(username, user.password_hash)
+            await self._broadcaster.send(username, Frame(Kind.RESUME, token))
 
+    # Strictly increasing timestamps, so no two messages share a history position.
+    def _stamp(self) -> datetime:
+        now = datetime.now()
+        if now <= self._last_stamp:
+            now = self._last_stamp + timedelta(microseconds=1)
+        self._last_stamp = now
+        return now
 
-async def main():
+    async def _acknowledge(self, username: str, seq: int | None = None):
+        await self._broadcaster.send(
+            username, ACK if seq is None else Frame(Kind.ACK, seq)
+        )
+
+    # Encode the message once and enqueue the same frame for every member of the room without waiting on any of them.
+    # Chat messages carry their timestamp so other workers can add them to their history,
+    # and their cursor so clients can page back from them.
+    async def _notify_room(
+        self, room: str, message: str, timestamp: datetime | None = None
+    ):  # E
+        if self._bus:
+            event = {"type": "message", "room": room, "text": message}
+            if timestamp:
+                event["timestamp"] = timestamp.isoformat()
+            self._bus.publish(event)
+        if members := self._rooms.get(room):
+            await self._broadcaster.broadcast(
+                self._room_frame(message, timestamp), members
+            )
+
+    # Same (timestamp, 0) cursor the history buffer keys the message by.
+    def _room_frame(self, message: str, timestamp: datetime | None) -> Frame:
+        if timestamp is None:
+            return text_frame(message)
+        return chat_frame(encode_cursor((timestamp, 0)), message)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m chatcmd.server")
+    parser.add_argument("mode", nargs="?", choices=["run_local"])
+    parser.add_argument(
+        "--loop",
+        choices=eventloop.LOOPS,
+        default="auto",
+        help="event loop implementation, auto uses uvloop when it is installed",
+    )
+    parser.add_argument(
+        "--backlog",
+        type=int,
+        default=1024,
+        help="pending connections the kernel queues, capped by net.core.somaxconn",
+    )
+    parser.add_argument("--queue-size", type=int, default=256)
+    parser.add_argument(
+        "--overflow-policy",
+        choices=[policy.value for policy in OverflowPolicy],
+        default=OverflowPolicy.DROP_OLDEST.value,
+    )
+    parser.add_argument(
+        "--write-buffer",
+        type=int,
+        nargs=2,
+        default=[HIGH_WATER, LOW_WATER],
+        metavar=("HIGH", "LOW"),
+        help="per-connection write buffer watermarks in bytes",
+    )
+    parser.add_argument(
+        "--max-lag",
+        type=float,
+        default=30,
+        help="disconnect clients that can't take any data this many seconds, 0 never",
+    )
+    parser.add_argument(
+        "--client-stats-interval",
+        type=float,
+        default=0,
+        help="print the write buffers of the slowest clients every this many seconds",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="serve Prometheus metrics on 127.0.0.1:PORT/metrics, "
+        "PORT + N for worker N",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="time request handlers, report event loop stalls, and sample stacks on SIGUSR1",
+    )
+    parser.add_argument(
+        "--slow-callback",
+        type=float,
+        default=100,
+        help="with --profile, report the event loop blocked this many milliseconds",
+    )
+    parser.add_argument(
+        "--profile-interval",
+        type=float,
+        default=5,
+        help="milliseconds between stack samples",
+    )
+    parser.add_argument(
+        "--profile-duration",
+        type=float,
+        default=10,
+        help="seconds to sample stacks for after SIGUSR1",
+    )
+    parser.add_argument(
+        "--profile-dir",
+        default=tempfile.gettempdir(),
+        help="where sampled stacks are written",
+    )
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--flush-interval", type=float, default=0.2)
+    parser.add_argument(
+        "--auth-executor", choices=["process", "thread"], default="process"
+    )
+    parser.add_argument("--auth-concurrency", type=int, default=4)
+    parser.add_argument("--history-size", type=int, default=500)
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=60,
+        help="disconnect clients that send nothing, not even a heartbeat, this long",
+    )
+    parser.add_argument(
+        "--room-buffers",
+        type=int,
+        default=64,
+        help="rooms whose recent history is kept in memory once nobody here is in them",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of worker processes sharing the port via SO_REUSEPORT",
+    )
+    parser.add_argument(
+        "--db-stats-interval",
+        type=float,
+        default=0,
+        help="print database pool and statement metrics every this many seconds",
+    )
+    parser.add_argument("--user-cache-ttl", type=float, default=300)
+    parser.add_argument("--user-cache-size", type=int, default=10_000)
+    parser.add_argument(
+        "--resume-ttl",
+        type=float,
+        default=0,
+        help="issue resume tokens valid for this many seconds, 0 disables them",
+    )
+    return parser.parse_args()
+
+
+def create_chat_server(
+    args: argparse.Namespace, bus_path: str | None = None, worker: int = 0
+) -> ChatServer:
+    executor = None
+    if args.auth_executor == "thread":
+        executor = ThreadPoolExecutor(max_workers=args.auth_concurrency)
+    hasher = PasswordHasher(executor, args.auth_concurrency)
+    resume_tokens = None
+    if args.resume_ttl:
+        secret = os.environ[RESUME_SECRET_ENV].encode()
+        resume_tokens = ResumeTokens(secret, args.resume_ttl)
+    profiler = None
+    if args.profile:
+        profiler = Profiler(
+            args.slow_callback / 1000,
+            args.profile_interval / 1000,
+            args.profile_duration,
+            args.profile_dir,
+        )
+    return ChatServer(
+        args.mode == "run_local",
+        args.queue_size,
+        OverflowPolicy(args.overflow_policy),
+        args.batch_size,
+        args.flush_interval,
+        hasher,
+        args.history_size,
+        bus_path,
+        worker,
+        args.db_stats_interval,
+        UserCache(args.user_cache_ttl, args.user_cache_size),
+        resume_tokens,
+        args.room_buffers,
+        args.idle_timeout,
+        tuple(args.write_buffer),
+        args.max_lag,
+        args.client_stats_interval,
+        args.metrics_port + worker if args.metrics_port else None,
+        profiler,
+        args.backlog,
+    )
+
+
+async def main(args: argparse.Namespace):
+    if args.workers > 1:
+        from .workers import supervise
+
+        await supervise(args, "127.0.0.2", 8000)
+        return
     try:
-        run_local = "run_local" in sys.argv
-        chat_server = ChatServer(run_local)
+        chat_server = create_chat_server(args)
     except EnvironmentError as e:
         print(e)
         return
     await chat_server.start_chat_server("127.0.0.2", 8000)
 
 
-try:
-    asyncio.run(main())
-except KeyboardInterrupt:
-    print("\nInterrupted by user")
+# Entry point of python -m chatcmd.server and the chatcmd-server script.
+def run():
+    args = parse_args()
+    # tokens outlive a restart only if the secret is set in the environment
+    os.environ.setdefault(RESUME_SECRET_ENV, secrets.token_hex(32))
+    try:
+        eventloop.run(main(args), args.loop)
+    except KeyboardInterrupt:
+        print("\nInterrupted by user")
+
+
+if __name__ == "__main__":
+    run()
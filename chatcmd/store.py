@@ -1,21 +1,154 @@
 from collections import deque
-from typing import Callable, Awaitable
+from itertools import islice
+from typing import Callable
 
 
+# Messages the client holds, oldest first, in a deque bounded by `capacity`. History pages
+# from \PACK are kept as chunks that remember the server cursor they were loaded with, so
+# when memory runs out the oldest chunk is dropped whole and the next \LOAD fetches it
+# again. Live chat lines carry their own cursor, so once they are dropped too \LOAD pages
+# back from the oldest one still held. The viewport is measured in messages up from the newest one; 0 follows new messages.
+# While the user reads back, the newest messages are dropped instead, so the page being
+# read stays; live messages are then set aside until the viewport comes back down.
 class MessageStore:
-    def __init__(self, callback: Callable[[deque], Awaitable[None]]):
-        self._messages = []
-        self._past_messages = []
-        # callback will be responsible for redrawing the output
-        self._callback = callback
+    def __init__(
+        self,
+        on_append: Callable[[str], None],
+        on_redraw: Callable[[], None],
+        capacity: int = 2000,
+    ):
+        self._messages: deque[str] = deque()
+        # (number of messages, cursor of the oldest one) per loaded history page, oldest first
+        self._chunks: deque[tuple[int, str]] = deque()
+        # cursor of every live message newer than the loaded pages, None for notices
+        self._live: deque[str | None] = deque()
+        self._live_evicted = False
+        # newer messages were dropped while reading back; the newest live ones wait in _tail
+        self._detached = False
+        self._tail: deque[tuple[str, str | None]] = deque(maxlen=capacity)
+        self._capacity = capacity
+        self._offset = 0
+        # callbacks tell the renderer what changed, so it can draw only that
+        self._on_append = on_append
+        self._on_redraw = on_redraw
+        # the server has no messages older than the oldest one here
+        self.history_complete = False
 
-    async def append(self, message):
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    # Cursor of the page just before the oldest message held; None means the moment the
+    # client connected.
+    @property
+    def history_cursor(self) -> str | None:
+        if self._chunks:
+            return self._chunks[0][1]
+        if self._live_evicted:
+            return next((cursor for cursor in self._live if cursor), None)
+        return None
+
+    @property
+    def following(self) -> bool:
+        return self._offset == 0 and not self._detached
+
+    async def append(self, message: str, cursor: str | None = None):
+        if self._detached:
+            # the held messages end before this one; only the newest chat line is needed
+            # to page back from once the user returns
+            if cursor:
+                self._tail.clear()
+            self._tail.append((message, cursor))
+            return
         self._messages.append(message)
-        await self._callback(self._past_messages + self._messages)
+        self._live.append(cursor)
+        if self.following:
+            self._on_append(message)
+        else:
+            # keep showing the same messages while the user is reading back
+            self._offset += 1
+        self._evict()
+
+    async def prepend(self, messages: list[str], cursor: str):
+        if not messages:
+            self.history_complete = True
+            return
+        self._messages.extendleft(reversed(messages))
+        self._chunks.appendleft((len(messages), cursor))
+        self._on_redraw()
+        # the page just loaded is the one the user scrolled up to, never drop it
+        self._evict(keep_oldest=True)
+
+    # Forget every message, e.g. when switching to another room.
+    def clear(self):
+        self._messages.clear()
+        self._chunks.clear()
+        self._live.clear()
+        self._live_evicted = False
+        self._detached = False
+        self._tail.clear()
+        self._offset = 0
+        self.history_complete = False
+        self._on_redraw()
+
+    # The `rows` messages in the viewport, oldest first.
+    def visible(self, rows: int) -> list[str]:
+        newest_first = islice(
+            reversed(self._messages), self._offset, self._offset + rows
+        )
+        return list(newest_first)[::-1]
+
+    # Move the viewport `lines` messages up, or down if negative. Returns True once it
+    # shows the oldest message held while the server may still have older ones, or when
+    # it comes back down past dropped messages and the newest ones have to be paged in.
+    def scroll(self, lines: int, rows: int) -> bool:
+        offset = max(0, min(self._offset + lines, len(self._messages) - rows))
+        if self._detached and offset == 0 and lines < 0:
+            self._resume()
+            return True
+        if offset != self._offset:
+            self._offset = offset
+            self._on_redraw()
+        at_top = self._offset + rows >= len(self._messages)
+        return lines > 0 and at_top and not self.history_complete
+
+    # Start over from the newest live messages, as held before anything was dropped.
+    def _resume(self):
+        tail = list(self._tail)
+        self.clear()
+        for message, cursor in tail:
+            self._messages.append(message)
+            self._live.append(cursor)
+        # everything older is paged back from the first of them
+        self._live_evicted = True
+
+    # Drop messages until within capacity: the newest ones below the viewport while the
+    # user reads back, else the oldest, a whole history page at a time.
+    def _evict(self, keep_oldest: bool = False):
+        while len(self._messages) > self._capacity:
+            if self._offset or keep_oldest:
+                self._drop_newest()
+            else:
+                self._drop_oldest()
 
-    async def extend(self, message_list: list[str]):
-        self._past_messages = message_list + self._past_messages
-        await self._callback(self._past_messages + self._messages)
+    def _drop_newest(self):
+        message = self._messages.pop()
+        if self._live:
+            cursor = self._live.pop()
+            if not any(held for _, held in self._tail):
+                # set aside the newest messages down to one that can be paged back from
+                self._tail.appendleft((message, cursor))
+        else:
+            count, cursor = self._chunks.pop()
+            if count > 1:
+                self._chunks.append((count - 1, cursor))
+        self._offset = max(self._offset - 1, 0)
+        self._detached = True
 
-    def get_len(self):
-        return len(self._messages) + len(self._past_messages)
+    def _drop_oldest(self):
+        count = self._chunks.popleft()[0] if self._chunks else 1
+        for _ in range(min(count, len(self._messages) - 1)):
+            self._messages.popleft()
+            if len(self._live) > len(self._messages):
+                self._live.popleft()
+                self._live_evicted = True
+        self.history_complete = False
@@ -14,6 +14,19 @@ def move_to_top_of_screen() -> None:
     sys.stdout.write("\033[H")
 
 
+def move_to(row: int, column: int = 1) -> None:
+    sys.stdout.write(f"\033[{row};{column}H")
+
+
+# Lines written at the bottom of the region scroll only the region, not the whole screen.
+def set_scroll_region(top: int, bottom: int) -> None:
+    sys.stdout.write(f"\033[{top};{bottom}r")
+
+
+def reset_scroll_region() -> None:
+    sys.stdout.write("\033[r")
+
+
 def delete_line() -> None:
     sys.stdout.write("\033[2K")
 
@@ -15,3 +15,7 @@ def validate_username(name: str):
     if check and len(name) > 3 and len(name) <= 10:
         return True
     return False
+
+
+def validate_room_name(name: str):
+    return re.fullmatch(r"[a-z\d_-]{1,32}", name) is not None
@@ -0,0 +1,90 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import tempfile
+
+from . import eventloop
+from .bus import BusHub
+from .server import create_chat_server
+
+
+# Entry point of a worker process: a regular ChatServer bound to the shared port with
+# SO_REUSEPORT, so the kernel spreads incoming connections across the workers.
+def run_worker(
+    args: argparse.Namespace, worker: int, bus_path: str, host: str, port: int
+):
+    # Ctrl+C reaches the whole process group; the supervisor stops workers with SIGTERM
+    # so each of them flushes its queued messages first.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    eventloop.run(_serve(args, worker, bus_path, host, port), args.loop)
+
+
+async def _serve(
+    args: argparse.Namespace, worker: int, bus_path: str, host: str, port: int
+):
+    try:
+        chat_server = create_chat_server(args, bus_path, worker)
+    except EnvironmentError as e:
+        print(e)
+        return
+    print(f"Worker {worker} started, pid {os.getpid()}")
+    await chat_server.start_chat_server(host, port)
+
+
+# Run the bus hub and `args.workers` worker processes until SIGTERM or Ctrl+C, or until
+# every worker has exited.
+async def supervise(args: argparse.Namespace, host: str, port: int):
+    if args.mode == "run_local":
+        from tests.database import LocalDatabase, SQLALCHEMY_DATABASE_URL
+
+        db = LocalDatabase(SQLALCHEMY_DATABASE_URL)
+        await db.recreate_tables()
+        await db.close()
+
+    bus_path = os.path.join(tempfile.gettempdir(), f"chatcmd-bus-{os.getpid()}.sock")
+    hub = BusHub(bus_path)
+    await hub.start()
+
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(
+            target=run_worker,
+            args=(args, worker, bus_path, host, port),
+            name=f"chatcmd-worker-{worker}",
+        )
+        for worker in range(args.workers)
+    ]
+    for process in processes:
+        process.start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    if args.profile:
+        # each worker writes its own stack samples
+        loop.add_signal_handler(
+            signal.SIGUSR1,
+            lambda: [os.kill(p.pid, signal.SIGUSR1) for p in processes if p.pid],
+        )
+    try:
+        while any(process.is_alive() for process in processes):
+            try:
+                await asyncio.wait_for(stop.wait(), 1)
+                break
+            except asyncio.exceptions.TimeoutError:
+                pass
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        await loop.run_in_executor(None, _join, processes)
+        await hub.close()
+        print(f"Stopped {len(processes)} worker(s)")
+
+
+def _join(processes: list[multiprocessing.Process]):
+    for process in processes:
+        process.join()
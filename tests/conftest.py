@@ -0,0 +1,27 @@
+import pytest_asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from chatcmd.db.pwd import PasswordHasher
+from chatcmd.server import ChatServer
+
+from .test_broadcast import close_outboxes
+
+
+# Builds ChatServers on the sqlite test database, hashing on threads instead of spawning a
+# process pool. On teardown every outbox is closed while the loop still runs, so no writer
+# task outlives the test, then the databases and hashers are disposed of.
+@pytest_asyncio.fixture
+async def make_server():
+    servers: list[ChatServer] = []
+
+    def make(**options) -> ChatServer:
+        options.setdefault("hasher", PasswordHasher(ThreadPoolExecutor()))
+        server = ChatServer(run_local=True, **options)
+        servers.append(server)
+        return server
+
+    yield make
+    for server in servers:
+        await close_outboxes(server._broadcaster)
+        await server._db.close()
+        server._hasher.shutdown()
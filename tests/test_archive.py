@@ -0,0 +1,124 @@
+import os
+import pytest
+from datetime import date, datetime, timedelta
+
+from chatcmd.db.archive import (
+    MessageArchive,
+    MonthWriter,
+    add_months,
+    month_of,
+    partition_name,
+)
+
+from .database import LocalDatabase, SQLALCHEMY_DATABASE_URL
+
+
+def archived_row(message_id: int, timestamp: datetime, room_id: int = 1) -> dict:
+    return {
+        "id": message_id,
+        "timestamp": timestamp.isoformat(),
+        "user_id": 1,
+        "user": "gvard",
+        "room_id": room_id,
+        "text": f"message {message_id}\n",
+    }
+
+
+# Three messages a day in room 1 and one in room 2, for the month.
+def write_month(directory: str, month: date, first_id: int) -> int:
+    message_id = first_id
+    with MonthWriter(directory, month) as writer:
+        for room_id, count in ((1, 3), (2, 1)):
+            for day in range(count):
+                timestamp = datetime(month.year, month.month, day + 1, 12)
+                writer.add(archived_row(message_id, timestamp, room_id))
+                message_id += 1
+    return message_id
+
+
+def test_months():
+    assert month_of(datetime(2026, 10, 18, 12)) == date(2026, 10, 1)
+    assert add_months(date(2026, 11, 1), 2) == date(2027, 1, 1)
+    assert add_months(date(2026, 1, 1), -13) == date(2024, 12, 1)
+    assert partition_name(date(2026, 3, 1)) == "message_p2026_03"
+
+
+@pytest.mark.asyncio
+async def test_archive_pages_across_months(tmp_path):
+    next_id = write_month(tmp_path, date(2026, 1, 1), 1)
+    write_month(tmp_path, date(2026, 2, 1), next_id)
+    archive = MessageArchive(tmp_path)
+    assert archive.months() == ["2026-02", "2026-01"]
+
+    page = await archive.page(4, (datetime(2026, 3, 1), 0), 1)
+    assert [m.id for m in page] == [3, 5, 6, 7]
+    assert page[0].user.name == "gvard"
+    page = await archive.page(4, (page[0].timestamp, page[0].id), 1)
+    assert [m.id for m in page] == [1, 2]
+    assert [m.id for m in await archive.page(4, (datetime.now(), 0), 2)] == [4, 8]
+    assert archive.stats() == {"cached": 4, "hits": 1, "misses": 4}
+
+
+def test_failed_export_leaves_no_month(tmp_path):
+    with pytest.raises(ValueError):
+        with MonthWriter(tmp_path, date(2026, 1, 1)) as writer:
+            writer.add(archived_row(1, datetime(2026, 1, 1)))
+            raise ValueError
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.asyncio
+async def test_history_continues_into_archive(tmp_path):
+    write_month(tmp_path, date(2026, 1, 1), 1)
+    db = LocalDatabase(SQLALCHEMY_DATABASE_URL, archive=MessageArchive(tmp_path))
+    await db.recreate_tables()
+    user = await db.add_user("gvard", "abc123!@#")
+    start = datetime(2026, 3, 1)
+    await db.add_messages(
+        [
+            {"user_id": user.id, "text": "recent\n", "timestamp": start + timedelta(i)}
+            for i in range(3)
+        ]
+    )
+
+    messages = await db.get_messages(4, (datetime.now(), 0))
+    assert [m.text for m in messages] == ["message 3\n"] + ["recent\n"] * 3
+    oldest = messages[0]
+    messages = await db.get_messages(4, (oldest.timestamp, oldest.id))
+    assert [m.id for m in messages] == [1, 2]
+    await db.close()
+
+
+@pytest.mark.asyncio
+async def test_short_pages_skip_an_empty_archive(tmp_path, monkeypatch):
+    archive = MessageArchive(tmp_path)
+    db = LocalDatabase(SQLALCHEMY_DATABASE_URL, archive=archive)
+    await db.recreate_tables()
+    user = await db.add_user("gvard", "abc123!@#")
+    await db.add_messages(
+        [{"user_id": user.id, "text": "hi\n", "timestamp": datetime(2026, 5, 1)}]
+    )
+    listdir = os.listdir
+    listed = []
+
+    def counting_listdir(path):
+        listed.append(path)
+        return listdir(path)
+
+    monkeypatch.setattr(os, "listdir", counting_listdir)
+
+    for _ in range(3):
+        assert len(await db.get_messages(10, (datetime.now(), 0))) == 1
+
+    # the listing is reused until it is due for a refresh
+    assert listed == [tmp_path]
+    assert archive.stats() == {"cached": 0, "hits": 0, "misses": 0}
+    await db.close()
+
+
+def test_archive_only_reaches_times_after_its_oldest_month_starts(tmp_path):
+    write_month(tmp_path, date(2026, 4, 1), 1)
+    archive = MessageArchive(tmp_path)
+
+    assert not archive.reaches(datetime(2026, 4, 1))
+    assert archive.reaches(datetime(2026, 4, 1, 0, 0, 1))
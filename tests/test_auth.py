@@ -0,0 +1,149 @@
+import asyncio
+import pytest
+import time
+from datetime import datetime
+
+from chatcmd.auth import ResumeTokens, UserCache
+from chatcmd.bus import BusHub
+from chatcmd.db.models import GENERAL_ROOM
+from chatcmd.protocol import TEXT, Kind
+from chatcmd.server import ChatServer, ClientSession, CredentialsError
+
+from .test_broadcast import FakeWriter
+
+PASSWORD = "abc123!@#"
+NEW_PASSWORD = "xyz789$%^"
+
+
+def test_user_cache_evicts_least_recently_used():
+    cache = UserCache(ttl=60, capacity=2)
+    cache.put("gvard", 1, "hash1")
+    cache.put("alice", 2, "hash2")
+    assert cache.get("gvard").id == 1
+
+    cache.put("carol", 3, "hash3")
+
+    assert cache.get("alice") is None
+    assert cache.get("gvard").id == 1
+    assert cache.get("carol").id == 3
+    assert cache.stats() == {"size": 2, "hits": 3, "misses": 1}
+
+
+def test_user_cache_expires_and_invalidates(monkeypatch):
+    cache = UserCache(ttl=60)
+    cache.put("gvard", 1, "hash1")
+    cache.put("alice", 2, "hash2")
+
+    cache.invalidate("alice")
+    assert cache.get("alice") is None
+
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 61)
+    assert cache.get("gvard") is None
+    assert len(cache) == 0
+
+
+def test_resume_tokens():
+    tokens = ResumeTokens(b"secret", ttl=60)
+    token = tokens.issue("gvard", "hash1")
+
+    assert tokens.verify(token, "gvard", "hash1")
+    assert not tokens.verify(token, "alice", "hash1")
+    # a new password revokes the token
+    assert not tokens.verify(token, "gvard", "hash2")
+    assert not ResumeTokens(b"other", ttl=60).verify(token, "gvard", "hash1")
+    assert not tokens.verify(token[:-2], "gvard", "hash1")
+    assert not tokens.verify("garbage", "gvard", "hash1")
+
+
+def test_resume_tokens_expire(monkeypatch):
+    tokens = ResumeTokens(b"secret", ttl=60)
+    token = tokens.issue("gvard", "hash1")
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 61)
+    assert not tokens.verify(token, "gvard", "hash1")
+
+
+async def start_workers(make_server, path: str, count: int) -> list[ChatServer]:
+    tokens = ResumeTokens(b"secret", ttl=60)
+    workers = [
+        make_server(bus_path=path, worker=worker, resume_tokens=tokens)
+        for worker in range(count)
+    ]
+    await workers[0]._db.recreate_tables()
+    await workers[0]._db.add_user("gvard", PASSWORD)
+    for server in workers:
+        await server._bus.connect()
+    await asyncio.sleep(0.05)
+    return workers
+
+
+@pytest.mark.asyncio
+async def test_password_change_revokes_cache_and_tokens_on_every_worker(
+    tmp_path, make_server
+):
+    hub = BusHub(str(tmp_path / "bus.sock"))
+    await hub.start()
+    workers = await start_workers(make_server, str(tmp_path / "bus.sock"), 2)
+    for server in workers:
+        assert await server._find_user("gvard")
+    token = workers[1]._resume_tokens.issue(
+        "gvard", (await workers[1]._find_user("gvard")).password_hash
+    )
+    server = workers[0]
+    writer = FakeWriter()
+    user = await server._find_user("gvard")
+    server._sessions["gvard"] = ClientSession(user.id, datetime.now(), TEXT)
+    server._broadcaster.add("gvard", writer)
+
+    await server._process_message("gvard", Kind.PASSWD, f"wrong1!@# {NEW_PASSWORD}")
+    await server._process_message("gvard", Kind.PASSWD, f"{PASSWORD} {NEW_PASSWORD}", 2)
+    await asyncio.sleep(0.05)
+
+    assert writer.data == [
+        b"\\ACK\n",
+        b"Wrong password.\n",
+        b"\\ACK 2\n",
+        b"Password changed.\n",
+    ]
+    for server in workers:
+        user = await server._find_user("gvard")
+        with pytest.raises(CredentialsError):
+            await server._login_user(FakeWriter(), TEXT, user, PASSWORD)
+        with pytest.raises(CredentialsError):
+            await server._resume_session(FakeWriter(), TEXT, "gvard", user, token)
+        assert await server._login_user(FakeWriter(), TEXT, user, NEW_PASSWORD)
+
+    for server in workers:
+        await server._bus.close()
+    await hub.close()
+
+
+@pytest.mark.asyncio
+async def test_reconnect_under_the_same_name_keeps_the_new_session(make_server):
+    server = make_server()
+    alice_reader, old_reader, new_reader = (asyncio.StreamReader() for _ in range(3))
+    old, new, alice = FakeWriter(), FakeWriter(), FakeWriter()
+    server._add_user("alice", 2, TEXT, alice_reader, alice)
+    server._add_user("gvard", 1, TEXT, old_reader, old)
+    server._add_user("gvard", 1, TEXT, new_reader, new)
+    await asyncio.sleep(0.01)
+
+    # the replaced connection is aborted, which ends its listener
+    assert old.transport.aborted
+    old_reader.feed_eof()
+    await asyncio.sleep(0.01)
+
+    assert "gvard" in server._sessions and "gvard" in server._broadcaster
+    assert not new.transport.aborted
+    await server._notify_room(GENERAL_ROOM, "alice: hi\n")
+    await asyncio.sleep(0.01)
+    assert new.data == alice.data == [b"alice: hi\n"]
+
+    new_reader.feed_eof()
+    await asyncio.sleep(0.01)
+    assert "gvard" not in server._sessions
+    assert alice.data[1:] == [b"gvard has left the chat\n"]
+    alice_reader.feed_eof()
+    await asyncio.sleep(0.01)
@@ -0,0 +1,338 @@
+import asyncio
+import pytest
+import pytest_asyncio
+
+from chatcmd.broadcast import Broadcaster, OverflowPolicy
+from chatcmd.frames import text_frame
+
+
+class FakeTransport:
+    def __init__(self):
+        self.aborted = False
+        self.buffered = 0
+
+    def abort(self):
+        self.aborted = True
+
+    def set_write_buffer_limits(self, high: int, low: int):
+        self.limits = (high, low)
+
+    def get_write_buffer_size(self) -> int:
+        return self.buffered
+
+
+class FakeWriter:
+    def __init__(self, stalled: bool = False, hang_on_close: bool = False):
+        self.data: list[bytes] = []
+        self.closed = False
+        self.transport = FakeTransport()
+        self._stalled = asyncio.Event() if stalled else None
+        self._hang_on_close = hang_on_close
+        self.error: Exception | None = None
+
+    def resume(self):
+        self._stalled.set()
+
+    # Wake the stalled drain with a failure, like a peer resetting the connection.
+    def fail(self, error: Exception):
+        self.error = error
+        self._stalled.set()
+
+    def write(self, data: bytes):
+        self.data.append(data)
+
+    def writelines(self, frames):
+        self.data.extend(frames)
+
+    async def drain(self):
+        if self._stalled:
+            await self._stalled.wait()
+        if self.error:
+            raise self.error
+
+    def close(self):
+        self.closed = True
+
+    async def wait_closed(self):
+        if self._hang_on_close:
+            await asyncio.Event().wait()
+
+
+# Remove every outbox while the loop still runs, so no writer task outlives the test.
+async def close_outboxes(broadcaster: Broadcaster):
+    for username in list(broadcaster._outboxes):
+        await broadcaster.remove(username, flush_timeout=0)
+    # let the cancelled writer tasks finish
+    await asyncio.sleep(0)
+
+
+@pytest_asyncio.fixture
+async def make_broadcaster():
+    broadcasters: list[Broadcaster] = []
+
+    def make(policy: OverflowPolicy, queue_size: int = 2, max_lag: float = 0):
+        disconnected = []
+
+        async def on_disconnect(username: str):
+            disconnected.append(username)
+
+        broadcaster = Broadcaster(on_disconnect, queue_size, policy, max_lag=max_lag)
+        broadcasters.append(broadcaster)
+        return broadcaster, disconnected
+
+    yield make
+    for broadcaster in broadcasters:
+        await close_outboxes(broadcaster)
+
+
+@pytest.mark.asyncio
+async def test_slow_client_does_not_block_others(make_broadcaster):
+    broadcaster, _ = make_broadcaster(OverflowPolicy.DROP_OLDEST)
+    slow, fast = FakeWriter(stalled=True), FakeWriter()
+    broadcaster.add("slow", slow)
+    broadcaster.add("fast", fast)
+
+    for i in range(5):
+        await asyncio.wait_for(broadcaster.broadcast(text_frame(f"{i}\n")), 1)
+        await asyncio.sleep(0)
+
+    assert fast.data == [f"{i}\n".encode() for i in range(5)]
+
+
+@pytest.mark.asyncio
+async def test_drop_oldest_policy(make_broadcaster):
+    broadcaster, disconnected = make_broadcaster(OverflowPolicy.DROP_OLDEST)
+    writer = FakeWriter(stalled=True)
+    broadcaster.add("slow", writer)
+    await asyncio.sleep(0)
+
+    # first frame is stuck in drain, the queue holds the rest
+    for i in range(5):
+        await broadcaster.broadcast(text_frame(f"{i}\n"))
+        await asyncio.sleep(0)
+
+    assert broadcaster.dropped("slow") == 2
+    assert not disconnected
+
+
+@pytest.mark.asyncio
+async def test_disconnect_policy(make_broadcaster):
+    broadcaster, disconnected = make_broadcaster(OverflowPolicy.DISCONNECT)
+    writer = FakeWriter(stalled=True)
+    broadcaster.add("slow", writer)
+    await asyncio.sleep(0)
+
+    for i in range(4):
+        await broadcaster.broadcast(text_frame(f"{i}\n"))
+        await asyncio.sleep(0)
+
+    assert disconnected == ["slow"]
+    assert "slow" not in broadcaster
+    assert writer.transport.aborted
+
+
+@pytest.mark.asyncio
+async def test_disconnect_does_not_wait_for_stalled_peer(make_broadcaster):
+    broadcaster, disconnected = make_broadcaster(OverflowPolicy.DISCONNECT)
+    writer = FakeWriter(stalled=True, hang_on_close=True)
+    broadcaster.add("slow", writer)
+    await asyncio.sleep(0)
+
+    for i in range(4):
+        await asyncio.wait_for(broadcaster.broadcast(text_frame(f"{i}\n")), 1)
+        await asyncio.sleep(0)
+
+    assert disconnected == ["slow"]
+    assert writer.transport.aborted
+
+
+@pytest.mark.asyncio
+async def test_block_policy(make_broadcaster):
+    broadcaster, disconnected = make_broadcaster(OverflowPolicy.BLOCK)
+    writer = FakeWriter(stalled=True)
+    broadcaster.add("slow", writer)
+    await asyncio.sleep(0)
+
+    for i in range(3):
+        await broadcaster.broadcast(text_frame(f"{i}\n"))
+        await asyncio.sleep(0)
+
+    blocked = asyncio.create_task(broadcaster.broadcast(text_frame("3\n")))
+    await asyncio.sleep(0.05)
+    assert not blocked.done()
+
+    writer.resume()
+    await asyncio.wait_for(blocked, 1)
+    await asyncio.sleep(0.05)
+
+    assert writer.data == [f"{i}\n".encode() for i in range(4)]
+    assert broadcaster.dropped("slow") == 0
+    assert not disconnected
+
+
+async def block_sender(broadcaster: Broadcaster) -> asyncio.Task:
+    for i in range(3):
+        await broadcaster.broadcast(text_frame(f"{i}\n"))
+        await asyncio.sleep(0)
+    blocked = asyncio.create_task(broadcaster.broadcast(text_frame("3\n")))
+    await asyncio.sleep(0.05)
+    assert not blocked.done()
+    return blocked
+
+
+@pytest.mark.asyncio
+async def test_disconnect_releases_blocked_sender(make_broadcaster):
+    broadcaster, _ = make_broadcaster(OverflowPolicy.BLOCK)
+    writer = FakeWriter(stalled=True)
+    broadcaster.add("slow", writer)
+    await asyncio.sleep(0)
+    blocked = await block_sender(broadcaster)
+
+    await broadcaster.remove("slow", flush_timeout=0)
+
+    await asyncio.wait_for(blocked, 1)
+    assert writer.transport.aborted
+
+
+@pytest.mark.asyncio
+async def test_write_error_releases_blocked_sender(make_broadcaster):
+    broadcaster, disconnected = make_broadcaster(OverflowPolicy.BLOCK)
+    writer = FakeWriter(stalled=True)
+    broadcaster.add("slow", writer)
+    await asyncio.sleep(0)
+    blocked = await block_sender(broadcaster)
+
+    writer.fail(ConnectionResetError())
+
+    await asyncio.wait_for(blocked, 1)
+    await asyncio.sleep(0.05)
+    assert disconnected == ["slow"]
+
+
+@pytest.mark.asyncio
+async def test_write_error_removes_client(make_broadcaster):
+    broadcaster, disconnected = make_broadcaster(OverflowPolicy.DROP_OLDEST)
+    writer = FakeWriter()
+
+    def broken_writelines(frames):
+        raise RuntimeError("transport is closed")
+
+    writer.writelines = broken_writelines
+    broadcaster.add("broken", writer)
+
+    await broadcaster.broadcast(text_frame("hello\n"))
+    await asyncio.sleep(0.05)
+
+    assert disconnected == ["broken"]
+    assert "broken" not in broadcaster
+
+
+@pytest.mark.asyncio
+async def test_replaced_outbox_does_not_remove_the_new_one(make_broadcaster):
+    broadcaster, disconnected = make_broadcaster(OverflowPolicy.DROP_OLDEST)
+    old_writer, new_writer = FakeWriter(), FakeWriter()
+    old = broadcaster.add("gvard", old_writer)
+    new = broadcaster.add("gvard", new_writer)
+    await asyncio.sleep(0)
+    assert old_writer.transport.aborted
+
+    assert not await broadcaster.remove("gvard", flush_timeout=0, outbox=old)
+    await broadcaster._disconnect("gvard", old)
+
+    assert "gvard" in broadcaster
+    assert not disconnected
+    await broadcaster.broadcast(text_frame("hello\n"))
+    await asyncio.sleep(0.01)
+    assert new_writer.data == [b"hello\n"]
+    assert await broadcaster.remove("gvard", outbox=new)
+
+
+@pytest.mark.asyncio
+async def test_lagging_client_is_evicted_under_any_policy(make_broadcaster):
+    broadcaster, disconnected = make_broadcaster(
+        OverflowPolicy.BLOCK, queue_size=8, max_lag=0.05
+    )
+    slow, fast = FakeWriter(stalled=True), FakeWriter()
+    # the peer stopped reading, so the transport stays above the high watermark
+    slow.transport.buffered = 1 << 20
+    broadcaster.add("slow", slow)
+    broadcaster.add("fast", fast)
+
+    await broadcaster.broadcast(text_frame("0\n"))
+    await asyncio.sleep(0.1)
+    await asyncio.wait_for(broadcaster.broadcast(text_frame("1\n")), 1)
+
+    assert disconnected == ["slow"]
+    assert broadcaster.evicted == 1
+    assert fast.data == [b"0\n", b"1\n"]
+
+
+@pytest.mark.asyncio
+async def test_lagging_client_does_not_stall_a_blocked_sender(make_broadcaster):
+    broadcaster, disconnected = make_broadcaster(
+        OverflowPolicy.BLOCK, queue_size=2, max_lag=0.05
+    )
+    slow, fast = FakeWriter(stalled=True), FakeWriter()
+    slow.transport.buffered = 1 << 20
+    broadcaster.add("slow", slow)
+    broadcaster.add("fast", fast)
+
+    # the first frame is stuck in drain and the queue fills up behind it
+    for i in range(3):
+        await broadcaster.broadcast(text_frame(f"{i}\n"))
+        await asyncio.sleep(0)
+    blocked = asyncio.create_task(broadcaster.broadcast(text_frame("3\n")))
+
+    await asyncio.wait_for(blocked, 1)
+    assert disconnected == ["slow"]
+    assert "slow" not in broadcaster
+    assert broadcaster.evicted == 1
+    assert fast.data == [f"{i}\n".encode() for i in range(4)]
+
+
+@pytest.mark.asyncio
+async def test_sender_blocked_on_an_evicted_client_is_released(make_broadcaster):
+    broadcaster, disconnected = make_broadcaster(
+        OverflowPolicy.BLOCK, queue_size=2, max_lag=0.1
+    )
+    slow, fast = FakeWriter(stalled=True), FakeWriter()
+    slow.transport.buffered = 1 << 20
+    broadcaster.add("slow", slow)
+    broadcaster.add("fast", fast)
+    for i in range(3):
+        await broadcaster.broadcast(text_frame(f"{i}\n"))
+        await asyncio.sleep(0)
+    # the client has been lagging since the first frame, before this sender blocked
+    await asyncio.sleep(0.08)
+    blocked = asyncio.create_task(broadcaster.broadcast(text_frame("3\n")))
+    await asyncio.sleep(0.04)
+    assert not blocked.done()
+
+    # another sender finds the client too far behind and evicts it
+    await asyncio.wait_for(broadcaster.broadcast(text_frame("4\n")), 0.02)
+
+    await asyncio.wait_for(blocked, 0.02)
+    assert disconnected == ["slow"]
+    assert broadcaster.evicted == 1
+
+
+@pytest.mark.asyncio
+async def test_client_stats_put_the_most_buffered_first(make_broadcaster):
+    broadcaster, _ = make_broadcaster(OverflowPolicy.DROP_OLDEST, queue_size=8)
+    slow, fast = FakeWriter(stalled=True), FakeWriter()
+    slow.transport.buffered = 1 << 20
+    broadcaster.add("fast", fast)
+    broadcaster.add("slow", slow)
+
+    for i in range(3):
+        await broadcaster.broadcast(text_frame(f"{i}\n"))
+        await asyncio.sleep(0)
+    stats = broadcaster.client_stats()
+
+    assert list(stats) == ["slow", "fast"]
+    assert stats["slow"]["stalls"] == 1
+    # the first frame is in the transport, the other two wait in the queue
+    assert stats["slow"]["queued_bytes"] == 4
+    assert stats["slow"]["lag_ms"] > 0
+    assert stats["fast"]["queued_bytes"] == stats["fast"]["lag_ms"] == 0
+    assert list(broadcaster.client_stats(limit=1)) == ["slow"]
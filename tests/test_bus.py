@@ -0,0 +1,63 @@
+import asyncio
+import pytest
+
+from chatcmd.bus import BusClient, BusHub
+
+
+class Recorder:
+    def __init__(self):
+        self.events: list[dict] = []
+
+    async def __call__(self, event: dict):
+        self.events.append(event)
+
+
+async def connect(path: str, worker: int) -> tuple[BusClient, list[dict]]:
+    recorder = Recorder()
+    client = BusClient(path, worker, recorder)
+    await client.connect()
+    return client, recorder.events
+
+
+@pytest.mark.asyncio
+async def test_events_are_relayed_to_other_workers(tmp_path):
+    hub = BusHub(str(tmp_path / "bus.sock"))
+    await hub.start()
+    first, first_events = await connect(str(tmp_path / "bus.sock"), 0)
+    second, second_events = await connect(str(tmp_path / "bus.sock"), 1)
+    await asyncio.sleep(0.05)
+
+    first.publish({"type": "message", "text": "gvard: hello\n"})
+    await asyncio.sleep(0.05)
+
+    assert second_events == [{"type": "message", "text": "gvard: hello\n", "worker": 0}]
+    # the publisher already delivered the message to its own clients
+    assert first_events == []
+
+    await first.close()
+    await second.close()
+    await hub.close()
+
+
+@pytest.mark.asyncio
+async def test_presence_reaches_late_and_surviving_workers(tmp_path):
+    path = str(tmp_path / "bus.sock")
+    hub = BusHub(path)
+    await hub.start()
+    first, _ = await connect(path, 0)
+    await asyncio.sleep(0.05)
+    first.publish({"type": "presence", "count": 3})
+    await asyncio.sleep(0.05)
+
+    second, second_events = await connect(path, 1)
+    await asyncio.sleep(0.05)
+    assert second_events == [{"type": "presence", "worker": 0, "count": 3}]
+
+    # users of a worker that disappears are no longer counted
+    await first.close()
+    await asyncio.sleep(0.05)
+    assert second_events[-1] == {"type": "presence", "worker": 0, "count": 0}
+    assert hub.presence == {}
+
+    await second.close()
+    await hub.close()
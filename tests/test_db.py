@@ -1,8 +1,10 @@
 import pytest
 from datetime import datetime
 from sqlalchemy import select
+from sqlalchemy.exc import InvalidRequestError, TimeoutError as SQLAlchemyTimeoutError
 
-from chatcmd.db.models import User, Message
+from chatcmd.db.db_queries import decode_cursor, encode_cursor
+from chatcmd.db.models import GENERAL_ROOM_ID, User, Message
 
 from .database import LocalDatabase, SQLALCHEMY_DATABASE_URL
 from .factories import UserFactory, MessageFactory, get_test_user_password
@@ -21,6 +23,9 @@ async def test_get_user():
 
     user = await db.get_user_by_name(username)
     assert user.name == username
+    # message history is never loaded along with the user
+    with pytest.raises(InvalidRequestError):
+        user.messages
 
     await test_session.close()
 
@@ -52,8 +57,9 @@ async def test_login_user():
     users = await test_session.execute(select(User))
     password = get_test_user_password(users.scalar_one())
 
-    login = await db.login_user(username, password)
-    assert login == True
+    user = await db.login_user(username, password)
+    assert user.name == username
+    assert await db.login_user(username, "wrong") is None
 
     await test_session.close()
 
@@ -69,12 +75,88 @@ async def test_get_messages():
     MessageFactory.create_batch(10)
     await test_session.commit()
 
-    messages = await db.get_messages(12, 0, datetime.now())
+    messages = await db.get_messages(12, (datetime.now(), 0))
     assert len(messages) == 10
+    assert all(m.user.name for m in messages)
+
+    await test_session.close()
+
+
+@pytest.mark.asyncio
+async def test_get_messages_per_room():
+    db = LocalDatabase(SQLALCHEMY_DATABASE_URL)
+    await db.recreate_tables()
+    user = await db.add_user("gvard", "abc123!@#")
+    games = await db.get_room_id("games")
+    assert games != GENERAL_ROOM_ID
+    assert await db.get_room_id("games") == games
+
+    await db.add_message(user.id, "in general")
+    await db.add_message(user.id, "in games", games)
+
+    messages = await db.get_messages(10, (datetime.now(), 0), games)
+    assert [m.text for m in messages] == ["in games"]
+    messages = await db.get_messages(10, (datetime.now(), 0))
+    assert [m.text for m in messages] == ["in general"]
+
+
+@pytest.mark.asyncio
+async def test_get_messages_pages():
+    db = LocalDatabase(SQLALCHEMY_DATABASE_URL)
+    await db.recreate_tables()
+    test_session = db.get_test_session()
+
+    UserFactory.set_session(test_session)
+    MessageFactory.set_session(test_session)
+    MessageFactory.create_batch(10)
+    await test_session.commit()
+
+    seen = []
+    cursor = encode_cursor((datetime.now(), 0))
+    for _ in range(5):
+        messages = await db.get_messages(4, decode_cursor(cursor))
+        if not messages:
+            break
+        seen = [m.id for m in messages] + seen
+        cursor = encode_cursor((messages[0].timestamp, messages[0].id))
+
+    assert seen == list(range(1, 11))
 
     await test_session.close()
 
 
+@pytest.mark.asyncio
+async def test_get_user_for_auth():
+    username = "gvard"
+    db = LocalDatabase(SQLALCHEMY_DATABASE_URL)
+    await db.recreate_tables()
+    user = await db.add_user(username, "abc123!@#")
+
+    auth = await db.get_user_for_auth(username)
+    assert auth.id == user.id
+    assert await db.verify_password("abc123!@#", auth.password_hash)
+    assert not await db.verify_password("wrong", auth.password_hash)
+    assert await db.get_user_for_auth("alice") is None
+
+
+@pytest.mark.asyncio
+async def test_set_password():
+    db = LocalDatabase(SQLALCHEMY_DATABASE_URL)
+    await db.recreate_tables()
+    await db.add_user("gvard", "abc123!@#")
+
+    await db.set_password("gvard", "new123!@#")
+
+    assert await db.login_user("gvard", "abc123!@#") is None
+    assert await db.login_user("gvard", "new123!@#")
+
+
+@pytest.mark.parametrize("token", ["", "garbage", "bm90IGEgY3Vyc29y"])
+def test_decode_bad_cursor(token):
+    with pytest.raises(ValueError):
+        decode_cursor(token)
+
+
 @pytest.mark.asyncio
 async def test_add_message():
     username = "gvard"
@@ -83,11 +165,38 @@ async def test_add_message():
     test_session = db.get_test_session()
 
     UserFactory.set_session(test_session)
-    UserFactory.create(name=username)
+    user = UserFactory.create(name=username)
     await test_session.commit()
-    await db.add_message(username, "hello everyone")
+    await db.add_message(user.id, "hello everyone")
 
     messages = await test_session.execute(select(Message))
     assert len(messages.all()) == 1
 
     await test_session.close()
+
+
+@pytest.mark.asyncio
+async def test_pool_stats_count_waits_and_statements():
+    pool_options = {"pool_size": 1, "max_overflow": 0, "pool_timeout": 0.1}
+    db = LocalDatabase(SQLALCHEMY_DATABASE_URL, pool_options=pool_options)
+    await db.recreate_tables()
+    await db.get_user_by_name("gvard")
+
+    # the only connection is taken, so the next checkout waits and times out
+    held = db.get_test_session()
+    await held.connection()
+    assert db.pool_stats()["checked_out"] == 1
+    with pytest.raises(SQLAlchemyTimeoutError):
+        await db.get_user_by_name("gvard")
+    await held.close()
+
+    stats = db.pool_stats()
+    assert stats["checked_out"] == 0
+    assert stats["waiting"] == 0
+    assert stats["timeouts"] == 1
+    assert stats["wait_ms"]["count"] >= 3
+    assert stats["statement_ms"]["count"] >= 1
+    # the call that timed out is timed too
+    assert db.method_time["get_user_by_name"].count == 2
+    assert db.method_time["get_messages"].count == 0
+    await db.close()
@@ -0,0 +1,60 @@
+import asyncio
+import pytest
+from datetime import datetime
+
+from chatcmd.db.persister import DirectMessagePersister
+from chatcmd.protocol import TEXT
+from chatcmd.server import ClientSession
+
+from .database import LocalDatabase
+from .test_broadcast import FakeWriter
+
+
+async def prepare_db(db: LocalDatabase, *names: str) -> list[int]:
+    await db.recreate_tables()
+    users = [await db.add_user(name, "abc123!@#") for name in names]
+    return [user.id for user in users]
+
+
+@pytest.mark.asyncio
+async def test_conversation_history_covers_both_directions_only(make_server):
+    db = make_server()._db
+    gvard, alice, carol = await prepare_db(db, "gvard", "alice", "carol")
+    persister = DirectMessagePersister(db, flush_interval=0.01)
+    persister.start()
+    await persister.put(gvard, alice, "hi alice\n", datetime.now())
+    await persister.put(alice, gvard, "hi gvard\n", datetime.now())
+    await persister.put(gvard, carol, "hi carol\n", datetime.now())
+    await persister.close()
+
+    messages = await db.get_direct_messages(alice, gvard, 10, (datetime.now(), 0))
+    assert [(m.sender.name, m.text) for m in messages] == [
+        ("gvard", "hi alice\n"),
+        ("alice", "hi gvard\n"),
+    ]
+    # no public messages were written
+    assert await db.get_messages(10, (datetime.now(), 0)) == []
+
+
+@pytest.mark.asyncio
+async def test_direct_message_reaches_only_sender_and_recipient(make_server):
+    server = make_server()
+    await prepare_db(server._db, "gvard", "alice", "carol")
+    writers = {name: FakeWriter() for name in ("gvard", "alice", "carol")}
+    for name, writer in writers.items():
+        user = await server._find_user(name)
+        server._sessions[name] = ClientSession(user.id, datetime.now(), TEXT)
+        server._broadcaster.add(name, writer)
+
+    await server._send_direct("gvard", "alice psst\n", seq=None)
+    await server._send_direct("gvard", "nobody hello\n", seq=None)
+    await asyncio.sleep(0.01)
+
+    assert writers["alice"].data == [b"gvard -> alice: psst\n"]
+    assert writers["carol"].data == []
+    assert writers["gvard"].data == [
+        b"\\ACK\n",
+        b"gvard -> alice: psst\n",
+        b"\\ACK\n",
+        b"No such user: nobody\n",
+    ]
@@ -0,0 +1,33 @@
+import asyncio
+import subprocess
+import sys
+import pytest
+
+from chatcmd import eventloop
+
+
+async def answer() -> int:
+    await asyncio.sleep(0)
+    return 42
+
+
+def test_run_on_the_standard_loop():
+    assert eventloop.run(answer(), "asyncio") == 42
+
+
+@pytest.mark.skipif(eventloop.uvloop_available(), reason="uvloop is installed")
+def test_auto_falls_back_without_uvloop():
+    assert eventloop.run(answer(), "auto") == 42
+    with pytest.raises(SystemExit):
+        eventloop.run(answer(), "uvloop")
+
+
+def test_modules_import_without_backends():
+    probe = (
+        "import sys, chatcmd.server, chatcmd.client, chatcmd.workers; "
+        "print(sorted(m for m in sys.modules if m.startswith(('tests', 'dotenv'))))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", probe], capture_output=True, text=True, check=True
+    )
+    assert result.stdout == "[]\n"
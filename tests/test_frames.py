@@ -0,0 +1,74 @@
+import asyncio
+import json
+import tracemalloc
+import pytest
+
+from chatcmd.frames import ACK, pack_fragment, pack_frame
+from chatcmd.protocol import TEXT
+from chatcmd.db.models import GENERAL_ROOM
+
+from .test_broadcast import FakeWriter
+
+RECIPIENTS = 1000
+
+
+def test_pack_frame_is_valid_json():
+    fragments = [pack_fragment('gvard: "hi"\n'), pack_fragment("alice: hello\n")]
+    frame = pack_frame("abc", fragments).encode(TEXT)
+
+    prefix, cursor, payload = frame.decode().split(" ", 2)
+    assert (prefix, cursor) == ("\\PACK", "abc")
+    assert json.loads(payload) == ['gvard: "hi"\n', "alice: hello\n"]
+    assert pack_frame("abc", []).encode(TEXT) == b"\\PACK abc []\n"
+
+
+async def bytes_allocated(coro) -> int:
+    tracemalloc.reset_peak()
+    before, _ = tracemalloc.get_traced_memory()
+    await coro
+    _, peak = tracemalloc.get_traced_memory()
+    return peak - before
+
+
+# Micro-benchmark: allocations per broadcast must not grow with recipients x payload size,
+# i.e. the message is encoded once and the same bytes object is shared by every queue.
+@pytest.mark.asyncio
+async def test_broadcast_allocates_one_frame(make_server):
+    server = make_server(queue_size=4)
+    writers = [FakeWriter() for _ in range(RECIPIENTS)]
+    for i, writer in enumerate(writers):
+        server._broadcaster.add(f"user{i}", writer)
+        server._rooms[GENERAL_ROOM].add(f"user{i}")
+    await asyncio.sleep(0)
+
+    small_message = "gvard: hi\n"
+    large_message = "gvard: " + "x" * 64 * 1024 + "\n"
+
+    tracemalloc.start()
+    try:
+        small = await bytes_allocated(server._notify_room(GENERAL_ROOM, small_message))
+        await asyncio.sleep(0.01)
+        large = await bytes_allocated(server._notify_room(GENERAL_ROOM, large_message))
+        await asyncio.sleep(0.01)
+    finally:
+        tracemalloc.stop()
+
+    # queue bookkeeping only, about 200 bytes per recipient
+    assert small / RECIPIENTS < 512
+    assert large - small < 2 * len(large_message)
+    assert all(writer.data[-1] is writers[0].data[-1] for writer in writers)
+
+
+@pytest.mark.asyncio
+async def test_acknowledge_reuses_cached_frame(make_server):
+    server = make_server()
+    writer = FakeWriter()
+    server._broadcaster.add("gvard", writer)
+
+    await server._acknowledge("gvard")
+    await server._acknowledge("gvard")
+    await asyncio.sleep(0.01)
+
+    assert len(writer.data) == 2
+    assert all(frame is ACK.encode(TEXT) for frame in writer.data)
+
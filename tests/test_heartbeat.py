@@ -0,0 +1,30 @@
+import asyncio
+import pytest
+from datetime import datetime
+
+from chatcmd.protocol import TEXT
+from chatcmd.server import ClientSession
+
+from .test_broadcast import FakeWriter
+
+
+@pytest.mark.asyncio
+async def test_idle_clients_are_reaped_together(make_server):
+    server = make_server(idle_timeout=0.2)
+    writers = {name: FakeWriter() for name in ("gvard", "alice", "carol")}
+    for user_id, (name, writer) in enumerate(writers.items(), 1):
+        server._sessions[name] = ClientSession(user_id, datetime.now(), TEXT)
+        server._broadcaster.add(name, writer)
+    reaper = asyncio.create_task(server._reap_idle())
+
+    # alice keeps sending PINGs, the others go quiet
+    loop = asyncio.get_running_loop()
+    for _ in range(6):
+        server._sessions["alice"].last_seen = loop.time()
+        await asyncio.sleep(0.05)
+    reaper.cancel()
+
+    assert list(server._sessions) == ["alice"]
+    # dead peers are dropped without waiting to flush what is queued for them
+    assert writers["gvard"].transport.aborted and writers["carol"].transport.aborted
+    assert not writers["alice"].transport.aborted
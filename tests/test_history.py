@@ -0,0 +1,103 @@
+import json
+from datetime import datetime, timedelta
+
+from chatcmd.history import HistoryBuffer
+
+start = datetime(2023, 7, 19, 12, 0)
+
+
+def key(i: int):
+    return start + timedelta(seconds=i), 0
+
+
+def fill(history: HistoryBuffer, count: int):
+    for i in range(count):
+        history.append(key(i), f"gvard: message {i}")
+
+
+def test_page_inside_window():
+    history = HistoryBuffer(10)
+    fill(history, 10)
+
+    fragments, cursor = history.page(3, key(10))
+    assert [json.loads(f) for f in fragments] == [
+        f"gvard: message {i}" for i in (7, 8, 9)
+    ]
+    assert cursor == key(7)
+
+    fragments, cursor = history.page(3, cursor)
+    assert json.loads(fragments[0]) == "gvard: message 4"
+    assert history.stats() == {"size": 10, "hits": 2, "misses": 0}
+
+
+def test_short_page_is_final_while_complete():
+    history = HistoryBuffer(10)
+    fill(history, 4)
+
+    fragments, cursor = history.page(10, key(2))
+    assert len(fragments) == 2
+    assert cursor == key(0)
+
+    fragments, cursor = history.page(10, key(0))
+    assert fragments == []
+    assert cursor == key(0)
+
+
+def test_page_past_window_misses_after_eviction():
+    history = HistoryBuffer(5)
+    fill(history, 8)
+
+    assert len(history) == 5
+    assert history.page(2, key(8)) is not None
+    # messages 0-2 were evicted, so only the database can answer this
+    assert history.page(4, key(5)) is None
+    assert history.misses == 1
+
+
+def test_warm_from_database_rows():
+    history = HistoryBuffer(5)
+    history.warm([((start, 1), "gvard: hello")], complete=True)
+
+    fragments, cursor = history.page(5, key(1))
+    assert fragments == [json.dumps("gvard: hello").encode()]
+    assert cursor == (start, 1)
+
+
+def test_out_of_order_append_keeps_order():
+    history = HistoryBuffer(3)
+    history.append(key(0), "gvard: first")
+    history.append(key(2), "gvard: third")
+    # relayed from another worker after a newer local message
+    history.append(key(1), "alice: second")
+
+    fragments, _ = history.page(3, key(3))
+    assert [json.loads(f) for f in fragments] == [
+        "gvard: first",
+        "alice: second",
+        "gvard: third",
+    ]
+
+    history.append(key(4), "gvard: fifth")
+    history.append(key(3), "alice: fourth")
+    fragments, _ = history.page(3, key(5))
+    assert [json.loads(f) for f in fragments] == [
+        "gvard: third",
+        "alice: fourth",
+        "gvard: fifth",
+    ]
+
+
+def test_warm_keeps_messages_appended_meanwhile():
+    history = HistoryBuffer(10, complete=False)
+    # sent while the stored messages were being queried
+    history.append(key(2), "alice: during")
+    history.append(key(1), "gvard: stored")
+
+    history.warm([(key(0), "gvard: older"), (key(1), "gvard: stored")], complete=True)
+
+    fragments, _ = history.page(10, key(3))
+    assert [json.loads(f) for f in fragments] == [
+        "gvard: older",
+        "gvard: stored",
+        "alice: during",
+    ]
@@ -0,0 +1,64 @@
+import asyncio
+import pytest
+
+from chatcmd.metrics import Histogram, Registry, serve_metrics
+
+
+def test_render_exposition_format():
+    registry = Registry()
+    registry.counter("chat_connects_total", "Connects", result="login").inc(3)
+    registry.counter("chat_connects_total", "Connects", result="rejected").inc()
+    latency = registry.histogram("chat_seconds", "Latency", buckets=(0.1, 1))
+    latency.observe(0.05)
+    latency.observe(0.5)
+    latency.observe(2)
+    registry.collect("chat_clients", "Clients", lambda: 7)
+
+    assert registry.render().splitlines() == [
+        "# HELP chat_connects_total Connects",
+        "# TYPE chat_connects_total counter",
+        'chat_connects_total{result="login"} 3',
+        'chat_connects_total{result="rejected"} 1',
+        "# HELP chat_seconds Latency",
+        "# TYPE chat_seconds histogram",
+        'chat_seconds_bucket{le="0.1"} 1',
+        'chat_seconds_bucket{le="1"} 2',
+        'chat_seconds_bucket{le="+Inf"} 3',
+        "chat_seconds_sum 2.55",
+        "chat_seconds_count 3",
+        "# HELP chat_clients Clients",
+        "# TYPE chat_clients gauge",
+        "chat_clients 7",
+    ]
+
+
+def test_same_labels_return_the_same_metric():
+    registry = Registry()
+    histogram = Histogram()
+    registry.add("chat_seconds", "Latency", histogram, stage="db")
+
+    assert registry.histogram("chat_seconds", "Latency", stage="db") is histogram
+    with pytest.raises(ValueError):
+        registry.counter("chat_seconds", "Latency")
+
+
+@pytest.mark.asyncio
+async def test_serve_metrics():
+    registry = Registry()
+    registry.counter("chat_messages_total", "Messages").inc()
+    server = await serve_metrics(registry, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+
+    async def get(path: str) -> bytes:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+        response = await reader.read()
+        writer.close()
+        return response
+
+    response = await get("/metrics")
+    assert response.startswith(b"HTTP/1.1 200 OK\r\n")
+    assert response.endswith(b"\r\n\r\n" + registry.render().encode())
+    assert (await get("/")).startswith(b"HTTP/1.1 404 Not Found\r\n")
+    server.close()
+    await server.wait_closed()
@@ -0,0 +1,164 @@
+import asyncio
+import pytest
+from datetime import datetime
+from sqlalchemy import select
+
+from chatcmd.db.models import Message
+from chatcmd.db.persister import MessagePersister
+
+from .database import LocalDatabase, SQLALCHEMY_DATABASE_URL
+from .factories import UserFactory
+
+
+class CountingDatabase(LocalDatabase):
+    def __init__(self, database_url: str):
+        super().__init__(database_url)
+        self.batches: list[int] = []
+
+    async def add_messages(self, rows: list[dict]):
+        self.batches.append(len(rows))
+        await super().add_messages(rows)
+
+
+async def prepare_db():
+    db = CountingDatabase(SQLALCHEMY_DATABASE_URL)
+    await db.recreate_tables()
+    test_session = db.get_test_session()
+    UserFactory.set_session(test_session)
+    user = UserFactory.create(name="gvard")
+    await test_session.commit()
+    return db, test_session, user
+
+
+@pytest.mark.asyncio
+async def test_messages_are_written_in_batches():
+    db, test_session, user = await prepare_db()
+    persister = MessagePersister(db, batch_size=10, flush_interval=5)
+    persister.start()
+
+    for i in range(25):
+        await persister.put(user.id, f"message {i}", datetime.now())
+    await asyncio.sleep(0.1)
+
+    # two full batches went out without waiting for the flush interval
+    assert db.batches == [10, 10]
+
+    await persister.close()
+    assert db.batches == [10, 10, 5]
+
+    messages = await test_session.execute(select(Message).order_by(Message.id))
+    assert [m.text for m in messages.scalars()] == [f"message {i}" for i in range(25)]
+
+    await test_session.close()
+
+
+@pytest.mark.asyncio
+async def test_partial_batch_flushed_after_interval():
+    db, test_session, user = await prepare_db()
+    persister = MessagePersister(db, batch_size=100, flush_interval=0.05)
+    persister.start()
+
+    await persister.put(user.id, "hello", datetime.now())
+    await asyncio.sleep(0.3)
+    assert db.batches == [1]
+
+    await persister.close()
+    await test_session.close()
+
+
+@pytest.mark.asyncio
+async def test_put_waits_when_queue_is_full():
+    db, test_session, user = await prepare_db()
+    persister = MessagePersister(db, batch_size=10, max_queue=2)
+
+    await persister.put(user.id, "first", datetime.now())
+    await persister.put(user.id, "second", datetime.now())
+    blocked = asyncio.create_task(persister.put(user.id, "third", datetime.now()))
+    await asyncio.sleep(0.05)
+    assert not blocked.done()
+
+    persister.start()
+    await asyncio.wait_for(blocked, 1)
+    await persister.close()
+    assert sum(db.batches) == 3
+
+    await test_session.close()
+
+
+@pytest.mark.asyncio
+async def test_close_keeps_puts_waiting_for_room():
+    db, test_session, user = await prepare_db()
+    persister = MessagePersister(db, batch_size=10, flush_interval=5, max_queue=2)
+    persister.start()
+    # stall the writer, so the queue fills up and the last put has to wait
+    stalled = asyncio.Event()
+    add_messages = db.add_messages
+
+    async def stalled_add_messages(rows: list[dict]):
+        await stalled.wait()
+        await add_messages(rows)
+
+    db.add_messages = stalled_add_messages
+    await persister.put(user.id, "first", datetime.now())
+    await asyncio.sleep(0)
+    await persister.put(user.id, "second", datetime.now())
+    await persister.put(user.id, "third", datetime.now())
+    blocked = asyncio.create_task(persister.put(user.id, "fourth", datetime.now()))
+    await asyncio.sleep(0.05)
+    assert not blocked.done()
+
+    closing = asyncio.create_task(persister.close())
+    await asyncio.sleep(0)
+    with pytest.raises(RuntimeError):
+        await persister.put(user.id, "too late", datetime.now())
+    stalled.set()
+    await asyncio.wait_for(closing, 1)
+    await blocked
+
+    messages = await test_session.execute(select(Message).order_by(Message.id))
+    assert [m.text for m in messages.scalars()] == [
+        "first",
+        "second",
+        "third",
+        "fourth",
+    ]
+
+    await test_session.close()
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_is_retried_then_counted():
+    db, test_session, user = await prepare_db()
+    persister = MessagePersister(db, batch_size=10, retries=2, retry_delay=0.01)
+    persister.start()
+    add_messages = db.add_messages
+    failures = 1
+
+    async def flaky_add_messages(rows: list[dict]):
+        nonlocal failures
+        if failures:
+            failures -= 1
+            raise ConnectionError("database went away")
+        await add_messages(rows)
+
+    db.add_messages = flaky_add_messages
+    await persister.put(user.id, "kept", datetime.now())
+    await persister.close()
+    assert persister.retried == 1
+    assert persister.failed == 0
+
+    async def broken_add_messages(rows: list[dict]):
+        raise ConnectionError("database went away")
+
+    db.add_messages = broken_add_messages
+    persister = MessagePersister(db, batch_size=10, retries=2, retry_delay=0.01)
+    persister.start()
+    await persister.put(user.id, "lost", datetime.now())
+    await persister.close()
+    assert persister.retried == 2
+    assert persister.failed == 1
+
+    messages = await test_session.execute(select(Message.text))
+    assert list(messages.scalars()) == ["kept"]
+
+    await test_session.close()
@@ -0,0 +1,72 @@
+import asyncio
+import logging
+import time
+import pytest
+
+from chatcmd.profiling import Profiler
+
+
+class Handlers:
+    async def work(self, busy: float, idle: float) -> str:
+        deadline = time.thread_time() + busy
+        while time.thread_time() < deadline:
+            pass
+        await asyncio.sleep(idle)
+        return "done"
+
+    async def fail(self):
+        await asyncio.sleep(0)
+        raise ValueError("bad command")
+
+
+@pytest.mark.asyncio
+async def test_instrumented_handlers_record_wall_and_cpu_time():
+    profiler = Profiler()
+    handlers = Handlers()
+    profiler.instrument(handlers, ["work", "fail"])
+
+    assert await handlers.work(0.02, 0.05) == "done"
+    with pytest.raises(ValueError):
+        await handlers.fail()
+
+    work = profiler.handlers["work"]
+    assert work.calls == 1
+    assert work.wall >= 0.07
+    # the sleep is waiting, not CPU
+    assert 0.015 < work.cpu < 0.05
+    assert profiler.handlers["fail"].calls == 1
+    # other instances keep their plain methods
+    assert Handlers().work.__func__ is Handlers.work
+
+
+@pytest.mark.asyncio
+async def test_blocked_event_loop_is_reported_with_its_stack(caplog):
+    profiler = Profiler(slow_callback=0.05)
+    profiler.start()
+    await asyncio.sleep(0.02)
+    with caplog.at_level(logging.WARNING):
+        time.sleep(0.2)
+        await asyncio.sleep(0.02)
+    profiler.stop()
+
+    assert profiler.stalls == 1
+    assert "test_blocked_event_loop_is_reported_with_its_stack" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_sampled_stacks_are_written_collapsed(tmp_path):
+    profiler = Profiler(interval=0.001, duration=0.1, directory=str(tmp_path))
+    profiler.start()
+    profiler.sample()
+    deadline = time.monotonic() + 0.3
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0)
+    await asyncio.sleep(0.1)
+    profiler.stop()
+
+    (path,) = tmp_path.iterdir()
+    lines = path.read_text().splitlines()
+    assert lines
+    stack, count = lines[0].rsplit(" ", 1)
+    assert int(count) > 0
+    assert "test_sampled_stacks_are_written_collapsed" in path.read_text()
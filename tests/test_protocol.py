@@ -0,0 +1,155 @@
+import asyncio
+import pytest
+
+from chatcmd.frames import (
+    chat_frame,
+    pack_fragment,
+    pack_frame,
+    results_frame,
+    text_frame,
+)
+from chatcmd.protocol import TEXT, FramedCodec, Kind, ProtocolError, negotiate
+
+
+def reader_with(*chunks: bytes) -> asyncio.StreamReader:
+    reader = asyncio.StreamReader()
+    for chunk in chunks:
+        reader.feed_data(chunk)
+    reader.feed_eof()
+    return reader
+
+
+@pytest.mark.asyncio
+async def test_text_commands():
+    reader = reader_with(
+        b"hello\n", b"\\LOAD 20 abc\n", TEXT.encode(Kind.PING), b"\\q\n"
+    )
+
+    assert await TEXT.read_command(reader) == (Kind.MESSAGE, "hello\n", None)
+    assert await TEXT.read_command(reader) == (Kind.LOAD, "20 abc", None)
+    assert await TEXT.read_command(reader) == (Kind.PING, "", None)
+    assert await TEXT.read_command(reader) == (Kind.QUIT, "", None)
+    assert await TEXT.read_command(reader) is None
+
+
+@pytest.mark.asyncio
+async def test_text_sequence_numbers():
+    reader = reader_with(
+        TEXT.encode(Kind.MESSAGE, "hello\n", 7),
+        TEXT.encode(Kind.LOAD, "20 abc", 8),
+        TEXT.encode(Kind.QUIT, seq=9),
+        TEXT.encode(Kind.ACK, 7),
+    )
+
+    assert await TEXT.read_command(reader) == (Kind.MESSAGE, "hello\n", 7)
+    assert await TEXT.read_command(reader) == (Kind.LOAD, "20 abc", 8)
+    assert await TEXT.read_command(reader) == (Kind.QUIT, "", 9)
+    assert await TEXT.read_event(reader) == (Kind.ACK, 7)
+
+
+@pytest.mark.asyncio
+async def test_text_resume_tokens():
+    reader = reader_with(
+        TEXT.encode(Kind.TOKEN, seq=3), TEXT.encode(Kind.RESUME, "a.b")
+    )
+
+    assert await TEXT.read_command(reader) == (Kind.TOKEN, "", 3)
+    assert await TEXT.read_event(reader) == (Kind.RESUME, "a.b")
+
+
+@pytest.mark.asyncio
+async def test_text_rooms():
+    reader = reader_with(
+        TEXT.encode(Kind.JOIN, "games", 1),
+        TEXT.encode(Kind.PART, seq=2),
+        TEXT.encode(Kind.ROOM, "games"),
+    )
+
+    assert await TEXT.read_command(reader) == (Kind.JOIN, "games", 1)
+    assert await TEXT.read_command(reader) == (Kind.PART, "", 2)
+    assert await TEXT.read_event(reader) == (Kind.ROOM, "games")
+
+
+@pytest.mark.asyncio
+async def test_text_direct_messages():
+    reader = reader_with(
+        TEXT.encode(Kind.DIRECT, "alice hi there\n", 1),
+        TEXT.encode(Kind.CONVERSATION, "alice 10", 2),
+    )
+
+    assert await TEXT.read_command(reader) == (Kind.DIRECT, "alice hi there\n", 1)
+    assert await TEXT.read_command(reader) == (Kind.CONVERSATION, "alice 10", 2)
+
+
+@pytest.mark.asyncio
+async def test_text_search():
+    lines = ["[2026-10-18 12:00] gvard: hello\n"]
+    reader = reader_with(
+        TEXT.encode(Kind.SEARCH, "- hello world", 1),
+        results_frame("abc", [pack_fragment(line) for line in lines]).encode(TEXT),
+    )
+
+    assert await TEXT.read_command(reader) == (Kind.SEARCH, "- hello world", 1)
+    assert await TEXT.read_event(reader) == (Kind.RESULTS, ("abc", lines))
+
+
+@pytest.mark.asyncio
+async def test_text_chat_lines_carry_their_cursor():
+    reader = reader_with(chat_frame("abc=", "gvard: hi there\n").encode(TEXT))
+
+    assert await TEXT.read_event(reader) == (Kind.CHAT, ("abc=", "gvard: hi there\n"))
+
+
+@pytest.mark.asyncio
+async def test_text_events_do_not_misroute_ack():
+    reader = reader_with(b"gvard: what does \\ACK mean?\n", b"\\ACK\n")
+
+    assert await TEXT.read_event(reader) == (
+        Kind.TEXT,
+        "gvard: what does \\ACK mean?\n",
+    )
+    assert await TEXT.read_event(reader) == (Kind.ACK, None)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("requested", ["framed", "framed-msgpack"])
+async def test_framed_round_trip(requested):
+    codec = negotiate(requested)
+    lines = ["gvard: multi\nline\n", "alice: \\ACK\n"]
+    reader = reader_with(
+        text_frame("gvard: hello\n").encode(codec),
+        pack_frame("abc", [pack_fragment(line) for line in lines]).encode(codec),
+        codec.encode(Kind.ACK),
+        codec.encode(Kind.MESSAGE, "hi\n"),
+        codec.encode(Kind.MESSAGE, "again\n", 2**32 - 1),
+        codec.encode(Kind.ACK, 3),
+        codec.encode(Kind.PING),
+        results_frame("def", [pack_fragment(lines[0])]).encode(codec),
+        codec.encode(Kind.SEARCH, "- hello", 4),
+        chat_frame("abc=", lines[0]).encode(codec),
+    )
+
+    assert await codec.read_event(reader) == (Kind.TEXT, "gvard: hello\n")
+    assert await codec.read_event(reader) == (Kind.PACK, ("abc", lines))
+    assert await codec.read_event(reader) == (Kind.ACK, None)
+    assert await codec.read_command(reader) == (Kind.MESSAGE, "hi\n", None)
+    assert await codec.read_command(reader) == (Kind.MESSAGE, "again\n", 2**32 - 1)
+    assert await codec.read_event(reader) == (Kind.ACK, 3)
+    assert await codec.read_command(reader) == (Kind.PING, "", None)
+    assert await codec.read_event(reader) == (Kind.RESULTS, ("def", lines[:1]))
+    assert await codec.read_command(reader) == (Kind.SEARCH, "- hello", 4)
+    assert await codec.read_event(reader) == (Kind.CHAT, ("abc=", lines[0]))
+    assert await codec.read_command(reader) is None
+
+
+@pytest.mark.asyncio
+async def test_framed_rejects_oversized_frames():
+    codec = FramedCodec()
+    reader = reader_with(codec.header.pack(Kind.MESSAGE, codec.max_payload + 1))
+
+    with pytest.raises(ProtocolError):
+        await codec.read_command(reader)
+
+
+def test_unknown_protocol_falls_back_to_text():
+    assert negotiate("carrier-pigeon") is TEXT
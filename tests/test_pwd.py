@@ -0,0 +1,44 @@
+import asyncio
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+
+from chatcmd.db.pwd import PasswordHasher, verify_password
+
+
+@pytest.mark.asyncio
+async def test_hash_and_verify_in_process_pool():
+    hasher = PasswordHasher()
+    pwd_hash = await hasher.hash("abc123!@#")
+
+    assert verify_password("abc123!@#", pwd_hash)
+    assert await hasher.verify("abc123!@#", pwd_hash)
+    assert not await hasher.verify("wrong", pwd_hash)
+
+    hasher.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_concurrency_is_capped():
+    in_flight = 0
+    peak = 0
+
+    class TrackingExecutor(ThreadPoolExecutor):
+        def submit(self, fn, *args, **kwargs):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            future = super().submit(fn, *args, **kwargs)
+
+            def done(_):
+                nonlocal in_flight
+                in_flight -= 1
+
+            future.add_done_callback(done)
+            return future
+
+    hasher = PasswordHasher(TrackingExecutor(max_workers=8), max_concurrency=2)
+    await asyncio.gather(*(hasher.hash("abc123!@#") for _ in range(6)))
+
+    assert peak <= 2
+
+    hasher.shutdown()
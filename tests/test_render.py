@@ -0,0 +1,53 @@
+import asyncio
+import os
+import pytest
+
+from chatcmd import render
+from chatcmd.render import TerminalRenderer
+from chatcmd.store import MessageStore
+
+
+def start_renderer(monkeypatch, capsys) -> tuple[TerminalRenderer, MessageStore]:
+    monkeypatch.setattr(
+        render.shutil, "get_terminal_size", lambda: os.terminal_size((80, 10))
+    )
+    store = None
+    renderer = TerminalRenderer(lambda rows: store.visible(rows), refresh_interval=0.01)
+    store = MessageStore(renderer.appended, renderer.redraw)
+    renderer.start()
+    capsys.readouterr()
+    return renderer, store
+
+
+@pytest.mark.asyncio
+async def test_burst_is_written_in_one_frame(monkeypatch, capsys):
+    renderer, store = start_renderer(monkeypatch, capsys)
+    for i in range(3):
+        await store.append(f"gvard: message {i}\n")
+    assert capsys.readouterr().out == ""
+
+    await asyncio.sleep(0.05)
+    out = capsys.readouterr().out
+    # new lines scroll the region from its bottom row, nothing is redrawn
+    assert out.count("\033[9;1H") == 1
+    assert "\033[2K" not in out
+    assert out.split("\n")[1:] == [
+        "gvard: message 0",
+        "gvard: message 1",
+        "gvard: message 2\0338",
+    ]
+    renderer.stop()
+
+
+@pytest.mark.asyncio
+async def test_prepend_redraws_only_the_viewport(monkeypatch, capsys):
+    renderer, store = start_renderer(monkeypatch, capsys)
+    await store.prepend([f"gvard: message {i}\n" for i in range(100)], "cursor")
+    await asyncio.sleep(0.05)
+
+    out = capsys.readouterr().out
+    assert out.count("\033[2K") == 9
+    assert "gvard: message 90\n" not in out
+    assert "gvard: message 91\n" in out
+    assert "gvard: message 99" in out
+    renderer.stop()
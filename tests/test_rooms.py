@@ -0,0 +1,135 @@
+import asyncio
+import pytest
+from datetime import datetime
+
+from chatcmd.db.db_queries import encode_cursor
+from chatcmd.db.models import GENERAL_ROOM
+from chatcmd.protocol import TEXT, Kind
+from chatcmd.server import ChatServer, ClientSession
+
+from .test_broadcast import FakeWriter
+
+
+async def connect_users(server: ChatServer, *names: str) -> dict[str, FakeWriter]:
+    await server._db.recreate_tables()
+    writers = {}
+    for name in names:
+        user = await server._db.add_user(name, "abc123!@#")
+        server._sessions[name] = ClientSession(user.id, datetime.now(), TEXT)
+        server._rooms[GENERAL_ROOM].add(name)
+        server._broadcaster.add(name, writers.setdefault(name, FakeWriter()))
+    return writers
+
+
+# Everything a client was sent, decoded as its text protocol reader would.
+async def events(writer: FakeWriter) -> list[tuple[Kind, object]]:
+    await asyncio.sleep(0.01)
+    reader = asyncio.StreamReader()
+    reader.feed_data(b"".join(writer.data))
+    reader.feed_eof()
+    writer.data.clear()
+    received = []
+    while event := await TEXT.read_event(reader):
+        kind, payload = event
+        # the cursor of a chat line is opaque to the tests
+        received.append((Kind.TEXT, payload[1]) if kind == Kind.CHAT else event)
+    return received
+
+
+@pytest.mark.asyncio
+async def test_room_messages_only_reach_members(make_server):
+    server = make_server()
+    writers = {name: FakeWriter() for name in ("gvard", "alice", "carol")}
+    for name, writer in writers.items():
+        server._broadcaster.add(name, writer)
+    server._rooms[GENERAL_ROOM].update(("gvard", "alice"))
+    server._rooms["games"] = {"carol"}
+
+    await server._notify_room("games", "carol: hi\n")
+    await asyncio.sleep(0.01)
+
+    assert writers["carol"].data == [b"carol: hi\n"]
+    assert writers["gvard"].data == writers["alice"].data == []
+
+
+@pytest.mark.asyncio
+async def test_room_frame_precedes_the_new_rooms_traffic(make_server):
+    server = make_server()
+    writers = await connect_users(server, "gvard", "alice", "carol")
+    await server._process_message("alice", Kind.JOIN, "games")
+    for writer in writers.values():
+        await events(writer)
+
+    await server._process_message("gvard", Kind.JOIN, "games", 1)
+    await server._process_message("alice", Kind.MESSAGE, "hi gvard\n")
+
+    assert await events(writers["gvard"]) == [
+        (Kind.ROOM, "games"),
+        (Kind.ACK, 1),
+        (Kind.TEXT, "gvard joined #games\n"),
+        (Kind.TEXT, "alice: hi gvard\n"),
+    ]
+    assert await events(writers["carol"]) == [(Kind.TEXT, "gvard left #general\n")]
+    assert server._sessions["gvard"].room == "games"
+    assert server._rooms == {GENERAL_ROOM: {"carol"}, "games": {"gvard", "alice"}}
+
+
+@pytest.mark.asyncio
+async def test_load_only_pages_the_current_room(make_server):
+    server = make_server()
+    writers = await connect_users(server, "gvard", "alice")
+    await server._process_message("alice", Kind.MESSAGE, "in general\n")
+    await server._process_message("gvard", Kind.JOIN, "games")
+    await server._process_message("gvard", Kind.MESSAGE, "in games\n")
+    await events(writers["gvard"])
+
+    # without a cursor, history starts from the moment gvard joined #games
+    await server._process_message("gvard", Kind.LOAD, "10", 1)
+    latest = encode_cursor((datetime.now(), 0))
+    await server._process_message("gvard", Kind.LOAD, f"10 {latest}", 2)
+
+    received = await events(writers["gvard"])
+    assert [payload[1] for kind, payload in received if kind == Kind.PACK] == [
+        [],
+        ["gvard: in games\n"],
+    ]
+    assert set(server._histories) == {GENERAL_ROOM, "games"}
+
+
+@pytest.mark.asyncio
+async def test_part_returns_to_general_and_drops_the_empty_room(make_server):
+    server = make_server()
+    writers = await connect_users(server, "gvard", "alice")
+    await server._process_message("gvard", Kind.JOIN, "games")
+    await events(writers["gvard"])
+    await events(writers["alice"])
+
+    await server._process_message("gvard", Kind.PART, "", 2)
+    await server._process_message("gvard", Kind.PART, "", 3)
+
+    assert await events(writers["gvard"]) == [
+        (Kind.ROOM, GENERAL_ROOM),
+        (Kind.ACK, 2),
+        (Kind.TEXT, "gvard joined #general\n"),
+        (Kind.ACK, 3),
+        (Kind.TEXT, f"Already in #{GENERAL_ROOM}.\n"),
+    ]
+    assert await events(writers["alice"]) == [(Kind.TEXT, "gvard joined #general\n")]
+    assert server._sessions["gvard"].room == GENERAL_ROOM
+    assert "games" not in server._rooms
+
+
+@pytest.mark.asyncio
+async def test_history_buffers_of_empty_rooms_are_evicted(make_server):
+    server = make_server(room_buffers=2)
+    await connect_users(server, "gvard", "alice")
+    await server._process_message("gvard", Kind.JOIN, "games")
+    await server._process_message("alice", Kind.JOIN, "music")
+    # nobody is in #general yet, but gvard is joining it
+    await server._process_message("gvard", Kind.PART, "")
+    assert list(server._histories) == ["games", "music", GENERAL_ROOM]
+
+    await server._process_message("alice", Kind.JOIN, "chess")
+
+    # only the least recently used empty room goes; alice is still in #music
+    assert list(server._histories) == ["music", GENERAL_ROOM, "chess"]
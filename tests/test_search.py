@@ -0,0 +1,91 @@
+import asyncio
+import json
+import pytest
+from datetime import datetime
+
+from chatcmd import server as server_module
+from chatcmd.db.db_queries import decode_search_cursor, encode_search_cursor
+from chatcmd.protocol import TEXT
+from chatcmd.server import ClientSession
+
+from .database import LocalDatabase
+from .test_broadcast import FakeWriter
+
+
+async def prepare_db(db: LocalDatabase, *texts: str) -> int:
+    await db.recreate_tables()
+    user = await db.add_user("gvard", "abc123!@#")
+    for text in texts:
+        await db.add_message(user.id, text)
+    return user.id
+
+
+@pytest.mark.asyncio
+async def test_search_ranks_and_pages(make_server):
+    db = make_server()._db
+    await prepare_db(
+        db,
+        "hello world\n",
+        "hello there, hello again\n",
+        "the cats are running\n",
+        "a cat runs\n",
+        "nothing to see\n",
+    )
+
+    results = await db.search_messages("hello", 1)
+    assert [m.text for m, _ in results] == ["hello there, hello again\n"]
+    assert results[0][0].user.name == "gvard"
+    last, score = results[0]
+    cursor = decode_search_cursor(encode_search_cursor((score, last.id)))
+    results = await db.search_messages("hello", 10, cursor)
+    assert [m.text for m, _ in results] == ["hello world\n"]
+
+    # words are stemmed, and every word must match
+    assert len(await db.search_messages("running cat", 10)) == 2
+    assert await db.search_messages("hello cats", 10) == []
+
+
+@pytest.mark.asyncio
+async def test_search_covers_one_room_and_any_input(make_server):
+    db = make_server()._db
+    user_id = await prepare_db(db, "hello from general\n")
+    games = await db.get_room_id("games")
+    await db.add_message(user_id, "hello from games\n", games)
+
+    results = await db.search_messages("hello", 10, room_id=games)
+    assert [m.text for m, _ in results] == ["hello from games\n"]
+    # FTS5 query syntax in the terms is matched literally, never an error
+    for terms in ['"hello', "hello AND", "NEAR(", "*", "!!!"]:
+        await db.search_messages(terms, 10)
+
+
+@pytest.mark.asyncio
+async def test_search_command_sends_result_pages(monkeypatch, make_server):
+    monkeypatch.setattr(server_module, "SEARCH_PAGE", 2)
+    server = make_server()
+    user_id = await prepare_db(
+        server._db, "hello one\n", "hello two\n", "hello three\n", "bye\n"
+    )
+    writer = FakeWriter()
+    server._sessions["gvard"] = ClientSession(user_id, datetime.now(), TEXT)
+    server._broadcaster.add("gvard", writer)
+
+    async def search(payload: str) -> tuple[str, list[str]]:
+        writer.data.clear()
+        await server._send_search_results("gvard", payload)
+        await asyncio.sleep(0.01)
+        _, cursor, results = writer.data[0].decode().split(" ", 2)
+        return cursor, json.loads(results)
+
+    cursor, first = await search("- hello")
+    cursor, second = await search(f"{cursor} hello")
+    _, third = await search(f"{cursor} hello")
+    assert len(first) == 2 and len(second) == 1 and third == []
+    lines = sorted(line.split("] ", 1)[1] for line in first + second)
+    assert lines == ["gvard: hello one\n", "gvard: hello three\n", "gvard: hello two\n"]
+
+    for payload in ["-", "- ", "bad-cursor hello"]:
+        writer.data.clear()
+        await server._send_search_results("gvard", payload)
+        await asyncio.sleep(0.01)
+        assert writer.data == [b"Usage: \\SEARCH <terms>\n"]
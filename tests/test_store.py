@@ -0,0 +1,141 @@
+import json
+import pytest
+from datetime import datetime, timedelta
+
+from chatcmd.db.db_queries import decode_cursor, encode_cursor
+from chatcmd.history import HistoryBuffer
+from chatcmd.store import MessageStore
+
+
+class Recorder:
+    def __init__(self):
+        self.appended: list[str] = []
+        self.redraws = 0
+
+    def append(self, message: str):
+        self.appended.append(message)
+
+    def redraw(self):
+        self.redraws += 1
+
+
+def page(start: int, end: int) -> list[str]:
+    return [f"gvard: message {i}\n" for i in range(start, end)]
+
+
+@pytest.mark.asyncio
+async def test_history_pages_are_prepended_with_their_cursor():
+    recorder = Recorder()
+    store = MessageStore(recorder.append, recorder.redraw)
+    await store.append("alice connected!\n")
+    assert store.history_cursor is None
+
+    await store.prepend(page(10, 20), "cursor-10")
+    await store.prepend(page(0, 10), "cursor-0")
+
+    assert len(store) == 21
+    assert store.history_cursor == "cursor-0"
+    assert store.visible(3) == [
+        "gvard: message 18\n",
+        "gvard: message 19\n",
+        "alice connected!\n",
+    ]
+    assert recorder.redraws == 2
+
+    await store.prepend([], "cursor-0")
+    assert store.history_complete
+
+
+@pytest.mark.asyncio
+async def test_oldest_page_is_evicted_and_loaded_again():
+    store = MessageStore(Recorder().append, Recorder().redraw, capacity=25)
+    await store.prepend(page(10, 20), "cursor-10")
+    await store.prepend(page(0, 10), "cursor-0")
+
+    # while following new messages the whole oldest page goes, and the next \LOAD asks
+    # for it again
+    for i in range(10):
+        await store.append(f"alice: live {i}\n")
+    assert len(store) == 20
+    assert store.history_cursor == "cursor-10"
+    assert store.visible(25)[0] == "gvard: message 10\n"
+
+
+@pytest.mark.asyncio
+async def test_scrolling_back_past_capacity_keeps_the_loaded_pages():
+    history = HistoryBuffer()
+    start = datetime(2026, 10, 18, 12)
+    keys = [(start + timedelta(seconds=i), 0) for i in range(301)]
+    for key, line in zip(keys, page(0, 301)):
+        history.append(key, line)
+
+    recorder = Recorder()
+    store = MessageStore(recorder.append, recorder.redraw, capacity=100)
+    for i in range(190, 300):
+        await store.append(page(i, i + 1)[0], encode_cursor(keys[i]))
+    assert store.history_cursor == encode_cursor(keys[200])
+    recorder.appended.clear()
+    assert store.scroll(100, rows=10)
+
+    for oldest in (180, 160, 140):
+        fragments, before = history.page(20, decode_cursor(store.history_cursor))
+        await store.prepend([json.loads(f) for f in fragments], encode_cursor(before))
+        # the newest messages make room, so each \LOAD pages further back
+        assert len(store) == 100
+        assert store.history_cursor == encode_cursor(keys[oldest])
+        assert store.scroll(20, rows=10)
+        assert store.visible(10) == page(oldest, oldest + 10)
+
+    # live messages wait until the user comes back down
+    await store.append(page(300, 301)[0], encode_cursor(keys[300]))
+    assert store.visible(10) == page(140, 150)
+    assert recorder.appended == []
+
+    assert store.scroll(-1000, rows=10)
+    assert store.following
+    assert store.visible(10) == page(300, 301)
+    fragments, _ = history.page(20, decode_cursor(store.history_cursor))
+    await store.prepend([json.loads(f) for f in fragments], "cursor-280")
+    assert store.visible(21) == page(280, 301)
+
+
+@pytest.mark.asyncio
+async def test_viewport_stays_put_while_scrolled_back():
+    recorder = Recorder()
+    store = MessageStore(recorder.append, recorder.redraw)
+    await store.prepend(page(0, 10), "cursor-0")
+
+    assert not store.scroll(3, rows=4)
+    assert store.visible(4) == page(3, 7)
+
+    await store.append("alice: new\n")
+    assert store.visible(4) == page(3, 7)
+    # new messages are not drawn while the user reads back
+    assert recorder.appended == []
+
+    # reaching the oldest message asks for more history
+    assert store.scroll(10, rows=4)
+    assert store.visible(4) == page(0, 4)
+
+    store.scroll(-100, rows=4)
+    assert store.following
+    assert store.visible(2) == ["gvard: message 9\n", "alice: new\n"]
+
+
+@pytest.mark.asyncio
+async def test_evicted_live_messages_are_paged_back():
+    # the server's view of the room: every message keyed like a live broadcast
+    history = HistoryBuffer()
+    start = datetime(2026, 10, 18, 12)
+    store = MessageStore(Recorder().append, Recorder().redraw, capacity=20)
+    await store.append("gvard joined #general\n")
+    for i, line in enumerate(page(0, 30)):
+        key = (start + timedelta(seconds=i), 0)
+        history.append(key, line)
+        await store.append(line, encode_cursor(key))
+
+    assert store.visible(20) == page(10, 30)
+    assert store.history_cursor == encode_cursor((start + timedelta(seconds=10), 0))
+
+    fragments, _ = history.page(10, decode_cursor(store.history_cursor))
+    assert [json.loads(f) for f in fragments] + store.visible(20) == page(0, 30)
@@ -1,5 +1,9 @@
 import pytest
-from chatcmd.validators import validate_password, validate_username
+from chatcmd.validators import (
+    validate_password,
+    validate_room_name,
+    validate_username,
+)
 
 
 @pytest.mark.parametrize(
@@ -16,3 +20,17 @@ def test_password_validator(input, expected):
 )
 def test_name_validator(input, expected):
     assert validate_username(input) == expected
+
+
+@pytest.mark.parametrize(
+    "input, expected",
+    [
+        ("games", True),
+        ("rust-lang_2", True),
+        ("Games", False),
+        ("", False),
+        ("a b", False),
+    ],
+)
+def test_room_name_validator(input, expected):
+    assert validate_room_name(input) == expected